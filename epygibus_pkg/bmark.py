@@ -40,7 +40,8 @@ class OsTimes(collections.namedtuple("OsTimes", ["utime", "stime", "cutime", "cs
     def __add__(self, other):
         return OsTimes(*(self[i] + other[i] for i in range(len(self))))
     def get_etd(self):
-        cpu_time = self.utime + self.stime
+        # NB: include the time used by child (e.g. worker) processes
+        cpu_time = self.utime + self.stime + self.cutime + self.cstime
         return ETD(cpu_time, self.rtime, max(self.rtime - cpu_time, 0))
 
 def get_os_times():
@@ -0,0 +1,548 @@
+### Copyright (C) 2016 Peter Williams <pwil3058@gmail.com>
+###
+### This program is free software; you can redistribute it and/or modify
+### it under the terms of the GNU General Public License as published by
+### the Free Software Foundation; version 2 of the License only.
+###
+### This program is distributed in the hope that it will be useful,
+### but WITHOUT ANY WARRANTY; without even the implied warranty of
+### MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+### GNU General Public License for more details.
+###
+### You should have received a copy of the GNU General Public License
+### along with this program; if not, write to the Free Software
+### Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+"""Persistent index of a content repository's content items (and their
+reference counts) that supports point lookups, in place updates and
+range scans without the need to load the whole index into memory."""
+
+import array
+import collections
+import os
+import sqlite3
+import time
+
+FORMAT_VERSION = 6
+
+# NB: a codec of None means that it wasn't recorded (i.e. gzip or none)
+# and a pack of None means that the item is stored in its own file
+CItem = collections.namedtuple("CItem", ["ref_count", "content_size", "stored_size", "chunked", "codec", "pack", "pack_offset"])
+
+# NB: the changes a session has made to the index's counts (so far)
+SessionCounts = collections.namedtuple("SessionCounts", ["created", "referenced", "unreferenced", "references"])
+
+_SCHEMA = [
+    "CREATE TABLE meta (key TEXT PRIMARY KEY, value) WITHOUT ROWID",
+    "CREATE TABLE citems (token TEXT PRIMARY KEY, ref_count INTEGER NOT NULL, content_size INTEGER NOT NULL, stored_size INTEGER NOT NULL, chunked INTEGER NOT NULL DEFAULT 0, codec TEXT, pack INTEGER, pack_offset INTEGER) WITHOUT ROWID",
+    # NB: partial index so that finding prune candidates doesn't require a full scan
+    "CREATE INDEX unreferenced ON citems(token) WHERE ref_count = 0",
+]
+
+# NB: totals of the items (by whether they're referenced and their codec
+# with "" standing in for an unrecorded codec) kept current by triggers
+# so that repository statistics don't require a full scan and changes
+# by concurrent sessions are all accounted for.  A chunked item's content
+# is held by its chunks so it's only counted once (via them).
+_TOTALS_SCHEMA = [
+    "CREATE TABLE totals (referenced INTEGER NOT NULL, codec TEXT NOT NULL, items INTEGER NOT NULL, refs INTEGER NOT NULL, content_bytes INTEGER NOT NULL, stored_bytes INTEGER NOT NULL, PRIMARY KEY (referenced, codec)) WITHOUT ROWID",
+    """CREATE TRIGGER totals_insert AFTER INSERT ON citems BEGIN
+        INSERT OR IGNORE INTO totals VALUES (NEW.ref_count > 0, IFNULL(NEW.codec, ''), 0, 0, 0, 0);
+        UPDATE totals SET items = items + 1, refs = refs + NEW.ref_count, content_bytes = content_bytes + (NOT NEW.chunked) * NEW.content_size, stored_bytes = stored_bytes + NEW.stored_size WHERE referenced = (NEW.ref_count > 0) AND codec = IFNULL(NEW.codec, '');
+    END""",
+    """CREATE TRIGGER totals_delete AFTER DELETE ON citems BEGIN
+        UPDATE totals SET items = items - 1, refs = refs - OLD.ref_count, content_bytes = content_bytes - (NOT OLD.chunked) * OLD.content_size, stored_bytes = stored_bytes - OLD.stored_size WHERE referenced = (OLD.ref_count > 0) AND codec = IFNULL(OLD.codec, '');
+    END""",
+    # NB: the usual update (a change of reference count that doesn't
+    # change whether the item is referenced) only has one total to adjust
+    """CREATE TRIGGER totals_update_refs AFTER UPDATE OF ref_count, content_size, stored_size, codec ON citems
+    WHEN (OLD.ref_count > 0) = (NEW.ref_count > 0) AND OLD.content_size = NEW.content_size AND OLD.stored_size = NEW.stored_size AND OLD.codec IS NEW.codec BEGIN
+        UPDATE totals SET refs = refs + NEW.ref_count - OLD.ref_count WHERE referenced = (NEW.ref_count > 0) AND codec = IFNULL(NEW.codec, '');
+    END""",
+    """CREATE TRIGGER totals_update AFTER UPDATE OF ref_count, content_size, stored_size, codec ON citems
+    WHEN NOT ((OLD.ref_count > 0) = (NEW.ref_count > 0) AND OLD.content_size = NEW.content_size AND OLD.stored_size = NEW.stored_size AND OLD.codec IS NEW.codec) BEGIN
+        UPDATE totals SET items = items - 1, refs = refs - OLD.ref_count, content_bytes = content_bytes - (NOT OLD.chunked) * OLD.content_size, stored_bytes = stored_bytes - OLD.stored_size WHERE referenced = (OLD.ref_count > 0) AND codec = IFNULL(OLD.codec, '');
+        INSERT OR IGNORE INTO totals VALUES (NEW.ref_count > 0, IFNULL(NEW.codec, ''), 0, 0, 0, 0);
+        UPDATE totals SET items = items + 1, refs = refs + NEW.ref_count, content_bytes = content_bytes + (NOT NEW.chunked) * NEW.content_size, stored_bytes = stored_bytes + NEW.stored_size WHERE referenced = (NEW.ref_count > 0) AND codec = IFNULL(NEW.codec, '');
+    END""",
+]
+
+# NB: the (expensive) equivalent of the totals table
+_TOTALS_QUERY = "SELECT ref_count > 0 AS referenced, IFNULL(codec, '') AS codec, COUNT(*) AS items, SUM(ref_count) AS refs, SUM((NOT chunked) * content_size) AS content_bytes, SUM(stored_size) AS stored_bytes FROM citems GROUP BY 1, 2"
+
+# NB: the columns (name, definition, value in older indexes) added to
+# citems by each format version
+_ADDED_COLUMNS = {
+    2: [("chunked", "INTEGER NOT NULL DEFAULT 0", "0")],
+    3: [("codec", "TEXT", "NULL")],
+    4: [("pack", "INTEGER", "NULL"), ("pack_offset", "INTEGER", "NULL")],
+}
+
+def _prefix_range(prefix):
+    # the range of tokens (start inclusive, end exclusive) that start with prefix
+    return (prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1))
+
+# NB: the states of the slots in a RefDeltas table
+_EMPTY, _LIVE, _DELETED = 0, 1, 2
+
+class RefDeltas:
+    """Compact mapping of (hex) content tokens to reference count deltas.
+    The tokens are held as binary digests in an open addressing hash table
+    with a parallel array of deltas which uses a fraction of the memory
+    of a dict keyed by hex strings."""
+    _MIN_CAPACITY = 1024
+    def __init__(self):
+        self._key_size = None
+        self._allocate(self._MIN_CAPACITY)
+    def _allocate(self, capacity):
+        # NB: capacity must be a power of two
+        self._mask = capacity - 1
+        self._states = bytearray(capacity)
+        self._keys = bytearray(capacity * (self._key_size or 0))
+        self._deltas = array.array("q", bytes(8 * capacity))
+        self._len = 0
+        self._used = 0
+    def _get_key(self, token):
+        key = bytes.fromhex(token)
+        if len(key) != self._key_size:
+            if self._key_size is not None:
+                raise ValueError("{}: token length differs from {} bytes".format(token, self._key_size))
+            self._key_size = len(key)
+            self._keys = bytearray(len(self._states) * self._key_size)
+        return key
+    def _find(self, token):
+        # NB: keys are digests so their leading bytes are already uniformly
+        # distributed and need no further hashing
+        if self._key_size is None:
+            return None
+        key = self._get_key(token)
+        states, keys, key_size, mask = self._states, self._keys, self._key_size, self._mask
+        index = int.from_bytes(key[:8], "little") & mask
+        while True:
+            state = states[index]
+            if state == _LIVE:
+                offset = index * key_size
+                if keys[offset:offset + key_size] == key:
+                    return index
+            elif state == _EMPTY:
+                return None
+            index = (index + 1) & mask
+    def _resize(self):
+        capacity = self._MIN_CAPACITY
+        while capacity < self._len * 2:
+            capacity *= 2
+        key_size, states, keys, deltas, num_items = self._key_size, self._states, self._keys, self._deltas, self._len
+        self._allocate(capacity)
+        new_states, new_keys, new_deltas, mask = self._states, self._keys, self._deltas, self._mask
+        # NB: the new table has no deleted entries or duplicates so each
+        # item just goes in the first empty slot that it probes
+        index = states.find(_LIVE)
+        while index != -1:
+            offset = index * key_size
+            key = keys[offset:offset + key_size]
+            new_index = int.from_bytes(key[:8], "little") & mask
+            while new_states[new_index]:
+                new_index = (new_index + 1) & mask
+            new_states[new_index] = _LIVE
+            new_offset = new_index * key_size
+            new_keys[new_offset:new_offset + key_size] = key
+            new_deltas[new_index] = deltas[index]
+            index = states.find(_LIVE, index + 1)
+        self._len = self._used = num_items
+    def incr(self, token, delta):
+        key = self._get_key(token)
+        states, keys, key_size, mask = self._states, self._keys, self._key_size, self._mask
+        index = int.from_bytes(key[:8], "little") & mask
+        free_index = None
+        while True:
+            state = states[index]
+            if state == _LIVE:
+                offset = index * key_size
+                if keys[offset:offset + key_size] == key:
+                    self._deltas[index] += delta
+                    return
+            elif state == _EMPTY:
+                break
+            elif free_index is None:
+                free_index = index
+            index = (index + 1) & mask
+        # NB: reuse the first deleted slot probed (if any)
+        if free_index is None:
+            free_index = index
+            self._used += 1
+        states[free_index] = _LIVE
+        offset = free_index * key_size
+        keys[offset:offset + key_size] = key
+        self._deltas[free_index] = delta
+        self._len += 1
+        if self._used * 3 > (mask + 1) * 2:
+            self._resize()
+    def get(self, token, default=None):
+        index = self._find(token)
+        return default if index is None else self._deltas[index]
+    def pop(self, token, default=None):
+        index = self._find(token)
+        if index is None:
+            return default
+        self._states[index] = _DELETED
+        self._len -= 1
+        return self._deltas[index]
+    def items(self):
+        key_size, states, keys, deltas = self._key_size, self._states, self._keys, self._deltas
+        index = states.find(_LIVE)
+        while index != -1:
+            offset = index * key_size
+            yield (keys[offset:offset + key_size].hex(), deltas[index])
+            index = states.find(_LIVE, index + 1)
+    def clear(self):
+        self._allocate(self._MIN_CAPACITY)
+    def __contains__(self, token):
+        return self._find(token) is not None
+    def __len__(self):
+        return self._len
+
+class CIndex:
+    # NB: new content items are committed periodically (with a zero
+    # reference count) so that their stored content can't be leaked by
+    # a crash but changes to reference counts are accumulated in memory
+    # and only applied when the session is closed as the snapshot that
+    # they belong to won't exist if the session doesn't finish
+    # NB: several sessions may be writing to the index concurrently so
+    # new items (and setting increments) are also buffered in memory and
+    # flushed in short transactions at each checkpoint to keep the time
+    # that the database's write lock is held to a minimum
+    CHECKPOINT_INTERVAL = 5.0
+    def __init__(self, connection, writeable):
+        self._connection = connection
+        self.writeable = writeable
+        self._ref_deltas = RefDeltas()
+        self._ref_deltas_folded = False
+        self._new_citems = {}
+        self._setting_deltas = {}
+        self._setting_maxima = {}
+        self._session_counts = [0] * len(SessionCounts._fields)
+        self._last_checkpoint = time.time()
+    def close(self, commit=True):
+        if self.writeable and commit:
+            self._fold_ref_deltas()
+            self._connection.commit()
+        self._connection.close()
+    def checkpoint(self):
+        if self._ref_deltas_folded or time.time() - self._last_checkpoint < self.CHECKPOINT_INTERVAL:
+            return
+        self._flush()
+        self._connection.commit()
+        self._last_checkpoint = time.time()
+    def _flush(self):
+        # NB: another session may have added the same item in the meantime
+        # and, if so, this session's references are simply added to it
+        if self._new_citems:
+            self._connection.executemany("INSERT OR IGNORE INTO citems VALUES (?, 0, ?, ?, ?, ?, ?, ?)", self._new_citems.values())
+            self._new_citems.clear()
+        for key, delta in self._setting_deltas.items():
+            self._connection.execute("INSERT OR IGNORE INTO meta VALUES (?, 0)", (key,))
+            self._connection.execute("UPDATE meta SET value = value + ? WHERE key = ?", (delta, key))
+        self._setting_deltas.clear()
+        for key, value in self._setting_maxima.items():
+            self._connection.execute("INSERT OR IGNORE INTO meta VALUES (?, ?)", (key, value))
+            self._connection.execute("UPDATE meta SET value = MAX(value, ?) WHERE key = ?", (value, key))
+        self._setting_maxima.clear()
+    def _flush_and_commit(self):
+        # NB: the flushed changes are committed straight away (unless they
+        # join a transaction that's already open) so that the database's
+        # write lock isn't held until the next checkpoint
+        in_transaction = self._connection.in_transaction
+        self._flush()
+        if not in_transaction and self._connection.in_transaction:
+            self._connection.commit()
+    def _execute(self, sql, parameters=()):
+        # NB: for queries that have to see this session's buffered changes
+        if self.writeable:
+            self._flush_and_commit()
+        return self._connection.execute(sql, parameters)
+    def _apply_ref_deltas(self):
+        self._connection.executemany("UPDATE citems SET ref_count = ref_count + ? WHERE token = ?", ((delta, token) for token, delta in self._ref_deltas.items() if delta))
+    def _fold_ref_deltas(self):
+        self._flush()
+        self._apply_ref_deltas()
+        self._ref_deltas.clear()
+        self._ref_deltas_folded = True
+    def _get_db_ref_count(self, token):
+        row = self._connection.execute("SELECT ref_count FROM citems WHERE token = ?", (token,)).fetchone()
+        return None if row is None else row[0]
+    def _get_ref_count(self, token):
+        # NB: for an item that this session has a reference count delta for
+        ref_count = 0 if token in self._new_citems else self._get_db_ref_count(token) or 0
+        return ref_count + self._ref_deltas.get(token, 0)
+    def _count_ref_change(self, old_ref_count, delta):
+        # NB: old_ref_count is None if the item's status can't change
+        counts = self._session_counts
+        counts[3] += delta
+        if old_ref_count is not None and bool(old_ref_count) != bool(old_ref_count + delta):
+            counts[1 if old_ref_count else 2] -= 1
+            counts[2 if old_ref_count else 1] += 1
+    def get_setting(self, key, default=None):
+        row = self._connection.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        value = default if row is None else row[0]
+        if key in self._setting_deltas:
+            value = (value or 0) + self._setting_deltas[key]
+        if key in self._setting_maxima:
+            value = self._setting_maxima[key] if value is None else max(int(value), self._setting_maxima[key])
+        return value
+    def set_setting(self, key, value):
+        assert self.writeable
+        self._connection.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)", (key, value))
+    def incr_setting(self, key, delta):
+        assert self.writeable
+        self._setting_deltas[key] = self._setting_deltas.get(key, 0) + delta
+    def raise_setting(self, key, value):
+        # NB: the setting becomes the maximum of its current value and value
+        assert self.writeable
+        self._setting_maxima[key] = max(value, self._setting_maxima.get(key, value))
+    def get_settings(self):
+        return {key: value for key, value in self._execute("SELECT key, value FROM meta WHERE key != 'format_version'")}
+    def delete_setting(self, key):
+        assert self.writeable
+        self._connection.execute("DELETE FROM meta WHERE key = ?", (key,))
+    def get(self, token):
+        row = self._new_citems.get(token)
+        if row is not None:
+            return CItem(self._ref_deltas.get(token, 0), row[1], row[2], bool(row[3]), *row[4:])
+        row = self._connection.execute("SELECT ref_count, content_size, stored_size, chunked, codec, pack, pack_offset FROM citems WHERE token = ?", (token,)).fetchone()
+        if row is None:
+            return None
+        return CItem(row[0] + self._ref_deltas.get(token, 0), row[1], row[2], bool(row[3]), *row[4:])
+    def __contains__(self, token):
+        return token in self._ref_deltas or self._get_db_ref_count(token) is not None
+    def add(self, token, ref_count, content_size, stored_size, chunked=False, codec=None, pack=None, pack_offset=None):
+        assert self.writeable
+        self._new_citems[token] = (token, content_size, stored_size, int(chunked), codec, pack, pack_offset)
+        self._ref_deltas.incr(token, ref_count)
+        self._session_counts[0] += 1
+        self._session_counts[1 if ref_count else 2] += 1
+        self._session_counts[3] += ref_count
+        self.checkpoint()
+    def incr_ref_count(self, token, delta=1):
+        # NB: returns False if token isn't in the index
+        assert self.writeable
+        session_delta = self._ref_deltas.get(token)
+        if session_delta is None:
+            ref_count = self._get_db_ref_count(token)
+            if ref_count is None:
+                return False
+        elif session_delta > 0 and delta > 0:
+            # the usual case during a back up and needs no look up
+            ref_count = None
+        else:
+            ref_count = self._get_ref_count(token)
+        self._ref_deltas.incr(token, delta)
+        self._count_ref_change(ref_count, delta)
+        return True
+    def set_stored_size(self, token, stored_size, codec=None, pack=None, pack_offset=None):
+        assert self.writeable
+        return self._execute("UPDATE citems SET stored_size = ?, codec = ?, pack = ?, pack_offset = ? WHERE token = ?", (stored_size, codec, pack, pack_offset, token)).rowcount == 1
+    def set_pack_offset(self, token, pack, pack_offset):
+        assert self.writeable
+        self._execute("UPDATE citems SET pack = ?, pack_offset = ? WHERE token = ?", (pack, pack_offset, token))
+    def delete(self, token):
+        assert self.writeable
+        ref_count = self._get_ref_count(token)
+        self._count_ref_change(ref_count, -ref_count)
+        self._session_counts[2] -= 1
+        self._ref_deltas.pop(token, None)
+        if self._new_citems.pop(token, None) is not None:
+            self._session_counts[0] -= 1
+            return
+        self._connection.execute("DELETE FROM citems WHERE token = ?", (token,))
+    def has_prefix(self, prefix):
+        return self._execute("SELECT 1 FROM citems WHERE token >= ? AND token < ? LIMIT 1", _prefix_range(prefix)).fetchone() is not None
+    def iterate(self, prefix=""):
+        if prefix:
+            cursor = self._execute("SELECT token, ref_count, content_size, stored_size, chunked FROM citems WHERE token >= ? AND token < ? ORDER BY token", _prefix_range(prefix))
+        else:
+            cursor = self._execute("SELECT token, ref_count, content_size, stored_size, chunked FROM citems ORDER BY token")
+        for token, ref_count, content_size, stored_size, chunked in cursor:
+            yield (token, ref_count + self._ref_deltas.get(token, 0), content_size, stored_size, bool(chunked))
+    def iterate_citems(self, after="", limit=-1):
+        for row in self._execute("SELECT token, ref_count, content_size, stored_size, chunked, codec, pack, pack_offset FROM citems WHERE token > ? ORDER BY token LIMIT ?", (after, limit)):
+            yield (row[0], CItem(row[1] + self._ref_deltas.get(row[0], 0), row[2], row[3], bool(row[4]), *row[5:]))
+    def iterate_codecs(self, after="", limit=-1):
+        return self._execute("SELECT token, codec FROM citems WHERE token > ? ORDER BY token LIMIT ?", (after, limit))
+    def iterate_unreferenced(self):
+        if self.writeable:
+            # NB: only maintenance operations (which have the repository to
+            # themselves) remove unreferenced items so their changes so far
+            # are final and can be committed
+            self._fold_ref_deltas()
+            self._connection.commit()
+        return self._connection.execute("SELECT token, content_size, stored_size, chunked, codec, pack FROM citems WHERE ref_count = 0 ORDER BY token")
+    def iterate_pack(self, pack):
+        return self._execute("SELECT token, pack_offset, stored_size FROM citems WHERE pack = ? ORDER BY pack_offset", (pack,))
+    def get_pack_totals(self):
+        # NB: the number of items and bytes (still) in use in each pack
+        return {pack: (items, int(stored_bytes)) for pack, items, stored_bytes in self._execute("SELECT pack, COUNT(*), TOTAL(stored_size) FROM citems WHERE pack IS NOT NULL GROUP BY pack")}
+    def get_counts(self):
+        num_refed, num_unrefed, ref_total = [int(v) for v in self._execute("SELECT TOTAL(ref_count > 0), TOTAL(ref_count = 0), TOTAL(ref_count) FROM citems").fetchone()]
+        for token, delta in self._ref_deltas.items():
+            if not delta:
+                continue
+            old_ref_count = self._get_db_ref_count(token)
+            if old_ref_count is None:
+                continue
+            ref_total += delta
+            if old_ref_count and not old_ref_count + delta:
+                num_refed -= 1
+                num_unrefed += 1
+            elif not old_ref_count and old_ref_count + delta:
+                num_refed += 1
+                num_unrefed -= 1
+        return (num_refed, num_unrefed, ref_total)
+    def get_session_counts(self):
+        return SessionCounts(*self._session_counts)
+    def get_storage_totals(self, recompute=False):
+        # NB: recompute (from the items themselves) is for auditing the totals
+        if not self.writeable:
+            return self._get_storage_totals(recompute)
+        # NB: this session's reference count changes aren't final until it's
+        # closed so they're applied in a savepoint that's then rolled back
+        self._flush_and_commit()
+        self._connection.execute("SAVEPOINT storage_totals")
+        try:
+            self._apply_ref_deltas()
+            return self._get_storage_totals(recompute)
+        finally:
+            self._connection.execute("ROLLBACK TO storage_totals")
+            self._connection.execute("RELEASE storage_totals")
+    def _get_storage_totals(self, recompute):
+        # NB: in the order of BRSS fields
+        totals = [0] * 7
+        query = _TOTALS_QUERY if recompute else "SELECT * FROM totals"
+        for referenced, items, references, content_bytes, stored_bytes in self._connection.execute("SELECT referenced, SUM(items), SUM(refs), SUM(content_bytes), SUM(stored_bytes) FROM ({}) GROUP BY referenced".format(query)):
+            if referenced:
+                totals[0:4] = [references, items, content_bytes, stored_bytes]
+            else:
+                totals[4:7] = [items, content_bytes, stored_bytes]
+        return tuple(totals)
+
+    def get_codec_totals(self, after=""):
+        # NB: items whose codec wasn't recorded are reported as None
+        if after:
+            return [(codec, items, int(content_bytes), int(stored_bytes)) for codec, items, content_bytes, stored_bytes in self._execute("SELECT codec, COUNT(*), TOTAL((NOT chunked) * content_size), TOTAL(stored_size) FROM citems WHERE token > ? GROUP BY codec ORDER BY codec", (after,))]
+        return [(codec or None, items, content_bytes, stored_bytes) for codec, items, content_bytes, stored_bytes in self._execute("SELECT codec, SUM(items), SUM(content_bytes), SUM(stored_bytes) FROM totals GROUP BY codec HAVING SUM(items) > 0 ORDER BY codec")]
+
+# NB: readers map (up to) this much of the index into memory so that a
+# lookup only touches the pages on its path through the B-tree (and
+# those are shared, via the page cache, with other readers)
+READ_ONLY_MMAP_SIZE = 1024 * 1024 * 1024
+
+# NB: how long (in seconds) to wait for another session to release the
+# database's lock (repositories may be on slow network file systems)
+BUSY_TIMEOUT = 120.0
+
+def _connect(index_path, writeable):
+    if writeable:
+        connection = sqlite3.connect(index_path, timeout=BUSY_TIMEOUT)
+    else:
+        from urllib.request import pathname2url
+        connection = sqlite3.connect("file:{}?mode=ro".format(pathname2url(index_path)), uri=True, timeout=BUSY_TIMEOUT)
+        connection.execute("PRAGMA mmap_size = {}".format(READ_ONLY_MMAP_SIZE))
+    return connection
+
+def _upgrade(connection, writeable):
+    format_version = int(connection.execute("SELECT value FROM meta WHERE key = 'format_version'").fetchone()[0])
+    if format_version >= FORMAT_VERSION:
+        return
+    added_columns = [column for version in range(format_version + 1, FORMAT_VERSION + 1) for column in _ADDED_COLUMNS.get(version, [])]
+    if writeable:
+        # NB: another session may be upgrading it at the same time
+        connection.execute("BEGIN IMMEDIATE")
+        if int(connection.execute("SELECT value FROM meta WHERE key = 'format_version'").fetchone()[0]) != format_version:
+            connection.rollback()
+            return
+        for name, definition, _value in added_columns:
+            connection.execute("ALTER TABLE citems ADD COLUMN {} {}".format(name, definition))
+        if format_version < 6:
+            # NB: version 5's totals counted chunked items' content too
+            if format_version == 5:
+                for trigger in ("totals_insert", "totals_delete", "totals_update_refs", "totals_update"):
+                    connection.execute("DROP TRIGGER {}".format(trigger))
+                connection.execute("DROP TABLE totals")
+            for statement in _TOTALS_SCHEMA:
+                connection.execute(statement)
+            connection.execute("INSERT INTO totals " + _TOTALS_QUERY)
+        connection.execute("UPDATE meta SET value = ? WHERE key = 'format_version'", (FORMAT_VERSION,))
+        connection.commit()
+    else:
+        # NB: a temporary view (which takes precedence) makes it look current
+        extra_columns = "".join(", {} AS {}".format(value, name) for name, _definition, value in added_columns)
+        connection.execute("CREATE TEMP VIEW citems AS SELECT *{} FROM main.citems".format(extra_columns))
+        if format_version < 6:
+            connection.execute("CREATE TEMP VIEW totals AS " + _TOTALS_QUERY)
+
+def open_index(index_path, writeable=False):
+    if not os.path.exists(index_path):
+        raise FileNotFoundError(index_path)
+    connection = _connect(index_path, writeable)
+    try:
+        _upgrade(connection, writeable)
+    except:
+        connection.close()
+        raise
+    return CIndex(connection, writeable)
+
+def _initialize(connection):
+    for statement in _SCHEMA + _TOTALS_SCHEMA:
+        connection.execute(statement)
+    connection.execute("INSERT INTO meta VALUES ('format_version', ?)", (FORMAT_VERSION,))
+
+def create_index(index_path, settings=None):
+    # NB: build it under a temporary name so that it appears atomically
+    tmp_index_path = index_path + ".tmp"
+    if os.path.exists(tmp_index_path):
+        os.remove(tmp_index_path)
+    connection = sqlite3.connect(tmp_index_path)
+    try:
+        _initialize(connection)
+        if settings:
+            connection.executemany("INSERT INTO meta VALUES (?, ?)", settings.items())
+        connection.commit()
+    finally:
+        connection.close()
+    os.rename(tmp_index_path, index_path)
+
+def _iterate_ref_counter(ref_counter):
+    for dir_name, dir_data in ref_counter.items():
+        for subdir_name, subdir_data in dir_data.items():
+            for file_name, (ref_count, content_size, stored_size) in subdir_data.items():
+                yield (dir_name + subdir_name + file_name, ref_count, content_size, stored_size)
+
+def _load_ref_counter(connection, ref_counter_path):
+    import pickle
+    with open(ref_counter_path, "rb") as f_obj:
+        ref_counter = pickle.load(f_obj)
+    connection.executemany("INSERT INTO citems VALUES (?, ?, ?, ?, 0, NULL, NULL, NULL)", _iterate_ref_counter(ref_counter))
+
+def migrate_ref_counter(ref_counter_path, index_path):
+    """Create an index containing the data in the (obsolete) pickled
+    reference counter file and rename that file so that it won't be used
+    by mistake"""
+    tmp_index_path = index_path + ".tmp"
+    if os.path.exists(tmp_index_path):
+        os.remove(tmp_index_path)
+    connection = sqlite3.connect(tmp_index_path)
+    try:
+        _initialize(connection)
+        _load_ref_counter(connection, ref_counter_path)
+        connection.commit()
+    finally:
+        connection.close()
+    os.rename(tmp_index_path, index_path)
+    os.rename(ref_counter_path, ref_counter_path + ".migrated")
+
+def open_ref_counter_as_index(ref_counter_path):
+    """Read only (in memory) index for a repository whose pickled
+    reference counter can't be migrated e.g. on read only media"""
+    connection = sqlite3.connect(":memory:")
+    _initialize(connection)
+    _load_ref_counter(connection, ref_counter_path)
+    return CIndex(connection, False)
@@ -26,9 +26,13 @@ from . import subcmd_del
 from . import subcmd_list_content_items
 from . import subcmd_repo_stats
 from . import subcmd_prune
+from . import subcmd_repack
+from . import subcmd_rehash
+from . import subcmd_scrub
 from . import subcmd_show
 from . import subcmd_extract
 from . import subcmd_compress
+from . import subcmd_convert_snapshots
 from . import subcmd_restore
 from . import subcmd_edit
 from . import subcmd_lss
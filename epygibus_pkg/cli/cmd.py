@@ -22,6 +22,8 @@ import argparse
 import collections
 
 from .. import VERSION
+from .. import codec
+from .. import digest
 
 _ARG_SPEC = collections.namedtuple("_ARG_SPEC", ["args", "kargs"])
 def add_cmd_argument(parser, arg_spec):
@@ -96,6 +98,24 @@ UNCOMPRESSED_ARG = lambda help_msg=_("store data uncompressed."): _ARG_SPEC(
     }
 )
 
+CODEC_ARG = lambda help_msg=_("the codec to be used to encode content."): _ARG_SPEC(
+    ["--codec"],
+    {   "help": help_msg,
+        "dest": "codec_name",
+        "choices": list(codec.CODECS),
+        "metavar": _("codec"),
+    }
+)
+
+HASH_ARG = lambda help_msg=_("the hash algorithm to be used to generate content tokens."): _ARG_SPEC(
+    ["--hash"],
+    {   "help": help_msg,
+        "dest": "hash_algorithm_name",
+        "choices": list(digest.ALGORITHMS),
+        "metavar": _("algorithm"),
+    }
+)
+
 OVERWRITE_ARG = lambda help_msg=_("overwrite a file/directory if it already exists instead of moving it aside."): _ARG_SPEC(
     ["--overwrite"],
     {   "help": help_msg,
@@ -42,6 +42,20 @@ PARSER.add_argument(
     action="store_true"
 )
 
+PARSER.add_argument(
+    "--incremental",
+    help=_("don't re-read files whose attributes are unchanged since the archive's most recent snapshot."),
+    action="store_true"
+)
+
+PARSER.add_argument(
+    "--jobs",
+    help=_("the number of worker processes to use for digesting and compressing new content."),
+    type=int,
+    default=1,
+    metavar=_("N"),
+)
+
 MXGROUP = PARSER.add_mutually_exclusive_group()
 cmd.add_cmd_argument(MXGROUP, cmd.COMPRESSED_ARG(_("override the default and create a compressed snapshot file.")))
 cmd.add_cmd_argument(MXGROUP, cmd.UNCOMPRESSED_ARG(_("override the default and create an uncompressed snapshot file.")))
@@ -62,7 +76,11 @@ def run_cmd(args):
         sys.stdout.write(" " * (len_longest_name - len(ARCHIVE_HDR)) + ARCHIVE_HDR + ":")
         sys.stdout.write(_("            Snapshot:   Occupies:   #files    #links      Holding  #Created #Released    Build(%I/O)     Write\n"))
     for archive_name, archive in archives:
-        stats = snapshot.generate_snapshot(archive, stderr=sys.stderr, report_skipped_links=not args.quiet, compress=compress)
+        try:
+            stats = snapshot.generate_snapshot(archive, stderr=sys.stderr, report_skipped_links=not args.quiet, incremental=args.incremental, jobs=args.jobs, compress=compress)
+        except excpns.Error as edata:
+            sys.stderr.write(str(edata) + "\n")
+            sys.exit(-1)
         if args.stats:
             ss_name, ss_size, ss_stats, write_etd = stats
             sys.stdout.write(TEMPL.format(archive_name, ss_name, utils.format_bytes(ss_size)))
@@ -34,12 +34,24 @@ cmd.add_cmd_argument(MXGROUP, cmd.REPO_NAME_ARG(_("the name of the repository wh
 cmd.add_cmd_argument(MXGROUP, cmd.ARCHIVE_NAME_ARG(_("the name of the archive whose snapshot is to be compressed/uncompressed."), False))
 cmd.add_cmd_argument(PARSER, cmd.BACK_ISSUE_ARG())
 
-PARSER.add_argument(
+CMXGROUP = PARSER.add_mutually_exclusive_group()
+
+CMXGROUP.add_argument(
     "--uncompress", "-U",
     help=_("do uncompression instead of (the default) compression."),
     action="store_true"
 )
 
+cmd.add_cmd_argument(CMXGROUP, cmd.CODEC_ARG(_("(repositories only) re-encode all content items with this codec and use it for new content.")))
+
+PARSER.add_argument(
+    "--jobs",
+    help=_("(repositories only) the number of worker processes to use (default: the number of CPUs)."),
+    type=int,
+    default=None,
+    metavar=_("N"),
+)
+
 def run_cmd(args):
     try:
         if args.archive_name:
@@ -54,11 +66,13 @@ def run_cmd(args):
                 except excpns.SnapshotAlreadyCompressed:
                     sys.stdout.write(_("Nothing to do.\n"))
         else:
+            # NB: progress reports are only useful to a human
+            progress_indicator = utils.TextProgressThingy(sys.stderr, args.repo_name) if sys.stderr.isatty() else utils.DummyProgressThingy()
             if args.uncompress:
-                size_change = repo.uncompress_repository(args.repo_name)
+                size_change = repo.uncompress_repository(args.repo_name, args.jobs, progress_indicator)
                 sys.stdout.write(_("Disk usage increased by {}.\n").format(utils.format_bytes(size_change)))
             else:
-                size_change = repo.compress_repository(args.repo_name)
+                size_change = repo.compress_repository(args.repo_name, args.codec_name, args.jobs, progress_indicator)
                 sys.stdout.write(_("Disk usage decreased by {}.\n").format(utils.format_bytes(size_change)))
     except excpns.Error as edata:
         sys.stderr.write(str(edata) + "\n")
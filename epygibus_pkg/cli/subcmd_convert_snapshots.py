@@ -0,0 +1,39 @@
+### Copyright (C) 2016 Peter Williams <pwil3058@gmail.com>
+###
+### This program is free software; you can redistribute it and/or modify
+### it under the terms of the GNU General Public License as published by
+### the Free Software Foundation; version 2 of the License only.
+###
+### This program is distributed in the hope that it will be useful,
+### but WITHOUT ANY WARRANTY; without even the implied warranty of
+### MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+### GNU General Public License for more details.
+###
+### You should have received a copy of the GNU General Public License
+### along with this program; if not, write to the Free Software
+### Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+import sys
+
+from . import cmd
+
+from .. import snapshot
+from .. import excpns
+
+PARSER = cmd.SUB_CMD_PARSER.add_parser(
+    "convert_snapshots",
+    description=_("Convert the nominated archive's pickled (.pkl/.pkl.gz) snapshots to the columnar snapshot file format."),
+)
+
+cmd.add_cmd_argument(PARSER, cmd.ARCHIVE_NAME_ARG(_("the name of the archive whose snapshots are to be converted.")))
+
+def run_cmd(args):
+    try:
+        count = snapshot.convert_archive_snapshots(args.archive_name)
+    except excpns.Error as edata:
+        sys.stderr.write(str(edata) + "\n")
+        sys.exit(-1)
+    sys.stdout.write(_("{} snapshots converted.\n").format(count))
+    return 0
+
+PARSER.set_defaults(run_cmd=run_cmd)
@@ -70,6 +70,12 @@ PARSER.add_argument(
 
 cmd.add_cmd_argument(PARSER, cmd.OVERWRITE_ARG())
 
+PARSER.add_argument(
+    "--link",
+    help=_("hard link files to the content stored in the repository (rather than copying it) where the repository stores it uncompressed on the same file system. Files extracted this way are read only and MUST NOT be modified."),
+    action="store_true"
+)
+
 PARSER.add_argument(
     "--stats",
     help=_("print the statistics for the extraction."),
@@ -84,16 +90,16 @@ def run_cmd(args):
     try:
         if args.file_path:
             if args.archive_name:
-                size, etd = snapshot.copy_file_to(args.archive_name, args.file_path, args.into_dir_path, seln_fn=lambda l: l[-1-args.back], as_name=args.as_name, overwrite=args.overwrite)
+                size, etd = snapshot.copy_file_to(args.archive_name, args.file_path, args.into_dir_path, seln_fn=lambda l: l[-1-args.back], as_name=args.as_name, overwrite=args.overwrite, link=args.link)
             else:
-                size, etd = snapshot.exig_copy_file_to(args.snapshot_dir_path, args.file_path, args.into_dir_path, seln_fn=lambda l: l[-1-args.back], as_name=args.as_name, overwrite=args.overwrite)
+                size, etd = snapshot.exig_copy_file_to(args.snapshot_dir_path, args.file_path, args.into_dir_path, seln_fn=lambda l: l[-1-args.back], as_name=args.as_name, overwrite=args.overwrite, link=args.link)
             if args.stats:
                 sys.stdout.write(FST.format(utils.format_bytes(size), etd.real_time, etd.percent_io))
         else:
             if args.archive_name:
-                cs, etd = snapshot.copy_subdir_to(args.archive_name, args.dir_path, args.into_dir_path, seln_fn=lambda l: l[-1-args.back], as_name=args.as_name, overwrite=args.overwrite)
+                cs, etd = snapshot.copy_subdir_to(args.archive_name, args.dir_path, args.into_dir_path, seln_fn=lambda l: l[-1-args.back], as_name=args.as_name, overwrite=args.overwrite, link=args.link)
             else:
-                cs, etd = snapshot.exig_copy_subdir_to(args.snapshot_dir_path, args.dir_path, args.into_dir_path, seln_fn=lambda l: l[-1-args.back], as_name=args.as_name, overwrite=args.overwrite)
+                cs, etd = snapshot.exig_copy_subdir_to(args.snapshot_dir_path, args.dir_path, args.into_dir_path, seln_fn=lambda l: l[-1-args.back], as_name=args.as_name, overwrite=args.overwrite, link=args.link)
             if args.stats:
                 sys.stdout.write(DST.format(cs.dir_count, cs.file_count, cs.soft_link_count, cs.hard_link_count, utils.format_bytes(cs.gross_bytes), utils.format_bytes(cs.net_bytes), etd.real_time, etd.percent_io))
     except excpns.Error as edata:
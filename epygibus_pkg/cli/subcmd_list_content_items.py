@@ -41,10 +41,11 @@ def run_cmd(args):
     total_content_size = 0
     total_stored_size = 0
     with repo.open_repo_mgr(repo_mgmt_key, writeable=False) as repo_mgr:
-        for content_token, ref_count, content_size, stored_size in repo_mgr.iterate_content_tokens():
+        for content_token, ref_count, content_size, stored_size, chunked in repo_mgr.iterate_content_tokens():
             total_citems += 1
             total_ref_count += ref_count
-            total_content_size += content_size
+            # NB: a chunked item's content is counted via its chunks
+            total_content_size += 0 if chunked else content_size
             total_stored_size += stored_size
             sys.stdout.write(_("{}: {:>4,}: {} ({})\n").format(content_token, ref_count, utils.format_bytes(content_size), utils.format_bytes(stored_size)))
     sys.stdout.write(_("{:,} content items: {:>4,} references: {} ({}) total\n").format(total_citems, total_ref_count, utils.format_bytes(total_content_size), utils.format_bytes(total_stored_size)))
@@ -18,6 +18,7 @@ import sys
 from . import cmd
 
 from .. import config
+from .. import repo
 from .. import snapshot
 from .. import excpns
 from .. import utils
@@ -48,6 +49,20 @@ XGROUP.add_argument(
     action="store_true"
 )
 
+PARSER.add_argument(
+    "--verify",
+    help=_("with --storage_stats, use the sizes of the stored files rather than those recorded in the content index."),
+    action="store_true"
+)
+
+PARSER.add_argument(
+    "--jobs",
+    help=_("the number of threads to use for looking up stored file sizes when verifying."),
+    type=int,
+    default=repo.DEFAULT_VERIFY_JOBS,
+    metavar=_("N"),
+)
+
 cmd.add_cmd_argument(PARSER, cmd.ARCHIVE_NAME_ARG(_("the name of the archive whose snapshots are to be listed.")))
 
 def run_cmd(args):
@@ -70,7 +85,7 @@ def run_cmd(args):
                 if first:
                     first = False
                     sys.stdout.write(_("Snapshots:                 Occupies    #Files    #Links        Holds    #Items       Stored        Share\n"))
-                nfiles, nlinks, csize, n_citems, stored_size, share = snapshot_fs.get_statistics()
+                nfiles, nlinks, csize, n_citems, stored_size, share = snapshot_fs.get_statistics(args.verify, args.jobs)
                 sys.stdout.write("  {}: {:>12} {:>9,} {:>9,} {:>12} {:>9,} {:>12} {:>12}\n".format(snapshot_fs.snapshot_name, utils.format_bytes(size), nfiles, nlinks, utils.format_bytes(csize), n_citems, utils.format_bytes(stored_size), utils.format_bytes(share)))
         except excpns.Error as edata:
             sys.stderr.write(str(edata) + "\n")
@@ -19,6 +19,8 @@ from . import cmd
 
 from .. import repo
 from .. import excpns
+from .. import codec
+from .. import digest
 
 PARSER = cmd.SUB_CMD_PARSER.add_parser(
     "new_repo",
@@ -40,11 +42,36 @@ PARSER.add_argument(
     action = "store"
 )
 
-cmd.add_cmd_argument(PARSER, cmd.UNCOMPRESSED_ARG())
+MXGROUP = PARSER.add_mutually_exclusive_group()
+cmd.add_cmd_argument(MXGROUP, cmd.UNCOMPRESSED_ARG())
+cmd.add_cmd_argument(MXGROUP, cmd.CODEC_ARG(_("the codec to be used to encode stored content (default: {}).").format(codec.DEFAULT_CODEC_NAME)))
+
+PARSER.add_argument(
+    "--chunking",
+    help=_("store large files as content defined chunks so that files that change a little between back ups share most of their storage."),
+    action="store_true",
+)
+
+PARSER.add_argument(
+    "--raw_extensions",
+    help=_("store files with these extensions without encoding them as their content is already compressed (default: {}).").format(" ".join(codec.DEFAULT_RAW_EXTENSIONS)),
+    nargs="*",
+    metavar=_("extension"),
+)
+
+PARSER.add_argument(
+    "--pack_threshold",
+    help=_("store content items smaller than this (in bytes) in shared pack files rather than their own files (default: {}). Zero disables packing.").format(repo.DEFAULT_PACK_THRESHOLD),
+    type=int,
+    default=repo.DEFAULT_PACK_THRESHOLD,
+    metavar=_("size"),
+)
+
+cmd.add_cmd_argument(PARSER, cmd.HASH_ARG(_("the hash algorithm to be used to generate content tokens (default: {}).").format(digest.DEFAULT_ALGORITHM_NAME)))
 
 def run_cmd(args):
     try:
-        repo.create_new_repo(args.repo_name, args.location_dir_path, compressed=not args.uncompressed)
+        repo.create_new_repo(args.repo_name, args.location_dir_path, compressed=not args.uncompressed, chunking=args.chunking, codec_name=args.codec_name, raw_extensions=args.raw_extensions, pack_threshold=args.pack_threshold, hash_algorithm_name=args.hash_algorithm_name)
     except excpns.Error as edata:
         sys.stderr.write(str(edata) + "\n")
     return 0
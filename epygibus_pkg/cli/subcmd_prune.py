@@ -30,19 +30,26 @@ PARSER = cmd.SUB_CMD_PARSER.add_parser(
 
 cmd.add_cmd_argument(PARSER, cmd.REPO_NAME_ARG())
 
+PARSER.add_argument(
+    "--jobs",
+    help=_("the number of threads to use for removing files."),
+    type=int,
+    default=repo.DEFAULT_PRUNE_JOBS,
+    metavar=_("N"),
+)
+
 def run_cmd(args):
     try:
-        repo_mgmt_key = repo.get_repo_mgmt_key(args.repo_name)
+        stats = repo.prune_repository(args.repo_name, args.jobs)
     except excpns.Error as edata:
         sys.stderr.write(str(edata) + "\n")
         sys.exit(-1)
-    stats = None
-    with repo.open_repo_mgr(repo_mgmt_key, writeable=True) as repo_mgr:
-        stats = repo_mgr.prune_unreferenced_content()
-    if not stats[0]:
+    if not stats[0] and not stats[3]:
         sys.stdout.write(_("Nothing to do.\n"))
-    else:
+    if stats[0]:
         sys.stdout.write(_("{:>4,} unreferenced content items removed freeing {} of content and {} of storage\n").format(stats[0], utils.format_bytes(stats[1]), utils.format_bytes(stats[2])))
+    if stats[3]:
+        sys.stdout.write(_("{:>4,} orphaned files removed\n").format(stats[3]))
     return 0
 
 PARSER.set_defaults(run_cmd=run_cmd)
@@ -0,0 +1,52 @@
+### Copyright (C) 2016 Peter Williams <pwil3058@gmail.com>
+###
+### This program is free software; you can redistribute it and/or modify
+### it under the terms of the GNU General Public License as published by
+### the Free Software Foundation; version 2 of the License only.
+###
+### This program is distributed in the hope that it will be useful,
+### but WITHOUT ANY WARRANTY; without even the implied warranty of
+### MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+### GNU General Public License for more details.
+###
+### You should have received a copy of the GNU General Public License
+### along with this program; if not, write to the Free Software
+### Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+import sys
+
+from . import cmd
+
+from .. import repo
+from .. import excpns
+from .. import digest
+
+PARSER = cmd.SUB_CMD_PARSER.add_parser(
+    "rehash",
+    description=_("Change the hash algorithm used to generate the named repository's content tokens (and update the snapshots of the archives that use it). The repository should not be in use while this is done."),
+)
+
+cmd.add_cmd_argument(PARSER, cmd.REPO_NAME_ARG())
+cmd.add_cmd_argument(PARSER, cmd.HASH_ARG(_("the new hash algorithm (default: {}).").format(digest.DEFAULT_ALGORITHM_NAME)))
+
+PARSER.add_argument(
+    "--jobs",
+    help=_("the number of worker processes to use (default: the number of CPUs)."),
+    type=int,
+    default=None,
+    metavar=_("N"),
+)
+
+def run_cmd(args):
+    try:
+        count = repo.rehash_repository(args.repo_name, args.hash_algorithm_name, args.jobs)
+    except excpns.Error as edata:
+        sys.stderr.write(str(edata) + "\n")
+        sys.exit(-1)
+    if not count:
+        sys.stdout.write(_("Nothing to do.\n"))
+    else:
+        sys.stdout.write(_("{:,} content items rehashed.\n").format(count))
+    return 0
+
+PARSER.set_defaults(run_cmd=run_cmd)
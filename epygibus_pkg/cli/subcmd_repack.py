@@ -0,0 +1,51 @@
+### Copyright (C) 2016 Peter Williams <pwil3058@gmail.com>
+###
+### This program is free software; you can redistribute it and/or modify
+### it under the terms of the GNU General Public License as published by
+### the Free Software Foundation; version 2 of the License only.
+###
+### This program is distributed in the hope that it will be useful,
+### but WITHOUT ANY WARRANTY; without even the implied warranty of
+### MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+### GNU General Public License for more details.
+###
+### You should have received a copy of the GNU General Public License
+### along with this program; if not, write to the Free Software
+### Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+import sys
+
+from . import cmd
+
+from .. import repo
+from .. import excpns
+from .. import utils
+
+PARSER = cmd.SUB_CMD_PARSER.add_parser(
+    "repack",
+    description=_("Reclaim the unused space (e.g. left by pruning) in the named repository's pack files."),
+)
+
+cmd.add_cmd_argument(PARSER, cmd.REPO_NAME_ARG())
+
+PARSER.add_argument(
+    "--min_unused",
+    help=_("only repack pack files with at least this percentage of their space unused (default: {}).").format(int(repo.DEFAULT_REPACK_MIN_UNUSED * 100)),
+    type=int,
+    default=int(repo.DEFAULT_REPACK_MIN_UNUSED * 100),
+    metavar=_("percent"),
+)
+
+def run_cmd(args):
+    try:
+        packs_removed, bytes_freed = repo.repack_repository(args.repo_name, args.min_unused / 100.0)
+    except excpns.Error as edata:
+        sys.stderr.write(str(edata) + "\n")
+        sys.exit(-1)
+    if not packs_removed:
+        sys.stdout.write(_("Nothing to do.\n"))
+    else:
+        sys.stdout.write(_("{:>4,} pack files repacked freeing {} of storage\n").format(packs_removed, utils.format_bytes(bytes_freed)))
+    return 0
+
+PARSER.set_defaults(run_cmd=run_cmd)
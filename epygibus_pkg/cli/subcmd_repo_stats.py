@@ -22,6 +22,7 @@ from .. import config
 from .. import repo
 from .. import excpns
 from .. import utils
+from .. import codec
 
 PARSER = cmd.SUB_CMD_PARSER.add_parser(
     "repo_stats",
@@ -30,32 +31,33 @@ PARSER = cmd.SUB_CMD_PARSER.add_parser(
 
 cmd.add_cmd_argument(PARSER, cmd.REPO_NAME_ARG())
 
+PARSER.add_argument(
+    "--recompute",
+    help=_("recompute the statistics from the individual content items (and report any discrepancy with the recorded totals)."),
+    action="store_true"
+)
+
 def run_cmd(args):
     try:
         repo_mgmt_key = repo.get_repo_mgmt_key(args.repo_name)
     except excpns.Error as edata:
         sys.stderr.write(str(edata) + "\n")
         sys.exit(-1)
-    total_referenced_citems = 0
-    total_ref_count = 0
-    total_referenced_content_size = 0
-    total_referenced_stored_size = 0
-    total_unreferenced_citems = 0
-    total_unreferenced_content_size = 0
-    total_unreferenced_stored_size = 0
     with repo.open_repo_mgr(repo_mgmt_key, writeable=False) as repo_mgr:
-        for content_token, ref_count, content_size, stored_size in repo_mgr.iterate_content_tokens():
-            if ref_count:
-                total_referenced_citems += 1
-                total_ref_count += ref_count
-                total_referenced_content_size += content_size
-                total_referenced_stored_size += stored_size
-            else:
-                total_unreferenced_citems += 1
-                total_unreferenced_content_size += content_size
-                total_unreferenced_stored_size += stored_size
-    sys.stdout.write(_("  Referenced {:,} content items: {:>4,} references: {} ({}) total\n").format(total_referenced_citems, total_ref_count, utils.format_bytes(total_referenced_content_size), utils.format_bytes(total_referenced_stored_size)))
-    sys.stdout.write(_("Unreferenced {:,} content items: {:>4,} references: {} ({}) total\n").format(total_unreferenced_citems, 0, utils.format_bytes(total_unreferenced_content_size), utils.format_bytes(total_unreferenced_stored_size)))
+        brss = repo.BRSS(*repo_mgr.citem_index.get_storage_totals())
+        if args.recompute:
+            recomputed_brss = repo.BRSS(*repo_mgr.citem_index.get_storage_totals(recompute=True))
+            if recomputed_brss != brss:
+                sys.stderr.write(_("Warning: the recorded totals {} differ from those recomputed.\n").format(brss))
+            brss = recomputed_brss
+        repo_codec_name = repo_mgr.codec_name
+        raw_totals = [totals for totals in repo_mgr.citem_index.get_codec_totals() if totals[0] == codec.NONE.name]
+        raw_seconds_saved = repo_mgr.citem_index.get_setting("raw_seconds_saved", 0.0)
+    sys.stdout.write(_("  Referenced {:,} content items: {:>4,} references: {} ({}) total\n").format(brss.referenced_items, brss.references, utils.format_bytes(brss.referenced_content_bytes), utils.format_bytes(brss.referenced_stored_bytes)))
+    sys.stdout.write(_("Unreferenced {:,} content items: {:>4,} references: {} ({}) total\n").format(brss.unreferenced_items, 0, utils.format_bytes(brss.unreferenced_content_bytes), utils.format_bytes(brss.unreferenced_stored_bytes)))
+    if repo_codec_name != codec.NONE.name:
+        raw_citems, raw_content_size = (raw_totals[0][1], raw_totals[0][2]) if raw_totals else (0, 0)
+        sys.stdout.write(_("  Stored raw {:,} content items: {} total, estimated encoding CPU time saved: {:.2f}s\n").format(raw_citems, utils.format_bytes(raw_content_size), raw_seconds_saved))
     return 0
 
 PARSER.set_defaults(run_cmd=run_cmd)
@@ -0,0 +1,72 @@
+### Copyright (C) 2016 Peter Williams <pwil3058@gmail.com>
+###
+### This program is free software; you can redistribute it and/or modify
+### it under the terms of the GNU General Public License as published by
+### the Free Software Foundation; version 2 of the License only.
+###
+### This program is distributed in the hope that it will be useful,
+### but WITHOUT ANY WARRANTY; without even the implied warranty of
+### MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+### GNU General Public License for more details.
+###
+### You should have received a copy of the GNU General Public License
+### along with this program; if not, write to the Free Software
+### Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+import sys
+
+from . import cmd
+
+from .. import repo
+from .. import excpns
+from .. import utils
+
+PARSER = cmd.SUB_CMD_PARSER.add_parser(
+    "scrub",
+    description=_("Verify that all of the named repository's stored content items are intact and report any that are corrupt or missing and any stored files that don't belong to a content item. An interrupted scrub resumes where it left off."),
+)
+
+cmd.add_cmd_argument(PARSER, cmd.REPO_NAME_ARG())
+
+PARSER.add_argument(
+    "--jobs",
+    help=_("the number of worker processes to use (default: the number of CPUs)."),
+    type=int,
+    default=None,
+    metavar=_("N"),
+)
+
+PARSER.add_argument(
+    "--max_rate",
+    help=_("the maximum rate (in megabytes per second) at which stored content is read."),
+    type=float,
+    default=None,
+    metavar=_("MB"),
+)
+
+PARSER.add_argument(
+    "--restart",
+    help=_("start from the beginning rather than resume an interrupted scrub."),
+    action="store_true",
+)
+
+def run_cmd(args):
+    # NB: progress reports are only useful to a human
+    progress_indicator = utils.TextProgressThingy(sys.stderr, args.repo_name) if sys.stderr.isatty() else utils.DummyProgressThingy()
+    max_rate = args.max_rate * 1000000 if args.max_rate else None
+    try:
+        result = repo.scrub_repository(args.repo_name, args.jobs, max_rate, args.restart, progress_indicator)
+    except excpns.Error as edata:
+        sys.stderr.write(str(edata) + "\n")
+        sys.exit(-1)
+    for content_token in result.corrupt:
+        sys.stdout.write(_("Corrupt: {}\n").format(content_token))
+    for content_token in result.missing:
+        sys.stdout.write(_("Missing: {}\n").format(content_token))
+    for file_path in result.orphaned:
+        sys.stdout.write(_("Orphaned: {}\n").format(file_path))
+    rate = result.content_bytes / result.seconds if result.seconds else 0.0
+    sys.stdout.write(_("{:,} content items ({}) verified in {:.1f} seconds ({}/s): {:,} corrupt, {:,} missing, {:,} orphaned files.\n").format(result.items, utils.format_bytes(result.content_bytes).strip(), result.seconds, utils.format_bytes(rate).strip(), len(result.corrupt), len(result.missing), len(result.orphaned)))
+    return 1 if result.corrupt or result.missing else 0
+
+PARSER.set_defaults(run_cmd=run_cmd)
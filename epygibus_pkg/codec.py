@@ -0,0 +1,99 @@
+### Copyright (C) 2016 Peter Williams <pwil3058@gmail.com>
+###
+### This program is free software; you can redistribute it and/or modify
+### it under the terms of the GNU General Public License as published by
+### the Free Software Foundation; version 2 of the License only.
+###
+### This program is distributed in the hope that it will be useful,
+### but WITHOUT ANY WARRANTY; without even the implied warranty of
+### MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+### GNU General Public License for more details.
+###
+### You should have received a copy of the GNU General Public License
+### along with this program; if not, write to the Free Software
+### Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+"""Codecs (all from the standard library) used to encode the content
+items stored in a content repository.  The file name suffix of a stored
+item identifies its format so that any item can be decoded regardless
+of the codec (or level) that was used to encode it."""
+
+import bz2
+import collections
+import gzip
+import io
+import lzma
+import time
+
+class Codec(collections.namedtuple("Codec", ["name", "suffix", "open_function", "level"])):
+    def open(self, file_path_or_obj, mode):
+        # NB: only binary modes are supported
+        if self.level is None or "r" in mode:
+            return self.open_function(file_path_or_obj, mode)
+        return self.open_function(file_path_or_obj, mode, self.level)
+
+_lzma_open = lambda file_path_or_obj, mode, preset=None: lzma.open(file_path_or_obj, mode, preset=preset)
+_plain_open = lambda file_path_or_obj, mode: open(file_path_or_obj, mode) if isinstance(file_path_or_obj, str) else file_path_or_obj
+
+NONE = Codec("none", "", _plain_open, None)
+
+# NB: "gzip", "bz2" and "lzma" (without a level) use the modules' defaults
+CODECS = collections.OrderedDict([(NONE.name, NONE)])
+CODECS["gzip"] = Codec("gzip", ".gz", gzip.open, None)
+CODECS.update(("gzip-{}".format(level), Codec("gzip-{}".format(level), ".gz", gzip.open, level)) for level in range(1, 10))
+CODECS["bz2"] = Codec("bz2", ".bz2", bz2.open, None)
+CODECS.update(("bz2-{}".format(level), Codec("bz2-{}".format(level), ".bz2", bz2.open, level)) for level in range(1, 10))
+CODECS["lzma"] = Codec("lzma", ".xz", _lzma_open, None)
+CODECS.update(("lzma-{}".format(level), Codec("lzma-{}".format(level), ".xz", _lzma_open, level)) for level in range(0, 10))
+
+DEFAULT_CODEC_NAME = "gzip"
+
+# NB: for decoding items whose codec isn't recorded
+DECODERS = collections.OrderedDict((codec.suffix, codec) for codec in (CODECS["gzip"], NONE, CODECS["bz2"], CODECS["lzma"]))
+
+# NB: content is stored raw if encoding a sample of its start doesn't
+# reduce its size by at least this proportion
+SAMPLE_SIZE = 64 * 1024
+MIN_GAIN = 0.05
+
+# NB: files with these extensions are (almost always) already compressed
+DEFAULT_RAW_EXTENSIONS = (
+    ".7z", ".avi", ".bz2", ".docx", ".flac", ".gif", ".gpg", ".gz", ".jar",
+    ".jpeg", ".jpg", ".lz", ".lzma", ".m4a", ".m4v", ".mkv", ".mov", ".mp3",
+    ".mp4", ".odp", ".ods", ".odt", ".ogg", ".png", ".pptx", ".rar", ".tbz2",
+    ".tgz", ".txz", ".webm", ".webp", ".xlsx", ".xz", ".zip", ".zst",
+)
+
+# the number of sample bytes encoded (and the CPU time taken) by this process for each codec
+_sample_costs = collections.defaultdict(lambda: [0, 0.0])
+
+def encode_sample(a_codec, sample):
+    """Return sample encoded (in memory) by a_codec"""
+    start = time.process_time()
+    f_out = io.BytesIO()
+    with a_codec.open(f_out, "wb") as f_enc:
+        f_enc.write(sample)
+    sample_cost = _sample_costs[a_codec.name]
+    sample_cost[0] += len(sample)
+    sample_cost[1] += time.process_time() - start
+    return f_out.getvalue()
+
+def is_incompressible(encoded_sample, sample):
+    return len(encoded_sample) > len(sample) * (1.0 - MIN_GAIN)
+
+def estimate_encoding_time(a_codec, size, sample):
+    """Estimate the CPU time a_codec would take to encode size bytes
+    of content starting with sample"""
+    sample_cost = _sample_costs[a_codec.name]
+    if not sample_cost[0]:
+        if not sample:
+            return 0.0
+        encode_sample(a_codec, sample)
+    return sample_cost[1] * size / sample_cost[0]
+
+def get_codec(codec_name):
+    from . import excpns
+    try:
+        return CODECS[codec_name]
+    except KeyError:
+        raise excpns.UnknownCodec(codec_name)
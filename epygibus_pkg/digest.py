@@ -0,0 +1,46 @@
+### Copyright (C) 2016 Peter Williams <pwil3058@gmail.com>
+###
+### This program is free software; you can redistribute it and/or modify
+### it under the terms of the GNU General Public License as published by
+### the Free Software Foundation; version 2 of the License only.
+###
+### This program is distributed in the hope that it will be useful,
+### but WITHOUT ANY WARRANTY; without even the implied warranty of
+### MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+### GNU General Public License for more details.
+###
+### You should have received a copy of the GNU General Public License
+### along with this program; if not, write to the Free Software
+### Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+"""Hash algorithms (all from the standard library) used to generate the
+tokens that identify the content items stored in a content repository.
+All of a repository's tokens must be generated by the same algorithm."""
+
+import collections
+import hashlib
+
+class HashAlgorithm(collections.namedtuple("HashAlgorithm", ["name", "new_function"])):
+    def new(self, data=b""):
+        return self.new_function(data)
+    def get_token(self, data):
+        return self.new_function(data).hexdigest()
+
+# NB: blake2b's digest is truncated to the same length as sha1's by default
+ALGORITHMS = collections.OrderedDict((algorithm.name, algorithm) for algorithm in [
+    HashAlgorithm("sha1", hashlib.sha1),
+    HashAlgorithm("sha256", hashlib.sha256),
+    HashAlgorithm("blake2b", lambda data=b"": hashlib.blake2b(data, digest_size=20)),
+    HashAlgorithm("blake2b-256", lambda data=b"": hashlib.blake2b(data, digest_size=32)),
+])
+
+DEFAULT_ALGORITHM_NAME = "blake2b"
+# NB: repositories created before the algorithm was recorded use this
+LEGACY_ALGORITHM_NAME = "sha1"
+
+def get_algorithm(algorithm_name):
+    from . import excpns
+    try:
+        return ALGORITHMS[algorithm_name]
+    except KeyError:
+        raise excpns.UnknownHashAlgorithm(algorithm_name)
@@ -96,6 +96,28 @@ class UnknownRepository(Error):
     def __init__(self, repo_name):
         self.repo_name = repo_name
 
+class UnknownCodec(Error):
+    STR_TEMPLATE = _("Error: content codec \"{codec_name}\" is not known.")
+    def __init__(self, codec_name):
+        self.codec_name = codec_name
+
+class UnknownHashAlgorithm(Error):
+    STR_TEMPLATE = _("Error: hash algorithm \"{algorithm_name}\" is not known.")
+    def __init__(self, algorithm_name):
+        self.algorithm_name = algorithm_name
+
+class RehashIncomplete(Error):
+    STR_TEMPLATE = _("Error: conversion of the repository at \"{base_dir_path}\" to a new hash algorithm was interrupted. Run \"rehash\" again to complete it.")
+    def __init__(self, base_dir_path):
+        self.base_dir_path = base_dir_path
+
+class RehashTokenClash(Error):
+    STR_TEMPLATE = _("Error: content items \"{content_token}\" and \"{other_content_token}\" have the same \"{algorithm_name}\" token.")
+    def __init__(self, content_token, other_content_token, algorithm_name):
+        self.content_token = content_token
+        self.other_content_token = other_content_token
+        self.algorithm_name = algorithm_name
+
 class RepositoryExists(Error):
     STR_TEMPLATE = _("Error: content repository \"{repo_name}\" is already defined.")
     def __init__(self, repo_name):
@@ -139,6 +161,12 @@ class SnapshotNotFound(Error):
         self.archive_name = archive_name
         self.archive_name = snapshot_name
 
+class SnapshotExists(Error):
+    STR_TEMPLATE = _("Error: snapshot \"{snapshot_name}\" already exists in \"{archive_name}\" archive (written by a concurrent back up).")
+    def __init__(self, archive_name, snapshot_name):
+        self.archive_name = archive_name
+        self.snapshot_name = snapshot_name
+
 class SnapshotAlreadyCompressed(Error):
     STR_TEMPLATE = _("Error: snapshot \"{snapshot_name}\" in \"{archive_name}\" already compressed.")
     def __init__(self, archive_name, snapshot_name):
@@ -318,13 +318,14 @@ class RepoPruneDialog(Gtk.Dialog):
         self.show_all()
     def prune(self):
         self.show()
-        repo_mgmt_key = repo.get_repo_mgmt_key(self._repo_name)
-        with repo.open_repo_mgr(repo_mgmt_key, writeable=True) as repo_mgr:
-            stats = repo_mgr.prune_unreferenced_content(progress_indicator=self._progress_indicator)
-        if not stats[0]:
+        stats = repo.prune_repository(self._repo_name, progress_indicator=self._progress_indicator)
+        if not stats[0] and not stats[3]:
             self._message.set_text(_("Nothing to do."))
         else:
-            self._message.set_text(_("{:>4,} unreferenced content items removed freeing {} of content and {} of storage.").format(stats[0], utils.format_bytes(stats[1]), utils.format_bytes(stats[2])))
+            message = _("{:>4,} unreferenced content items removed freeing {} of content and {} of storage.").format(stats[0], utils.format_bytes(stats[1]), utils.format_bytes(stats[2]))
+            if stats[3]:
+                message += _("\n{:>4,} orphaned files removed.").format(stats[3])
+            self._message.set_text(message)
         self.set_response_sensitive(Gtk.ResponseType.CLOSE, True)
 
 
@@ -15,25 +15,344 @@
 
 import hashlib
 from contextlib import contextmanager
-import gzip
+import io
 import os
 import collections
 import shutil
+import threading
+import zlib
 
-import pickle
-
+from . import cindex
+from . import codec
+from . import digest
 from . import utils
 
+# NB: the pickled reference counter has been superseded by the index
+# but its path is still needed to migrate older repositories
 _REF_COUNTER_FILE_NAME = "ref_counter"
+_INDEX_FILE_NAME = "citems.db"
 _LOCK_FILE_NAME = "lock"
 _ref_counter_path = lambda base_dir_path: os.path.join(base_dir_path, _REF_COUNTER_FILE_NAME)
+_index_path = lambda base_dir_path: os.path.join(base_dir_path, _INDEX_FILE_NAME)
 _lock_file_path = lambda base_dir_path: os.path.join(base_dir_path, _LOCK_FILE_NAME)
+_PACKS_DIR_NAME = "packs"
+_packs_dir_path = lambda base_dir_path: os.path.join(base_dir_path, _PACKS_DIR_NAME)
+_pack_file_path = lambda base_dir_path, pack: os.path.join(base_dir_path, _PACKS_DIR_NAME, "{}.pack".format(pack))
+_pack_lock_file_path = lambda base_dir_path, pack: _pack_file_path(base_dir_path, pack) + ".lock"
+_TRASH_DIR_NAME = "trash"
+_MAINTENANCE_LOCK_FILE_NAME = "maintenance_lock"
+_trash_dir_path = lambda base_dir_path: os.path.join(base_dir_path, _TRASH_DIR_NAME)
+_maintenance_lock_file_path = lambda base_dir_path: os.path.join(base_dir_path, _MAINTENANCE_LOCK_FILE_NAME)
+_REHASH_JOURNAL_FILE_NAME = "rehash_journal"
+_rehash_journal_path = lambda base_dir_path: os.path.join(base_dir_path, _REHASH_JOURNAL_FILE_NAME)
+_SCRUB_STATE_FILE_NAME = "scrub_state"
+_scrub_state_path = lambda base_dir_path: os.path.join(base_dir_path, _SCRUB_STATE_FILE_NAME)
 _ld1 = 1
 _ld2 = _ld1 + 2
 _split_content_token = lambda content_token: (content_token[:_ld1], content_token[_ld1:_ld2], content_token[_ld2:])
 
+# NB: read content in chunks of this size when calculating its digest
+# so that peak memory use doesn't depend on the size of the file
+_DIGEST_CHUNK_SIZE = 1024 * 1024
+# NB: the amount copied by each copy_file_range() or sendfile() call
+_ZERO_COPY_CHUNK_SIZE = 64 * 1024 * 1024
+
+def _is_plain_file(f_obj):
+    # NB: compressed file objects also have fileno() so be specific
+    return isinstance(f_obj, (io.BufferedReader, io.BufferedWriter)) and isinstance(f_obj.raw, io.FileIO)
+
+def _copy_file_contents(f_in, f_out):
+    """Copy the rest of f_in's content to f_out without passing it
+    through user space (when both are plain files and the kernel
+    supports copy_file_range() or sendfile()) or in chunks otherwise"""
+    if not (_is_plain_file(f_in) and _is_plain_file(f_out)):
+        shutil.copyfileobj(f_in, f_out, _DIGEST_CHUNK_SIZE)
+        return
+    import errno
+    f_out.flush()
+    fd_in, fd_out = f_in.fileno(), f_out.fileno()
+    # NB: f_in's buffer is abandoned so start where its reader is up to
+    os.lseek(fd_in, f_in.tell(), os.SEEK_SET)
+    copy_functions = [lambda: os.sendfile(fd_out, fd_in, None, _ZERO_COPY_CHUNK_SIZE)]
+    if hasattr(os, "copy_file_range"):
+        copy_functions.insert(0, lambda: os.copy_file_range(fd_in, fd_out, _ZERO_COPY_CHUNK_SIZE))
+    for copy_function in copy_functions:
+        try:
+            while copy_function():
+                pass
+            return
+        except OSError as edata:
+            # NB: what's been copied stays copied as the offsets have moved
+            if edata.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP):
+                raise
+    for chunk in iter(lambda: os.read(fd_in, _DIGEST_CHUNK_SIZE), b""):
+        f_out.write(chunk)
+
+def _get_content_token(f_in, hash_algorithm):
+    digester = hash_algorithm.new()
+    for chunk in iter(lambda: f_in.read(_DIGEST_CHUNK_SIZE), b""):
+        digester.update(chunk)
+    return digester.hexdigest()
+
+# NB: parameters for content defined chunking (which MUST NOT be changed
+# once repositories using them exist or deduplication will suffer).
+# Candidate boundaries are found (at C speed) by mapping each byte to a
+# bit and searching for a fixed bit pattern and then confirmed by a
+# checksum of the preceding window of bytes.
+_CHUNK_MIN_SIZE = 16 * 1024
+_CHUNK_MAX_SIZE = 256 * 1024
+_CHUNK_WINDOW_SIZE = 48
+_CHUNK_CHECK_MASK = (1 << 10) - 1
+_cdc_bits = lambda seed, count: bytes((seed[i >> 3] >> (i & 7)) & 1 for i in range(count))
+_CHUNK_BIT_TABLE = _cdc_bits(hashlib.sha256(b"epygibus content defined chunking").digest(), 256)
+_CHUNK_NEEDLE = _cdc_bits(hashlib.sha256(b"epygibus chunk boundary").digest(), 6)
+# NB: files smaller than this are always stored whole
+_CHUNKING_THRESHOLD = 1024 * 1024
+
+def _find_chunk_end(data, bits, start, final):
+    # NB: returns None if more data is needed to decide
+    limit = min(start + _CHUNK_MAX_SIZE, len(data))
+    pos = start + _CHUNK_MIN_SIZE - len(_CHUNK_NEEDLE)
+    while True:
+        index = bits.find(_CHUNK_NEEDLE, pos, limit)
+        if index < 0:
+            break
+        end = index + len(_CHUNK_NEEDLE)
+        if not zlib.crc32(data[end - _CHUNK_WINDOW_SIZE:end]) & _CHUNK_CHECK_MASK:
+            return end
+        pos = index + 1
+    if limit - start == _CHUNK_MAX_SIZE or (final and limit > start):
+        return limit
+    return None
+
+def split_into_chunks(f_in):
+    """Iterate over the content of f_in in content defined chunks"""
+    data = b""
+    while True:
+        block = f_in.read(_DIGEST_CHUNK_SIZE)
+        data += block
+        bits = data.translate(_CHUNK_BIT_TABLE)
+        start = 0
+        while True:
+            end = _find_chunk_end(data, bits, start, not block)
+            if end is None:
+                break
+            yield data[start:end]
+            start = end
+        data = data[start:]
+        if not block:
+            break
+
+# NB: content items smaller than the repository's pack threshold are
+# appended to pack files (of about this size) rather than stored in their
+# own files to save inodes, directory entries and system calls
+_PACK_MAX_SIZE = 32 * 1024 * 1024
+DEFAULT_PACK_THRESHOLD = 16 * 1024
+# NB: pack files with at least this proportion of unused space are repacked
+DEFAULT_REPACK_MIN_UNUSED = 0.25
+
+# NB: the stored size and codec of a stored item and the (estimated)
+# CPU time saved if it was stored raw because it's incompressible
+_StoredBlob = collections.namedtuple("_StoredBlob", ["stored_size", "codec_name", "seconds_saved"])
+
+def _create_blob_file(file_path, open_function):
+    import stat
+    try:
+        return open_function(file_path, "wb")
+    except FileNotFoundError:
+        # NB: cheaper than checking for the directories' existence every time
+        # (and another process may be creating them at the same time)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        return open_function(file_path, "wb")
+    except PermissionError:
+        # left over by a session that was interrupted before it was indexed
+        os.chmod(file_path, stat.S_IRUSR|stat.S_IWUSR)
+        return open_function(file_path, "wb")
+
+def _encode_blob(file_path, codec_name, f_in, raw=False, tmp_suffix=""):
+    # NB: file_path doesn't include the codec's suffix
+    import stat
+    out_codec = codec.get_codec(codec_name)
+    sample = b""
+    encoded_sample = None
+    sampled_codec = None
+    if out_codec is not codec.NONE:
+        sample = f_in.read(codec.SAMPLE_SIZE)
+        if sample and not raw:
+            encoded_sample = codec.encode_sample(out_codec, sample)
+            raw = codec.is_incompressible(encoded_sample, sample)
+        if raw or not sample:
+            sampled_codec, out_codec = out_codec, codec.NONE
+    out_file_path = file_path + out_codec.suffix + tmp_suffix
+    if encoded_sample is not None and out_codec is not codec.NONE and len(sample) < codec.SAMPLE_SIZE:
+        # NB: the sample is all of the content so use its encoding
+        with _create_blob_file(out_file_path, open) as f_out:
+            f_out.write(encoded_sample)
+    else:
+        with _create_blob_file(out_file_path, out_codec.open) as f_out:
+            f_out.write(sample)
+            _copy_file_contents(f_in, f_out)
+    os.chmod(out_file_path, stat.S_IRUSR|stat.S_IRGRP)
+    stored_size = os.path.getsize(out_file_path)
+    seconds_saved = 0.0 if sampled_codec is None else codec.estimate_encoding_time(sampled_codec, stored_size, sample)
+    return _StoredBlob(stored_size, out_codec.name, seconds_saved)
+
+def _write_blob(base_dir_path, codec_name, content_token, f_in, raw=False):
+    # NB: written under a name private to this process and then renamed
+    # so that concurrent sessions storing the same content can't collide
+    file_path = os.path.join(base_dir_path, *_split_content_token(content_token))
+    tmp_suffix = ".{}.tmp".format(os.getpid())
+    stored_blob = _encode_blob(file_path, codec_name, f_in, raw, tmp_suffix)
+    out_file_path = file_path + codec.get_codec(stored_blob.codec_name).suffix
+    os.replace(out_file_path + tmp_suffix, out_file_path)
+    return stored_blob
+
+def _encode_data(codec_name, data, raw=False):
+    # NB: returns the encoded data along with the details
+    a_codec = codec.get_codec(codec_name)
+    if a_codec is codec.NONE or not data:
+        return (_StoredBlob(len(data), codec.NONE.name, 0.0), data)
+    if not raw:
+        encoded_data = codec.encode_sample(a_codec, data)
+        if not codec.is_incompressible(encoded_data, data):
+            return (_StoredBlob(len(encoded_data), a_codec.name, 0.0), encoded_data)
+    return (_StoredBlob(len(data), codec.NONE.name, codec.estimate_encoding_time(a_codec, len(data), data)), data)
+
+def _store_blob(base_dir_path, codec_name, content_token, content_size, f_in, raw=False, pack_threshold=0):
+    # NB: also returns the encoded content if it's to be packed
+    if content_size < pack_threshold:
+        return _encode_data(codec_name, f_in.read(), raw)
+    return (_write_blob(base_dir_path, codec_name, content_token, f_in, raw), None)
+
+_chunk_list_bytes = lambda chunk_tokens: "".join(chunk_token + "\n" for chunk_token in chunk_tokens).encode()
+
+def _find_blob(base_dir_path, content_token, codec_name=None):
+    # NB: returns the path and codec of the content's stored file
+    file_path = os.path.join(base_dir_path, *_split_content_token(content_token))
+    if codec_name is not None:
+        blob_codec = codec.get_codec(codec_name)
+        return (file_path + blob_codec.suffix, blob_codec)
+    # it wasn't recorded so look for it (trying the default first)
+    for blob_codec in codec.DECODERS.values():
+        if os.path.exists(file_path + blob_codec.suffix):
+            return (file_path + blob_codec.suffix, blob_codec)
+    raise FileNotFoundError(file_path)
+
+def _open_blob(base_dir_path, content_token, codec_name=None):
+    file_path, blob_codec = _find_blob(base_dir_path, content_token, codec_name)
+    return blob_codec.open(file_path, "rb")
+
+def _read_packed_blob(base_dir_path, pack, pack_offset, stored_size):
+    with open(_pack_file_path(base_dir_path, pack), "rb") as f_in:
+        return os.pread(f_in.fileno(), stored_size, pack_offset)
+
+def _open_citem(base_dir_path, content_token, citem):
+    if citem.pack is None:
+        return _open_blob(base_dir_path, content_token, citem.codec)
+    # NB: packed items are small so read them into memory
+    f_in = io.BytesIO(_read_packed_blob(base_dir_path, citem.pack, citem.pack_offset, citem.stored_size))
+    return codec.get_codec(citem.codec).open(f_in, "rb")
+
+# NB: the (repository, pack) pairs being appended to by this process's packers
+_packs_in_use = set()
+_packs_in_use_lock = threading.Lock()
+
+class _Packer:
+    """Append content items to the repository's current pack file"""
+    def __init__(self, base_dir_path, citem_index):
+        self._base_dir_path = base_dir_path
+        self._citem_index = citem_index
+        self._f_out = None
+        self._f_lock = None
+        self.pack = None
+        self._offset = 0
+    def _lock_pack(self, pack):
+        # NB: returns False if the pack is being appended to by another
+        # packer (in this or another process) which is detected using a
+        # flock() lock on a file of its own as, unlike lockf() locks, it
+        # isn't shared by the whole process or dropped when any other
+        # descriptor for the pack is closed
+        import fcntl
+        key = (self._base_dir_path, pack)
+        with _packs_in_use_lock:
+            if key in _packs_in_use:
+                return False
+            f_lock = open(_pack_lock_file_path(self._base_dir_path, pack), "ab")
+            try:
+                fcntl.flock(f_lock, fcntl.LOCK_EX|fcntl.LOCK_NB)
+            except OSError:
+                f_lock.close()
+                return False
+            _packs_in_use.add(key)
+        self._f_lock = f_lock
+        return True
+    def _unlock_pack(self):
+        with _packs_in_use_lock:
+            _packs_in_use.discard((self._base_dir_path, self.pack))
+            self._f_lock.close()
+        self._f_lock = None
+    def _open_next_pack(self):
+        if self._f_out is None:
+            self.pack = int(self._citem_index.get_setting("current_pack", 0))
+        else:
+            self._unlock_pack()
+            self._f_out.close()
+            self.pack += 1
+        os.makedirs(_packs_dir_path(self._base_dir_path), exist_ok=True)
+        # NB: each concurrent session appends to a pack of its own
+        while not self._lock_pack(self.pack):
+            self.pack += 1
+        self._f_out = open(_pack_file_path(self._base_dir_path, self.pack), "ab")
+        self._citem_index.raise_setting("current_pack", self.pack)
+        # NB: anything written by an interrupted session is just wasted space
+        self._offset = self._f_out.seek(0, os.SEEK_END)
+    def append(self, data):
+        while self._f_out is None or self._offset >= _PACK_MAX_SIZE:
+            self._open_next_pack()
+        location = (self.pack, self._offset)
+        self._f_out.write(data)
+        # NB: the data must be in the file before the index refers to it
+        self._f_out.flush()
+        self._offset += len(data)
+        return location
+    def close(self):
+        if self._f_out is not None:
+            self._unlock_pack()
+            self._f_out.close()
+            self._f_out = None
+
+class _ChunkedContents(io.RawIOBase):
+    def __init__(self, base_dir_path, chunks):
+        io.RawIOBase.__init__(self)
+        self._base_dir_path = base_dir_path
+        self._chunks = iter(chunks)
+        self._f_in = None
+    def readable(self):
+        return True
+    def readinto(self, buffer):
+        while True:
+            if self._f_in is None:
+                try:
+                    self._f_in = _open_citem(self._base_dir_path, *next(self._chunks))
+                except StopIteration:
+                    return 0
+            count = self._f_in.readinto(buffer)
+            if count:
+                return count
+            self._f_in.close()
+            self._f_in = None
+    def close(self):
+        if self._f_in is not None:
+            self._f_in.close()
+            self._f_in = None
+        io.RawIOBase.close(self)
+
 RepoMgmtKey = collections.namedtuple("RepoMgmtKey", ["base_dir_path", "ref_counter_path", "lock_file_path", "compressed"])
 
+# NB: looking up file sizes is I/O (latency) bound so threads are sufficient
+DEFAULT_VERIFY_JOBS = 16
+_VERIFY_BATCH_SIZE = 256
+
 class CIS(collections.namedtuple("CIS", ["stored_size", "ref_count"])):
     @property
     def stored_size_per_ref(self):
@@ -50,72 +369,133 @@ def get_repo_mgmt_key(repo_name):
     repo_spec = config.read_repo_spec(repo_name)
     return RepoMgmtKey(repo_spec.base_dir_path, _ref_counter_path(repo_spec.base_dir_path), _lock_file_path(repo_spec.base_dir_path), repo_spec.compressed)
 
-_REF_COUNT, _CONTENT_SIZE, _STORED_SIZE = range(3)
-
-class _BlobRepo(collections.namedtuple("_BlobRepo", ["ref_counter", "base_dir_path", "writeable", "compressed"])):
+class _BlobRepo(collections.namedtuple("_BlobRepo", ["citem_index", "base_dir_path", "writeable", "compressed", "packer"])):
+    @property
+    def codec_name(self):
+        # NB: repositories created before codecs were introduced don't have one
+        return self.citem_index.get_setting("codec", codec.DEFAULT_CODEC_NAME if self.compressed else codec.NONE.name)
+    @property
+    def raw_extensions(self):
+        raw_extensions = self.citem_index.get_setting("raw_extensions", None)
+        return codec.DEFAULT_RAW_EXTENSIONS if raw_extensions is None else raw_extensions.split()
+    @property
+    def hash_algorithm(self):
+        return digest.get_algorithm(self.citem_index.get_setting("hash", digest.LEGACY_ALGORITHM_NAME))
+    @property
+    def pack_threshold(self):
+        # NB: repositories created before packing was introduced don't pack
+        return int(self.citem_index.get_setting("pack_threshold", 0))
+    def _add_stored_blob(self, content_token, content_size, stored_blob, packed_data=None, chunked=False):
+        # NB: packed_data is the encoded content if it's to be packed
+        pack, pack_offset = (None, None) if packed_data is None else self.packer.append(packed_data)
+        self.citem_index.add(content_token, 1, content_size, stored_blob.stored_size, chunked=chunked, codec=stored_blob.codec_name, pack=pack, pack_offset=pack_offset)
+        if stored_blob.seconds_saved:
+            self.citem_index.incr_setting("raw_seconds_saved", stored_blob.seconds_saved)
+    def _store_blob(self, content_token, content_size, f_in, codec_name, raw=False, pack_threshold=0):
+        self._add_stored_blob(content_token, content_size, *_store_blob(self.base_dir_path, codec_name, content_token, content_size, f_in, raw, pack_threshold))
+    def _store_chunk_list(self, content_token, content_size, chunk_tokens, codec_name, pack_threshold):
+        # NB: the item records the size of the content (not of the list)
+        chunk_list = _chunk_list_bytes(chunk_tokens)
+        self._add_stored_blob(content_token, content_size, *_store_blob(self.base_dir_path, codec_name, content_token, len(chunk_list), io.BytesIO(chunk_list), False, pack_threshold), chunked=True)
+    def _store_chunk(self, chunk, codec_name, raw, pack_threshold, hash_algorithm):
+        content_token = hash_algorithm.get_token(chunk)
+        if not self.citem_index.incr_ref_count(content_token):
+            self._store_blob(content_token, len(chunk), io.BytesIO(chunk), codec_name, raw, pack_threshold)
+        return content_token
     def store_contents(self, file_path):
         assert self.writeable
+        hash_algorithm = self.hash_algorithm
         with open(file_path, "rb") as f_in:
-            content_token = hashlib.sha1(f_in.read()).hexdigest()
-            dir_name, subdir_name, file_name = _split_content_token(content_token)
-            dir_path = os.path.join(self.base_dir_path, dir_name)
-            subdir_path = os.path.join(dir_path, subdir_name)
-            needs_write = True
-            if dir_name not in self.ref_counter:
-                c_size = os.path.getsize(file_path)
-                self.ref_counter[dir_name] = { subdir_name : { file_name : [1, c_size, c_size] }}
-                os.mkdir(dir_path)
-                os.mkdir(subdir_path)
-            elif subdir_name not in self.ref_counter[dir_name]:
-                c_size = os.path.getsize(file_path)
-                self.ref_counter[dir_name][subdir_name] = { file_name : [1, c_size, c_size] }
-                os.mkdir(subdir_path)
-            elif file_name not in self.ref_counter[dir_name][subdir_name]:
-                c_size = os.path.getsize(file_path)
-                self.ref_counter[dir_name][subdir_name][file_name] = [1, c_size, c_size]
+            content_token = _get_content_token(f_in, hash_algorithm)
+            if self.citem_index.incr_ref_count(content_token):
+                # NB returning content storage stats here has been tried and
+                # rejected due to time penalties (3 orders of magnitude) on
+                # slow file systems such as cifs mounted network devices
+                return content_token
+            f_in.seek(0)
+            c_size = os.fstat(f_in.fileno()).st_size
+            codec_name = self.codec_name
+            raw = os.path.splitext(file_path)[1].lower() in self.raw_extensions
+            pack_threshold = self.pack_threshold
+            if self.chunking and c_size >= _CHUNKING_THRESHOLD:
+                # NB: the content is stored as a list of chunk tokens (each
+                # of which holds a reference to its chunk) under its own token
+                digester = hash_algorithm.new()
+                chunk_tokens = []
+                c_size = 0
+                for chunk in split_into_chunks(f_in):
+                    digester.update(chunk)
+                    c_size += len(chunk)
+                    chunk_tokens.append(self._store_chunk(chunk, codec_name, raw, pack_threshold, hash_algorithm))
+                if digester.hexdigest() != content_token:
+                    # NB: it changed after it was digested so (to keep the
+                    # item consistent with its chunks) it's what was chunked
+                    content_token = digester.hexdigest()
+                    if self.citem_index.incr_ref_count(content_token):
+                        for chunk_token in chunk_tokens:
+                            self.citem_index.incr_ref_count(chunk_token, -1)
+                        return content_token
+                self._store_chunk_list(content_token, c_size, chunk_tokens, codec_name, pack_threshold)
             else:
-                self.ref_counter[dir_name][subdir_name][file_name][_REF_COUNT] += 1
-                needs_write = False
-            if needs_write:
-                import stat
-                f_in.seek(0)
-                out_file_path = os.path.join(subdir_path, file_name)
-                if self.compressed:
-                    out_file_path += ".gz"
-                    OPEN = gzip.open
-                else:
-                    OPEN = open
-                with OPEN(out_file_path, "wb") as f_out:
-                    shutil.copyfileobj(f_in, f_out)
-                self.ref_counter[dir_name][subdir_name][file_name][_STORED_SIZE] = os.path.getsize(out_file_path)
-                os.chmod(out_file_path, stat.S_IRUSR|stat.S_IRGRP)
-            # NB returning content storage stats here has been tried and
-            # rejected due to time penalties (3 orders of magnitude) on
-            # slow file systems such as cifs mounted network devices
+                self._store_blob(content_token, c_size, f_in, codec_name, raw, pack_threshold)
         return content_token
+    @property
+    def chunking(self):
+        return bool(self.citem_index.get_setting("chunking", 0))
+    def reference_content(self, content_token):
+        # NB: for content that is known to be already stored (e.g. unchanged since last snapshot)
+        assert self.writeable
+        if not self.citem_index.incr_ref_count(content_token):
+            raise KeyError(content_token)
     def check_contents(self, file_path, content_token):
         with open(file_path, "rb") as f_in:
-            file_content_token = hashlib.sha1(f_in.read()).hexdigest()
+            file_content_token = _get_content_token(f_in, self.hash_algorithm)
         return content_token == file_content_token
-    def _content_stored_size(self, *token_parts):
-        file_path = os.path.join(self.base_dir_path, *token_parts)
-        if self.compressed: # try compressed first
-            try: # but allow for the case that they've been uncompressed
-                return os.path.getsize(file_path + ".gz")
-            except FileNotFoundError:
-                return os.path.getsize(file_path)
-        else: # try uncompressed first
-            try: # but allow for the case that they've been compressed
-                return os.path.getsize(file_path)
-            except FileNotFoundError:
-                return os.path.getsize(file_path + ".gz")
-    def get_content_storage_stats(self, content_token):
-        dir_name, subdir_name, file_name = _split_content_token(content_token)
-        return CIS(self._content_stored_size(dir_name, subdir_name, file_name), self.ref_counter[dir_name][subdir_name][file_name][_REF_COUNT])
+    def _content_stored_size(self, content_token, citem):
+        if citem.pack is not None:
+            return citem.stored_size
+        return os.path.getsize(_find_blob(self.base_dir_path, content_token, citem.codec)[0])
+    def get_content_storage_stats(self, content_token, verify=False):
+        # NB: the stored size recorded in the index unless asked to verify it
+        citem = self.citem_index.get(content_token)
+        if citem is None:
+            raise KeyError(content_token)
+        return CIS(self._content_stored_size(content_token, citem) if verify else citem.stored_size, citem.ref_count)
+    def get_chunk_tokens(self, content_token):
+        # NB: None if the content isn't chunked
+        citem = self.citem_index.get(content_token)
+        if citem is None:
+            raise KeyError(content_token)
+        return self._read_chunk_list(content_token, citem) if citem.chunked else None
+    def iterate_content_storage_stats(self, content_tokens, verify=False, jobs=None):
+        """Yield the (content token, storage stats) pairs for content_tokens
+        with the stored sizes recorded in the index or, if verify is True,
+        those of the stored files (looked up by jobs threads)"""
+        if not verify:
+            for content_token in content_tokens:
+                yield (content_token, self.get_content_storage_stats(content_token))
+            return
+        from concurrent.futures import ThreadPoolExecutor
+        jobs = jobs if jobs else DEFAULT_VERIFY_JOBS
+        content_tokens = iter(content_tokens)
+        with ThreadPoolExecutor(jobs) as executor:
+            while True:
+                # NB: in batches so that the number of futures is bounded
+                batch = []
+                for content_token in content_tokens:
+                    citem = self.citem_index.get(content_token)
+                    if citem is None:
+                        raise KeyError(content_token)
+                    batch.append((content_token, citem))
+                    if len(batch) >= jobs * _VERIFY_BATCH_SIZE:
+                        break
+                if not batch:
+                    break
+                for (content_token, citem), stored_size in zip(batch, executor.map(lambda item: self._content_stored_size(*item), batch)):
+                    yield (content_token, CIS(stored_size, citem.ref_count))
     def release_content(self, content_token):
         assert self.writeable
-        dir_name, subdir_name, file_name = _split_content_token(content_token)
-        self.ref_counter[dir_name][subdir_name][file_name][_REF_COUNT] -= 1
+        self.citem_index.incr_ref_count(content_token, -1)
     def release_contents(self, content_tokens, progress_indicator=utils.DummyProgressThingy()):
         assert self.writeable
         try:
@@ -123,101 +503,358 @@ class _BlobRepo(collections.namedtuple("_BlobRepo", ["ref_counter", "base_dir_pa
         except TypeError:
             pass # content_tokens is an iterater so assume caller set the total
         for content_token in content_tokens:
-            dir_name, subdir_name, file_name = _split_content_token(content_token)
-            self.ref_counter[dir_name][subdir_name][file_name][_REF_COUNT] -= 1
+            self.citem_index.incr_ref_count(content_token, -1)
             progress_indicator.increment_count()
         progress_indicator.finished()
     def iterate_content_tokens(self):
-        for dir_name, dir_data in self.ref_counter.items():
-            for subdir_name, subdir_data in dir_data.items():
-                for file_name, data in subdir_data.items():
-                    yield (dir_name + subdir_name + file_name, data[_REF_COUNT], data[_CONTENT_SIZE], data[_STORED_SIZE])
+        return self.citem_index.iterate()
     def get_counts(self):
-        num_refed = 0
-        num_unrefed = 0
-        ref_total = 0
-        for dir_data in self.ref_counter.values():
-            for subdir_data in dir_data.values():
-                for count, c_size, s_size in subdir_data.values():
-                    if count:
-                        ref_total += count
-                        num_refed += 1
-                    else:
-                        num_unrefed += 1
-        return (num_refed, num_unrefed, ref_total)
+        return self.citem_index.get_counts()
+    def get_session_counts(self):
+        # NB: unlike get_counts() this doesn't have to visit every item
+        return self.citem_index.get_session_counts()
     def prune_unreferenced_content(self, rm_empty_dirs=False, rm_empty_subdirs=True, progress_indicator=utils.DummyProgressThingy()):
         assert self.writeable
         citem_count = 0
         total_content_bytes = 0
         total_stored_bytes = 0
-        progress_indicator.set_expected_total(len(self.ref_counter))
-        for dir_name, dir_data in list(self.ref_counter.items()):
-            for subdir_name, subdir_data in list(dir_data.items()):
-                for file_name, file_data in list(subdir_data.items()):
-                    count, content_size, stored_size = file_data
-                    if count: continue
-                    citem_count += 1
-                    total_content_bytes += content_size
-                    total_stored_bytes += stored_size
-                    file_path = os.path.join(self.base_dir_path, dir_name, subdir_name, file_name)
-                    try: # try the default first
-                        os.remove(file_path + ".gz")
-                    except FileNotFoundError:
-                        os.remove(file_path)
-                    del subdir_data[file_name]
-                if rm_empty_subdirs and len(dir_data[subdir_name]) == 0:
-                    del dir_data[subdir_name]
+        # NB: don't modify the index while iterating over it
+        unreferenced = list(self.citem_index.iterate_unreferenced())
+        progress_indicator.set_expected_total(len(unreferenced))
+        touched_subdirs = set()
+        while unreferenced:
+            for content_token, content_size, stored_size, chunked, codec_name, pack in unreferenced:
+                citem_count += 1
+                # NB: a chunked item's content is counted via its chunks
+                total_content_bytes += 0 if chunked else content_size
+                total_stored_bytes += stored_size
+                if chunked:
+                    # NB: which may make some chunks unreferenced
+                    for chunk_token in self._read_chunk_list(content_token, self.citem_index.get(content_token)):
+                        self.citem_index.incr_ref_count(chunk_token, -1)
+                # NB: the space used by packed items is reclaimed by repacking
+                if pack is None:
+                    dir_name, subdir_name, _file_name = _split_content_token(content_token)
+                    os.remove(_find_blob(self.base_dir_path, content_token, codec_name)[0])
+                    touched_subdirs.add((dir_name, subdir_name))
+                self.citem_index.delete(content_token)
+                progress_indicator.increment_count()
+            unreferenced = list(self.citem_index.iterate_unreferenced())
+            if unreferenced:
+                progress_indicator.set_expected_total(citem_count + len(unreferenced))
+        if rm_empty_subdirs:
+            for dir_name, subdir_name in sorted(touched_subdirs):
+                if not self.citem_index.has_prefix(dir_name + subdir_name):
                     os.rmdir(os.path.join(self.base_dir_path, dir_name, subdir_name))
-            if rm_empty_dirs and len(self.ref_counter[dir_name]) == 0:
-                del self.ref_counter[dir_name]
-                os.rmdir(os.path.join(self.base_dir_path, dir_name))
-            progress_indicator.increment_count()
+        if rm_empty_dirs:
+            for dir_name in sorted(set(dir_name for dir_name, _subdir_name in touched_subdirs)):
+                if not self.citem_index.has_prefix(dir_name):
+                    os.rmdir(os.path.join(self.base_dir_path, dir_name))
         progress_indicator.finished()
         return (citem_count, total_content_bytes, total_stored_bytes) #if citem_count else None
+    def _read_chunk_list(self, content_token, citem):
+        with _open_citem(self.base_dir_path, content_token, citem) as f_in:
+            return f_in.read().decode().split()
+    def _open_contents(self, content_token):
+        citem = self.citem_index.get(content_token)
+        if citem is None:
+            return _open_blob(self.base_dir_path, content_token)
+        if citem.chunked:
+            chunks = [(chunk_token, self.citem_index.get(chunk_token)) for chunk_token in self._read_chunk_list(content_token, citem)]
+            return io.BufferedReader(_ChunkedContents(self.base_dir_path, chunks))
+        return _open_citem(self.base_dir_path, content_token, citem)
     def open_contents_read_only(self, content_token, binary=False):
-        # NB since this doen't use ref count data it doesn't need locking
+        # NB since the returned file doesn't use ref count data it can
+        # be read after the lock has been released
         # TODO: make this a context manager
-        file_path = os.path.join(self.base_dir_path, *_split_content_token(content_token))
-        try:
-            return gzip.open(file_path + ".gz", "rb" if binary else "rt")
-        except FileNotFoundError:
-            return open(file_path, "rb" if binary else "r")
+        f_in = self._open_contents(content_token)
+        return f_in if binary else io.TextIOWrapper(f_in)
     def copy_contents_to(self, content_token, target_file_path, attributes):
         from . import excpns
-        file_path = os.path.join(self.base_dir_path, *_split_content_token(content_token))
+        import stat
         try:
-            with open(target_file_path, "wb") as f_out:
-                try: # try compressed first as that is the default
-                    with gzip.open(file_path + ".gz", "rb") as f_in:
-                        shutil.copyfileobj(f_in, f_out)
-                except FileNotFoundError:
-                    with open(file_path, "rb") as f_in:
-                        shutil.copyfileobj(f_in, f_out)
+            f_out = open(target_file_path, "wb")
         except OSError as edata:
             raise excpns.CopyFileFailed(target_file_path, os.strerror(edata.errno))
+        with f_out:
+            try:
+                with self._open_contents(content_token) as f_in:
+                    _copy_file_contents(f_in, f_out)
+                f_out.flush()
+            except OSError as edata:
+                raise excpns.CopyFileFailed(target_file_path, os.strerror(edata.errno))
+            # NB: use the open file to save looking up the path each time
+            fd_out = f_out.fileno()
+            try:
+                os.chmod(fd_out, attributes.st_mode)
+                os.utime(fd_out, (attributes.st_atime, attributes.st_mtime))
+                os.chown(fd_out, attributes.st_uid, attributes.st_gid)
+                if attributes.st_mode & (stat.S_ISUID | stat.S_ISGID):
+                    # NB: changing the owner clears these
+                    os.chmod(fd_out, attributes.st_mode)
+            except OSError as edata:
+                raise excpns.SetAttributesFailed(target_file_path, os.strerror(edata.errno))
+    def link_contents_to(self, content_token, target_file_path, attributes):
+        """Hard link target_file_path to the content's stored file if it's
+        stored (unencoded) in its own file on the same file system and
+        the stored file's attributes can be made to match attributes.
+        Linked files are read only (as changing them would corrupt the
+        repository) and the caller should copy the content if this
+        returns False."""
+        import errno
+        import stat
+        from . import excpns
+        # NB: the caller has decided that the target is to be replaced and
+        # it mustn't be written to as it may be linked to stored content
         try:
-            os.chmod(target_file_path, attributes.st_mode)
-            os.utime(target_file_path, (attributes.st_atime, attributes.st_mtime))
-            os.chown(target_file_path, attributes.st_uid, attributes.st_gid)
+            if os.path.lexists(target_file_path):
+                os.remove(target_file_path)
         except OSError as edata:
-            raise excpns.SetAttributesFailed(target_file_path, os.strerror(edata.errno))
+            raise excpns.CopyFileFailed(target_file_path, os.strerror(edata.errno))
+        citem = self.citem_index.get(content_token)
+        if citem is None or citem.chunked or citem.pack is not None:
+            return False
+        try:
+            file_path, blob_codec = _find_blob(self.base_dir_path, content_token, citem.codec)
+            blob_stat = os.stat(file_path)
+        except FileNotFoundError:
+            return False
+        mode = stat.S_IMODE(attributes.st_mode) & (stat.S_IRUSR | stat.S_IXUSR | stat.S_IRGRP | stat.S_IXGRP | stat.S_IROTH | stat.S_IXOTH)
+        if blob_codec is not codec.NONE or not mode & stat.S_IRUSR or (blob_stat.st_uid, blob_stat.st_gid) != (attributes.st_uid, attributes.st_gid):
+            return False
+        if stat.S_IMODE(blob_stat.st_mode) != mode or abs(blob_stat.st_mtime - attributes.st_mtime) > 1e-6:
+            if blob_stat.st_nlink > 1:
+                return False # it's already linked with other attributes
+            try:
+                os.chmod(file_path, mode)
+                os.utime(file_path, (attributes.st_atime, attributes.st_mtime))
+            except PermissionError:
+                return False
+        try:
+            os.link(file_path, target_file_path)
+        except OSError as edata:
+            if edata.errno in (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP):
+                return False
+            raise excpns.CopyFileFailed(target_file_path, os.strerror(edata.errno))
+        return True
+
+def _digest_file(file_path, chunking, hash_algorithm_name):
+    # NB: runs in a worker process
+    hash_algorithm = digest.get_algorithm(hash_algorithm_name)
+    with open(file_path, "rb") as f_in:
+        content_size = os.fstat(f_in.fileno()).st_size
+        if not chunking or content_size < _CHUNKING_THRESHOLD:
+            return (_get_content_token(f_in, hash_algorithm), content_size, None)
+        # NB: one pass to get the content token and the chunks' tokens
+        digester = hash_algorithm.new()
+        chunks = []
+        offset = 0
+        for chunk in split_into_chunks(f_in):
+            digester.update(chunk)
+            chunks.append((hash_algorithm.get_token(chunk), offset, len(chunk)))
+            offset += len(chunk)
+        return (digester.hexdigest(), content_size, chunks)
+
+class _ContentChanged(Exception):
+    # NB: a file changed between being digested and (a chunk) being stored
+    pass
+
+def _store_file_region(base_dir_path, codec_name, content_token, file_path, offset, length, raw, pack_threshold, hash_algorithm_name):
+    # NB: runs in a worker process (and content to be packed is returned)
+    with open(file_path, "rb") as f_in:
+        if length is None:
+            return _store_blob(base_dir_path, codec_name, content_token, os.fstat(f_in.fileno()).st_size, f_in, raw, pack_threshold)
+        f_in.seek(offset)
+        chunk = f_in.read(length)
+        # NB: a chunk stored under the wrong token would be shared by any
+        # content that (really) has that chunk so it's checked first
+        if digest.get_algorithm(hash_algorithm_name).get_token(chunk) != content_token:
+            raise _ContentChanged(file_path)
+        return _store_blob(base_dir_path, codec_name, content_token, length, io.BytesIO(chunk), raw, pack_threshold)
+
+class _PendingCItem:
+    def __init__(self, futures, content_size, chunk_tokens=None):
+        self.futures = futures
+        self.ref_count = 1
+        self.content_size = content_size
+        self.chunk_tokens = chunk_tokens
+    def done(self):
+        return all(future.done() for future in self.futures)
+    def exception(self):
+        for future in self.futures:
+            if future.exception() is not None:
+                return future.exception()
+        return None
+
+class ParallelContentStorer:
+    """Store file contents using a pool of worker processes to do the
+    (CPU intensive) digesting and compressing.  The index is only ever
+    updated in this process and the callbacks are called in the order
+    in which the files were submitted."""
+    def __init__(self, blob_repo, executor, max_queued):
+        assert blob_repo.writeable
+        self._blob_repo = blob_repo
+        self._executor = executor
+        self._max_queued = max_queued
+        self._chunking = blob_repo.chunking
+        self._codec_name = blob_repo.codec_name
+        self._raw_extensions = blob_repo.raw_extensions
+        self._pack_threshold = blob_repo.pack_threshold
+        self._hash_algorithm_name = blob_repo.hash_algorithm.name
+        self._queue = collections.deque()
+        self._pending = collections.OrderedDict()
+    def store_contents(self, file_path, callback):
+        # NB: callback(content_token, edata) where content_token is None on failure
+        future = self._executor.submit(_digest_file, file_path, self._chunking, self._hash_algorithm_name)
+        self._queue.append([file_path, future, callback, None])
+        while self._queue and (len(self._queue) > self._max_queued or self._queue[0][1].done()):
+            self._finish_oldest()
+    def finish(self):
+        while self._queue:
+            self._finish_oldest()
+        self._complete_pending(wait=True)
+    def _reference(self, content_token):
+        if self._blob_repo.citem_index.incr_ref_count(content_token):
+            return True
+        pending_citem = self._pending.get(content_token, None)
+        if pending_citem is not None:
+            pending_citem.ref_count += 1
+            return True
+        return False
+    def _release(self, content_token):
+        pending_citem = self._pending.get(content_token, None)
+        if pending_citem is not None:
+            pending_citem.ref_count -= 1
+        else:
+            self._blob_repo.citem_index.incr_ref_count(content_token, -1)
+    def _submit_store(self, content_token, content_size, file_path, offset=0, length=None):
+        future = self._executor.submit(_store_file_region, self._blob_repo.base_dir_path, self._codec_name, content_token, file_path, offset, length, os.path.splitext(file_path)[1].lower() in self._raw_extensions, self._pack_threshold, self._hash_algorithm_name)
+        self._pending[content_token] = _PendingCItem([future], content_size)
+    def _digested(self, file_path, content_token, content_size, chunks):
+        if self._reference(content_token):
+            pass
+        elif chunks is None:
+            self._submit_store(content_token, content_size, file_path)
+        else:
+            futures = []
+            for chunk_token, offset, length in chunks:
+                if not self._reference(chunk_token):
+                    self._submit_store(chunk_token, length, file_path, offset, length)
+                pending_citem = self._pending.get(chunk_token, None)
+                if pending_citem is not None:
+                    futures += pending_citem.futures
+            chunk_tokens = [chunk[0] for chunk in chunks]
+            self._pending[content_token] = _PendingCItem(futures, content_size, chunk_tokens)
+        pending_citem = self._pending.get(content_token, None)
+        return [] if pending_citem is None else pending_citem.futures
+    def _finish_oldest(self):
+        item = self._queue[0]
+        file_path, future, callback, futures = item
+        if futures is None:
+            try:
+                content_token, content_size, chunks = future.result()
+            except OSError as edata:
+                self._queue.popleft()
+                callback(None, edata)
+                return
+            item[1] = content_token
+            item[3] = futures = self._digested(file_path, content_token, content_size, chunks)
+        self._complete_pending(wait=False)
+        for future in futures:
+            if future.exception() is not None:
+                self._queue.popleft()
+                self._release(item[1])
+                if isinstance(future.exception(), _ContentChanged):
+                    # NB: store it here (where each chunk is digested and
+                    # stored from the same read) once nothing is pending
+                    # so that no item is added to the index twice
+                    self._complete_pending(wait=True)
+                    try:
+                        content_token = self._blob_repo.store_contents(file_path)
+                    except OSError as edata:
+                        callback(None, edata)
+                    else:
+                        callback(content_token, None)
+                    return
+                callback(None, future.exception())
+                return
+        self._queue.popleft()
+        callback(item[1], None)
+    def _complete_pending(self, wait):
+        while self._pending:
+            content_token, pending_citem = next(iter(self._pending.items()))
+            if not wait and not pending_citem.done():
+                break
+            del self._pending[content_token]
+            if pending_citem.exception() is not None:
+                if pending_citem.chunk_tokens is not None:
+                    for chunk_token in pending_citem.chunk_tokens:
+                        self._release(chunk_token)
+                continue
+            if pending_citem.chunk_tokens is None:
+                self._blob_repo._add_stored_blob(content_token, pending_citem.content_size, *pending_citem.futures[0].result())
+            else:
+                self._blob_repo._store_chunk_list(content_token, pending_citem.content_size, pending_citem.chunk_tokens, self._codec_name, self._pack_threshold)
+            if pending_citem.ref_count != 1:
+                self._blob_repo.citem_index.incr_ref_count(content_token, pending_citem.ref_count - 1)
+
+def _migrate_ref_counter(repo_mgmt_key, index_path):
+    import fcntl
+    with open(repo_mgmt_key.lock_file_path, "wb") as f_obj:
+        fcntl.lockf(f_obj, fcntl.LOCK_EX)
+        try:
+            if not os.path.exists(index_path): # someone may have beaten us to it
+                cindex.migrate_ref_counter(repo_mgmt_key.ref_counter_path, index_path)
+        finally:
+            fcntl.lockf(f_obj, fcntl.LOCK_UN)
 
 @contextmanager
-def open_repo_mgr(repo_mgmt_key, writeable=False):
+def _repo_lock(lock_file_path, exclusive):
     import fcntl
-    with open(repo_mgmt_key.lock_file_path, "wb" if writeable else "rb") as f_obj:
-        fcntl.lockf(f_obj, fcntl.LOCK_EX if writeable else fcntl.LOCK_SH)
-        with open(repo_mgmt_key.ref_counter_path, "rb") as ref_in:
-            ref_counter = pickle.load(ref_in)
+    with open(lock_file_path, "wb" if exclusive else "rb") as f_obj:
+        fcntl.lockf(f_obj, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
         try:
-            yield _BlobRepo(ref_counter, repo_mgmt_key.base_dir_path, writeable, compressed=repo_mgmt_key.compressed)
+            yield
         finally:
-            if writeable:
-                with open(repo_mgmt_key.ref_counter_path, "wb") as ref_out:
-                    pickle.dump(ref_counter, ref_out, pickle.HIGHEST_PROTOCOL)
             fcntl.lockf(f_obj, fcntl.LOCK_UN)
 
-def initialize_repo(repo_spec):
+@contextmanager
+def open_repo_mgr(repo_mgmt_key, writeable=False, exclusive=False):
+    # NB: sessions that only add content or change reference counts can
+    # share the repository with each other (and readers) but maintenance
+    # operations that rearrange or remove stored content need exclusivity
+    from . import excpns
+    index_path = _index_path(repo_mgmt_key.base_dir_path)
+    if not os.path.exists(index_path) and os.path.exists(repo_mgmt_key.ref_counter_path):
+        # a repository created before the index was introduced
+        # NB: this has to be done before we take our own lock
+        try:
+            _migrate_ref_counter(repo_mgmt_key, index_path)
+        except OSError:
+            if writeable:
+                raise
+    with _repo_lock(repo_mgmt_key.lock_file_path, exclusive):
+        if os.path.exists(_rehash_journal_path(repo_mgmt_key.base_dir_path)):
+            raise excpns.RehashIncomplete(repo_mgmt_key.base_dir_path)
+        try:
+            citem_index = cindex.open_index(index_path, writeable)
+        except FileNotFoundError:
+            if writeable or not os.path.exists(repo_mgmt_key.ref_counter_path):
+                raise
+            # it couldn't be migrated e.g. read only media during an exigency restore
+            citem_index = cindex.open_ref_counter_as_index(repo_mgmt_key.ref_counter_path)
+        packer = _Packer(repo_mgmt_key.base_dir_path, citem_index) if writeable else None
+        try:
+            yield _BlobRepo(citem_index, repo_mgmt_key.base_dir_path, writeable, compressed=repo_mgmt_key.compressed, packer=packer)
+        finally:
+            if packer is not None:
+                packer.close()
+            # NB: commit even if there was an exception as content may have been stored
+            citem_index.close(commit=writeable)
+
+_normalize_extension = lambda extension: (extension if extension.startswith(".") else "." + extension).lower()
+
+def initialize_repo(repo_spec, chunking=False, codec_name=None, raw_extensions=None, pack_threshold=DEFAULT_PACK_THRESHOLD, hash_algorithm_name=None):
     from . import excpns
     try:
         os.makedirs(repo_spec.base_dir_path)
@@ -225,19 +862,26 @@ def initialize_repo(repo_spec):
         raise excpns.RepositoryLocationExists(repo_spec.name)
     except PermissionError:
         raise excpns.RepositoryLocationNoPerm(repo_spec.name)
-    ref_counter_path = _ref_counter_path(repo_spec.base_dir_path)
-    with open(ref_counter_path, "wb") as f_obj:
-        pickle.dump(dict(), f_obj, pickle.HIGHEST_PROTOCOL)
+    if codec_name is None:
+        codec_name = codec.DEFAULT_CODEC_NAME if repo_spec.compressed else codec.NONE.name
+    if hash_algorithm_name is None:
+        hash_algorithm_name = digest.DEFAULT_ALGORITHM_NAME
+    settings = {"chunking": int(chunking), "codec": codec_name, "pack_threshold": pack_threshold, "hash": digest.get_algorithm(hash_algorithm_name).name}
+    if raw_extensions is not None:
+        settings["raw_extensions"] = " ".join(_normalize_extension(extension) for extension in raw_extensions)
+    cindex.create_index(_index_path(repo_spec.base_dir_path), settings)
     lock_file_path = _lock_file_path(repo_spec.base_dir_path)
     with open(lock_file_path, "wb") as f_obj:
         f_obj.write(b"content_repo_lock")
 
-def create_new_repo(repo_name, location_dir_path, compressed):
+def create_new_repo(repo_name, location_dir_path, compressed, chunking=False, codec_name=None, raw_extensions=None, pack_threshold=DEFAULT_PACK_THRESHOLD, hash_algorithm_name=None):
     from . import config
     from . import excpns
+    if codec_name is not None:
+        compressed = codec.get_codec(codec_name) is not codec.NONE
     repo_spec = config.write_repo_spec(repo_name, location_dir_path, compressed)
     try:
-        initialize_repo(repo_spec)
+        initialize_repo(repo_spec, chunking, codec_name, raw_extensions, pack_threshold, hash_algorithm_name)
     except (OSError, excpns.Error) as edata:
         config.delete_repo_spec(repo_spec.name)
         raise edata
@@ -246,53 +890,573 @@ def delete_repo(repo_name):
     from . import excpns
     from . import config
     rmk = get_repo_mgmt_key(repo_name)
-    with open_repo_mgr(rmk, writeable=True) as repo_mgr:
+    with open_repo_mgr(rmk, writeable=True, exclusive=True) as repo_mgr:
         refed, _unrefed, _total = repo_mgr.get_counts()
         if refed:
             raise excpns.RepositoryInUse(repo_name, refed)
         config.delete_repo_spec(repo_name)
         repo_mgr.prune_unreferenced_content(rm_empty_dirs=True, rm_empty_subdirs=True)
-    os.remove(rmk.ref_counter_path)
+    for dir_path in [_packs_dir_path(rmk.base_dir_path), _trash_dir_path(rmk.base_dir_path)]:
+        if os.path.isdir(dir_path):
+            shutil.rmtree(dir_path)
+    for file_path in [_maintenance_lock_file_path(rmk.base_dir_path), _scrub_state_path(rmk.base_dir_path)]:
+        if os.path.exists(file_path):
+            os.remove(file_path)
+    os.remove(_index_path(rmk.base_dir_path))
+    if os.path.exists(rmk.ref_counter_path + ".migrated"):
+        os.remove(rmk.ref_counter_path + ".migrated")
     os.remove(rmk.lock_file_path)
     os.rmdir(rmk.base_dir_path)
 
-def compress_repository(repo_name):
-    from . import utils
-    saved_bytes = 0
+# NB: removing files is I/O bound so threads are sufficient
+DEFAULT_PRUNE_JOBS = 4
+
+@contextmanager
+def _maintenance_lock(base_dir_path):
+    # NB: only one prune, recode, repack or scrub at a time but it doesn't
+    # exclude other users of the repository
+    import fcntl
+    with open(_maintenance_lock_file_path(base_dir_path), "wb") as f_obj:
+        fcntl.lockf(f_obj, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.lockf(f_obj, fcntl.LOCK_UN)
+
+_trash_file_path = lambda base_dir_path, file_path: os.path.join(base_dir_path, _TRASH_DIR_NAME, "".join(os.path.relpath(file_path, base_dir_path).split(os.sep)))
+
+def _restore_from_trash(base_dir_path, trash_file_path):
+    file_path = os.path.join(base_dir_path, *_split_content_token(os.path.basename(trash_file_path)))
+    try:
+        os.rename(trash_file_path, file_path)
+    except FileNotFoundError:
+        # NB: its directory may have been removed by an interrupted prune
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        os.rename(trash_file_path, file_path)
+
+def _move_to_trash(base_dir_path, file_path):
+    # NB: returns None if the file doesn't exist
+    trash_file_path = _trash_file_path(base_dir_path, file_path)
+    try:
+        os.rename(file_path, trash_file_path)
+    except FileNotFoundError:
+        if os.path.exists(file_path):
+            os.makedirs(os.path.dirname(trash_file_path), exist_ok=True)
+            os.rename(file_path, trash_file_path)
+        else:
+            return None
+    return trash_file_path
+
+def _recover_trash(repo_mgr):
+    # NB: files left in the trash by an interrupted prune are restored if
+    # they're still in the index and returned for removal otherwise
+    trash_dir_path = _trash_dir_path(repo_mgr.base_dir_path)
+    try:
+        file_names = os.listdir(trash_dir_path)
+    except FileNotFoundError:
+        return []
+    obsolete_file_paths = []
+    for file_name in file_names:
+        trash_file_path = os.path.join(trash_dir_path, file_name)
+        content_token = file_name.split(".")[0]
+        if content_token in repo_mgr.citem_index:
+            _restore_from_trash(repo_mgr.base_dir_path, trash_file_path)
+        else:
+            obsolete_file_paths.append(trash_file_path)
+    return obsolete_file_paths
+
+def prune_repository(repo_name, jobs=DEFAULT_PRUNE_JOBS, progress_indicator=utils.DummyProgressThingy()):
+    """Remove the repository's unreferenced content items and any stored
+    files that don't belong to a content item.  The repository is only
+    locked while the candidates are found (shared) and while the index is
+    updated (exclusive) with the files being moved to the trash and
+    removed (by jobs threads) while it isn't locked.  Candidates that are
+    referenced again before the index is updated are restored."""
+    from concurrent.futures import ThreadPoolExecutor
+    import time
     rmk = get_repo_mgmt_key(repo_name)
-    for entry_name in os.listdir(rmk.base_dir_path):
-        entry_path = os.path.join(rmk.base_dir_path, entry_name)
-        if not os.path.isdir(entry_path): continue
-        with open_repo_mgr(rmk, True) as repo_mgr: # don't hog the lock
-            for subdir_name in os.listdir(entry_path):
-                subdir_path = os.path.join(entry_path, subdir_name)
-                if not os.path.isdir(subdir_path): continue
-                for file_name in os.listdir(subdir_path):
-                    if not file_name.endswith(".gz"):
-                        file_data = repo_mgr.ref_counter[entry_name][subdir_name][file_name]
-                        old_size = file_data[_STORED_SIZE]
-                        file_data[_STORED_SIZE] = utils.compress_file(os.path.join(subdir_path, file_name))
-                        saved_bytes += old_size - file_data[_STORED_SIZE]
-    return saved_bytes
-
-def uncompress_repository(repo_name):
-    from . import utils
-    extra_bytes = 0
+    citem_count = 0
+    total_content_bytes = 0
+    total_stored_bytes = 0
+    start_time = time.time()
+    with _maintenance_lock(rmk.base_dir_path), ThreadPoolExecutor(jobs) as executor:
+        with open_repo_mgr(rmk, False) as repo_mgr:
+            obsolete_file_paths = _recover_trash(repo_mgr)
+        while True:
+            list(executor.map(os.remove, obsolete_file_paths))
+            with open_repo_mgr(rmk, False) as repo_mgr:
+                unreferenced = list(repo_mgr.citem_index.iterate_unreferenced())
+                # NB: the chunk lists need to be read before they're trashed
+                chunk_lists = {content_token: repo_mgr._read_chunk_list(content_token, repo_mgr.citem_index.get(content_token)) for content_token, _cs, _ss, chunked, _cn, _p in unreferenced if chunked}
+            if not unreferenced:
+                break
+            progress_indicator.set_expected_total(citem_count + len(unreferenced))
+            loose_items = [(content_token, codec_name) for content_token, _cs, _ss, _c, codec_name, pack in unreferenced if pack is None]
+            trash_file_paths = dict(zip([content_token for content_token, _cn in loose_items], executor.map(lambda item: _move_to_trash(rmk.base_dir_path, _find_blob(rmk.base_dir_path, *item)[0]), loose_items)))
+            obsolete_file_paths = []
+            touched_subdirs = set()
+            with open_repo_mgr(rmk, True, exclusive=True) as repo_mgr:
+                for content_token, content_size, stored_size, chunked, codec_name, pack in unreferenced:
+                    trash_file_path = trash_file_paths.get(content_token, None)
+                    citem = repo_mgr.citem_index.get(content_token)
+                    if citem is not None and citem.ref_count:
+                        # NB: referenced again while we weren't looking
+                        if trash_file_path is not None:
+                            _restore_from_trash(rmk.base_dir_path, trash_file_path)
+                        continue
+                    if trash_file_path is not None:
+                        obsolete_file_paths.append(trash_file_path)
+                        touched_subdirs.add(_split_content_token(content_token)[:2])
+                    if citem is None:
+                        continue
+                    citem_count += 1
+                    # NB: a chunked item's content is counted via its chunks
+                    total_content_bytes += 0 if chunked else content_size
+                    total_stored_bytes += stored_size
+                    if chunked:
+                        # NB: which may make some chunks unreferenced
+                        for chunk_token in chunk_lists[content_token]:
+                            repo_mgr.citem_index.incr_ref_count(chunk_token, -1)
+                    repo_mgr.citem_index.delete(content_token)
+                    progress_indicator.increment_count()
+                for dir_name, subdir_name in sorted(touched_subdirs):
+                    if not repo_mgr.citem_index.has_prefix(dir_name + subdir_name):
+                        os.rmdir(os.path.join(rmk.base_dir_path, dir_name, subdir_name))
+        # NB: files stored by sessions that died before their items were
+        # committed to the index are found without locking but, as their
+        # items may still be in a running session's buffer, they're only
+        # confirmed as orphans while no session can be running
+        orphaned = _find_orphaned_files(rmk, start_time)
+        if orphaned:
+            with open_repo_mgr(rmk, True, exclusive=True) as repo_mgr:
+                orphaned = [file_path for file_path in orphaned if _is_orphaned_file(rmk.base_dir_path, repo_mgr.citem_index, file_path)]
+                list(executor.map(os.remove, orphaned))
+    progress_indicator.finished()
+    return (citem_count, total_content_bytes, total_stored_bytes, len(orphaned))
+
+# NB: the number of content items (per worker) recoded per lock hold
+_RECODE_BATCH_SIZE = 32
+
+def _recode_citem(base_dir_path, content_token, citem, to_codec_name):
+    # NB: runs in a worker process and the new version of a loose item is
+    # written to a temporary file that is only renamed while locked
+    if citem.pack is None:
+        from_file_path, from_codec = _find_blob(base_dir_path, content_token, citem.codec)
+        with from_codec.open(from_file_path, "rb") as f_in:
+            return (_encode_blob(os.path.join(base_dir_path, *_split_content_token(content_token)), to_codec_name, f_in, tmp_suffix=".tmp"), None)
+    with _open_citem(base_dir_path, content_token, citem) as f_in:
+        return _encode_data(to_codec_name, f_in.read())
+
+def _get_recode_batch(repo_mgr, position, needs_recoding, batch_size):
+    # NB: returns the batch and the token of the last item considered
+    batch = []
+    for content_token, codec_name in repo_mgr.citem_index.iterate_codecs(position, batch_size):
+        position = content_token
+        if codec_name is None: # find out what it actually is
+            codec_name = _find_blob(repo_mgr.base_dir_path, content_token)[1].name
+        if needs_recoding(codec_name):
+            citem = repo_mgr.citem_index.get(content_token)
+            batch.append((content_token, citem, citem._replace(codec=codec_name)))
+    return (batch, position)
+
+def _recode_repository(repo_name, to_codec, needs_recoding, recode_key, jobs=None, progress_indicator=utils.DummyProgressThingy()):
+    """Recode (in parallel) the repository's content items for which
+    needs_recoding(codec_name) is true.  The repository is only locked
+    (exclusively) while each batch of results is committed and, as the
+    position reached is committed with them, an interrupted recode with
+    the same recode_key resumes where it left off."""
+    from concurrent.futures import ProcessPoolExecutor
     rmk = get_repo_mgmt_key(repo_name)
-    for entry_name in os.listdir(rmk.base_dir_path):
-        entry_path = os.path.join(rmk.base_dir_path, entry_name)
-        if not os.path.isdir(entry_path): continue
-        with open_repo_mgr(rmk, True) as repo_mgr: # don't hog the lock
-            for subdir_name in os.listdir(entry_path):
-                subdir_path = os.path.join(entry_path, subdir_name)
-                if not os.path.isdir(subdir_path): continue
-                for file_name in os.listdir(subdir_path):
-                    if file_name.endswith(".gz"):
-                        file_data = repo_mgr.ref_counter[entry_name][subdir_name][file_name[:-3]]
-                        old_size = file_data[_STORED_SIZE]
-                        file_data[_STORED_SIZE] = utils.uncompress_file(os.path.join(subdir_path, file_name))
-                        extra_bytes += file_data[_STORED_SIZE] - old_size
-    return extra_bytes
+    jobs = jobs if jobs else os.cpu_count() or 1
+    size_change = 0
+    with _maintenance_lock(rmk.base_dir_path), ProcessPoolExecutor(jobs) as executor:
+        with open_repo_mgr(rmk, False) as repo_mgr:
+            key, position = repo_mgr.citem_index.get_setting("recode_state", " ").split(" ")
+            if key != recode_key:
+                position = ""
+            progress_indicator.set_expected_total(sum(content_bytes for codec_name, _items, content_bytes, _stored_bytes in repo_mgr.citem_index.get_codec_totals(position) if codec_name is None or needs_recoding(codec_name)))
+        while True:
+            with open_repo_mgr(rmk, False) as repo_mgr:
+                batch, next_position = _get_recode_batch(repo_mgr, position, needs_recoding, jobs * _RECODE_BATCH_SIZE)
+            if next_position == position:
+                break
+            if not batch:
+                position = next_position
+                continue
+            futures = [executor.submit(_recode_citem, rmk.base_dir_path, content_token, from_citem, to_codec.name) for content_token, _citem, from_citem in batch]
+            obsolete_file_paths = []
+            try:
+                with open_repo_mgr(rmk, True, exclusive=True) as repo_mgr:
+                    for (content_token, citem, from_citem), future in zip(batch, futures):
+                        try:
+                            stored_blob, packed_data = future.result()
+                        except OSError:
+                            continue # it'll be tried again next time (if it still exists)
+                        current_citem = repo_mgr.citem_index.get(content_token)
+                        if current_citem is None or current_citem[1:] != citem[1:]:
+                            # NB: it was pruned, repacked, etc. while being recoded
+                            if packed_data is None:
+                                os.remove(_find_blob(rmk.base_dir_path, content_token, stored_blob.codec_name)[0] + ".tmp")
+                            continue
+                        if packed_data is None:
+                            to_file_path = _find_blob(rmk.base_dir_path, content_token, stored_blob.codec_name)[0]
+                            os.replace(to_file_path + ".tmp", to_file_path)
+                            from_file_path = _find_blob(rmk.base_dir_path, content_token, from_citem.codec)[0]
+                            # NB: the suffix may be the same (e.g. a different level)
+                            if from_file_path != to_file_path:
+                                obsolete_file_paths.append(from_file_path)
+                            repo_mgr.citem_index.set_stored_size(content_token, stored_blob.stored_size, stored_blob.codec_name)
+                        else:
+                            # NB: the old version becomes unused space in its pack
+                            repo_mgr.citem_index.set_stored_size(content_token, stored_blob.stored_size, stored_blob.codec_name, *repo_mgr.packer.append(packed_data))
+                        if stored_blob.seconds_saved:
+                            repo_mgr.citem_index.incr_setting("raw_seconds_saved", stored_blob.seconds_saved)
+                        size_change += stored_blob.stored_size - citem.stored_size
+                        progress_indicator.increment_count(0 if citem.chunked else citem.content_size)
+                    position = next_position
+                    repo_mgr.citem_index.set_setting("recode_state", "{} {}".format(recode_key, position))
+            finally:
+                # NB: the index is committed even if there's an exception
+                for obsolete_file_path in obsolete_file_paths:
+                    os.remove(obsolete_file_path)
+        with open_repo_mgr(rmk, True, exclusive=True) as repo_mgr:
+            repo_mgr.citem_index.delete_setting("recode_state")
+    progress_indicator.finished()
+    return size_change
+
+def compress_repository(repo_name, codec_name=None, jobs=None, progress_indicator=utils.DummyProgressThingy()):
+    """Compress the repository's uncompressed content items or, if
+    codec_name is given, re-encode all content items not encoded with
+    that codec and make it the repository's codec for new content"""
+    if codec_name is None:
+        rmk = get_repo_mgmt_key(repo_name)
+        with open_repo_mgr(rmk, False) as repo_mgr:
+            to_codec = codec.get_codec(repo_mgr.codec_name)
+        if to_codec is codec.NONE:
+            # NB: new content is to be compressed too
+            to_codec = codec.get_codec(codec.DEFAULT_CODEC_NAME)
+            with open_repo_mgr(rmk, True, exclusive=True) as repo_mgr:
+                repo_mgr.citem_index.set_setting("codec", to_codec.name)
+        return -_recode_repository(repo_name, to_codec, lambda item_codec_name: item_codec_name == codec.NONE.name, "compress-" + to_codec.name, jobs, progress_indicator)
+    to_codec = codec.get_codec(codec_name)
+    with open_repo_mgr(get_repo_mgmt_key(repo_name), True, exclusive=True) as repo_mgr:
+        repo_mgr.citem_index.set_setting("codec", to_codec.name)
+    return -_recode_repository(repo_name, to_codec, lambda item_codec_name: item_codec_name != to_codec.name, "recode-" + to_codec.name, jobs, progress_indicator)
+
+def uncompress_repository(repo_name, jobs=None, progress_indicator=utils.DummyProgressThingy()):
+    """Decode all of the repository's content items and stop new content
+    being compressed"""
+    with open_repo_mgr(get_repo_mgmt_key(repo_name), True, exclusive=True) as repo_mgr:
+        repo_mgr.citem_index.set_setting("codec", codec.NONE.name)
+    return _recode_repository(repo_name, codec.NONE, lambda item_codec_name: item_codec_name != codec.NONE.name, "uncompress", jobs, progress_indicator)
+
+def _get_pack_list(base_dir_path):
+    try:
+        file_names = os.listdir(_packs_dir_path(base_dir_path))
+    except FileNotFoundError:
+        return []
+    return sorted(int(file_name[:-len(".pack")]) for file_name in file_names if file_name.endswith(".pack"))
+
+def repack_repository(repo_name, min_unused=DEFAULT_REPACK_MIN_UNUSED):
+    """Move the content items in pack files with at least min_unused
+    (proportion) of their space unused to the current pack file and
+    remove them.  Returns the number of pack files removed and the
+    number of bytes freed."""
+    rmk = get_repo_mgmt_key(repo_name)
+    packs_removed = 0
+    bytes_freed = 0
+    with _maintenance_lock(rmk.base_dir_path):
+        while True:
+            pack_file_path = None
+            with open_repo_mgr(rmk, True, exclusive=True) as repo_mgr: # don't hog the lock
+                current_pack = int(repo_mgr.citem_index.get_setting("current_pack", 0))
+                pack_totals = repo_mgr.citem_index.get_pack_totals()
+                for pack in _get_pack_list(rmk.base_dir_path):
+                    if pack >= current_pack:
+                        continue # still being filled
+                    pack_size = os.path.getsize(_pack_file_path(rmk.base_dir_path, pack))
+                    used_bytes = pack_totals.get(pack, (0, 0))[1]
+                    if pack_size - used_bytes >= pack_size * min_unused:
+                        pack_file_path = _pack_file_path(rmk.base_dir_path, pack)
+                        break
+                if pack_file_path is None:
+                    break
+                with open(pack_file_path, "rb") as f_in:
+                    for content_token, pack_offset, stored_size in list(repo_mgr.citem_index.iterate_pack(pack)):
+                        repo_mgr.citem_index.set_pack_offset(content_token, *repo_mgr.packer.append(os.pread(f_in.fileno(), stored_size, pack_offset)))
+            # NB: only remove the old pack file after the index has been committed
+            os.remove(pack_file_path)
+            try:
+                os.remove(_pack_lock_file_path(rmk.base_dir_path, pack))
+            except FileNotFoundError:
+                pass
+            packs_removed += 1
+            bytes_freed += pack_size - used_bytes
+    return (packs_removed, bytes_freed)
+
+def _hash_citem(base_dir_path, content_token, citem, chunks, hash_algorithm_name):
+    # NB: runs in a worker process
+    if chunks is None:
+        f_in = _open_citem(base_dir_path, content_token, citem)
+    else:
+        f_in = io.BufferedReader(_ChunkedContents(base_dir_path, chunks))
+    with f_in:
+        return _get_content_token(f_in, digest.get_algorithm(hash_algorithm_name))
+
+def _link_blob(from_file_path, to_file_path):
+    try:
+        os.link(from_file_path, to_file_path)
+    except FileNotFoundError:
+        os.makedirs(os.path.dirname(to_file_path), exist_ok=True)
+        os.link(from_file_path, to_file_path)
+    except FileExistsError:
+        # left over by an interrupted attempt
+        os.remove(to_file_path)
+        os.link(from_file_path, to_file_path)
+
+def _finish_rehash(base_dir_path):
+    # NB: this is idempotent so it's safe to repeat if it's interrupted
+    import pickle
+    with open(_rehash_journal_path(base_dir_path), "rb") as f_obj:
+        renames, obsolete_file_paths = pickle.load(f_obj)
+    for tmp_file_path, file_path in renames:
+        if os.path.exists(tmp_file_path):
+            os.replace(tmp_file_path, file_path)
+    for file_path in obsolete_file_paths:
+        if os.path.exists(file_path):
+            os.remove(file_path)
+    os.remove(_rehash_journal_path(base_dir_path))
+
+def rehash_repository(repo_name, hash_algorithm_name=None, jobs=None):
+    """Change the hash algorithm used to generate the repository's
+    content tokens and rewrite the tokens in its index and in the
+    snapshots of all archives that use it.  This should be done while
+    the repository isn't in use (and it's locked while it's done).
+    Everything is prepared under temporary names and a journal is
+    written before anything is renamed so that an interrupted rehash
+    can be completed by running it again.  Returns the number of
+    content items rehashed."""
+    import pickle
+    from concurrent.futures import ProcessPoolExecutor
+    from . import config
+    from . import excpns
+    from . import snapshot
+    hash_algorithm = digest.get_algorithm(hash_algorithm_name if hash_algorithm_name else digest.DEFAULT_ALGORITHM_NAME)
+    rmk = get_repo_mgmt_key(repo_name)
+    base_dir_path = rmk.base_dir_path
+    index_path = _index_path(base_dir_path)
+    if not os.path.exists(index_path) and os.path.exists(rmk.ref_counter_path):
+        _migrate_ref_counter(rmk, index_path)
+    with _maintenance_lock(base_dir_path), _repo_lock(rmk.lock_file_path, True):
+        if os.path.exists(_rehash_journal_path(base_dir_path)):
+            _finish_rehash(base_dir_path)
+        old_index = cindex.open_index(index_path, False)
+        try:
+            settings = old_index.get_settings()
+            if settings.get("hash", digest.LEGACY_ALGORITHM_NAME) == hash_algorithm.name:
+                return 0
+            citems = list(old_index.iterate_citems())
+            old_blob_repo = _BlobRepo(old_index, base_dir_path, False, rmk.compressed, None)
+            chunk_lists = {content_token: old_blob_repo._read_chunk_list(content_token, citem) for content_token, citem in citems if citem.chunked}
+            with ProcessPoolExecutor(jobs if jobs else os.cpu_count() or 1) as executor:
+                futures = [executor.submit(_hash_citem, base_dir_path, content_token, citem, [(chunk_token, old_index.get(chunk_token)) for chunk_token in chunk_lists[content_token]] if citem.chunked else None, hash_algorithm.name) for content_token, citem in citems]
+                new_tokens = {content_token: future.result() for (content_token, _citem), future in zip(citems, futures)}
+        finally:
+            old_index.close(commit=False)
+        old_tokens = {}
+        for content_token, new_content_token in new_tokens.items():
+            if new_content_token in old_tokens:
+                raise excpns.RehashTokenClash(old_tokens[new_content_token], content_token, hash_algorithm.name)
+            old_tokens[new_content_token] = content_token
+        settings["hash"] = hash_algorithm.name
+        tmp_index_path = index_path + ".rehash"
+        cindex.create_index(tmp_index_path, settings)
+        new_index = cindex.open_index(tmp_index_path, True)
+        packer = _Packer(base_dir_path, new_index)
+        obsolete_file_paths = []
+        try:
+            for content_token, citem in citems:
+                new_content_token = new_tokens[content_token]
+                if citem.chunked:
+                    # NB: the chunk list has to be rewritten
+                    chunk_list = _chunk_list_bytes(new_tokens[chunk_token] for chunk_token in chunk_lists[content_token])
+                    stored_blob, packed_data = _store_blob(base_dir_path, settings.get("codec", codec.NONE.name), new_content_token, len(chunk_list), io.BytesIO(chunk_list), pack_threshold=int(settings.get("pack_threshold", 0)))
+                    pack, pack_offset = (None, None) if packed_data is None else packer.append(packed_data)
+                    new_index.add(new_content_token, citem.ref_count, citem.content_size, stored_blob.stored_size, True, stored_blob.codec_name, pack, pack_offset)
+                    if citem.pack is None:
+                        obsolete_file_paths.append(_find_blob(base_dir_path, content_token, citem.codec)[0])
+                elif citem.pack is None:
+                    file_path, blob_codec = _find_blob(base_dir_path, content_token, citem.codec)
+                    _link_blob(file_path, _find_blob(base_dir_path, new_content_token, blob_codec.name)[0])
+                    new_index.add(new_content_token, citem.ref_count, citem.content_size, citem.stored_size, False, blob_codec.name)
+                    obsolete_file_paths.append(file_path)
+                else:
+                    new_index.add(new_content_token, citem.ref_count, citem.content_size, citem.stored_size, False, citem.codec, citem.pack, citem.pack_offset)
+        finally:
+            packer.close()
+            new_index.close()
+        renames = [(tmp_index_path, index_path)]
+        for archive in config.get_archive_spec_list():
+            if archive.repo_name == repo_name:
+                renames += [(snapshot.write_retokenized_snapshot(snapshot_file_path, new_tokens, ".rehash"), snapshot_file_path) for snapshot_file_path in snapshot.get_snapshot_file_path_list(archive.snapshot_dir_path)]
+        tmp_journal_path = _rehash_journal_path(base_dir_path) + ".tmp"
+        with open(tmp_journal_path, "wb") as f_obj:
+            pickle.dump((renames, obsolete_file_paths), f_obj, pickle.HIGHEST_PROTOCOL)
+        # NB: this is the point of no return
+        os.replace(tmp_journal_path, _rehash_journal_path(base_dir_path))
+        _finish_rehash(base_dir_path)
+    return len(citems)
+
+# NB: the number of content items per worker that may be being verified
+# (or waiting to be) at any time
+_SCRUB_WINDOW = 4
+_SCRUB_BATCH_SIZE = 256
+_SCRUB_SAVE_INTERVAL = 10.0
+
+_SCRUB_OK, _SCRUB_CORRUPT, _SCRUB_MISSING = range(3)
+
+ScrubResult = collections.namedtuple("ScrubResult", ["items", "content_bytes", "seconds", "corrupt", "missing", "orphaned"])
+
+def _scrub_citem(base_dir_path, content_token, citem, hash_algorithm_name):
+    # NB: runs in a worker process and returns the item's state and (for
+    # a chunked item) its chunk tokens.  A chunked item's content is the
+    # list of its chunks and each of them is verified in its own right.
+    import lzma
+    try:
+        with _open_citem(base_dir_path, content_token, citem) as f_in:
+            if citem.chunked:
+                return (_SCRUB_OK, f_in.read().decode().split())
+            if _get_content_token(f_in, digest.get_algorithm(hash_algorithm_name)) == content_token:
+                return (_SCRUB_OK, None)
+    except FileNotFoundError:
+        return (_SCRUB_MISSING, None)
+    except (OSError, EOFError, ValueError, zlib.error, lzma.LZMAError):
+        pass
+    return (_SCRUB_CORRUPT, None)
+
+def _iterate_scrub_citems(repo_mgmt_key, position):
+    # NB: the repository is only locked while each batch is read
+    while True:
+        with open_repo_mgr(repo_mgmt_key, False) as repo_mgr:
+            batch = list(repo_mgr.citem_index.iterate_citems(position, _SCRUB_BATCH_SIZE))
+        if not batch:
+            break
+        for content_token, citem in batch:
+            yield (content_token, citem)
+        position = batch[-1][0]
+
+def _is_orphaned_file(base_dir_path, citem_index, file_path):
+    parts = os.path.relpath(file_path, base_dir_path).split(os.sep)
+    if len(parts) != 3:
+        return True
+    content_token = "".join(parts[:2]) + parts[2].split(".")[0]
+    citem = citem_index.get(content_token)
+    if citem is not None and citem.pack is None:
+        try:
+            if _find_blob(base_dir_path, content_token, citem.codec)[0] == file_path:
+                return False
+        except FileNotFoundError:
+            pass
+    return True
+
+def _find_orphaned_files(repo_mgmt_key, before):
+    # NB: files modified after "before" may belong to items being stored
+    base_dir_path = repo_mgmt_key.base_dir_path
+    orphaned = []
+    for dir_name in sorted(os.listdir(base_dir_path)):
+        dir_path = os.path.join(base_dir_path, dir_name)
+        if len(dir_name) != _ld1 or not os.path.isdir(dir_path):
+            continue
+        for subdir_name in sorted(os.listdir(dir_path)):
+            subdir_path = os.path.join(dir_path, subdir_name)
+            if not os.path.isdir(subdir_path):
+                if os.path.getmtime(subdir_path) < before:
+                    orphaned.append(subdir_path)
+                continue
+            file_names = sorted(os.listdir(subdir_path))
+            with open_repo_mgr(repo_mgmt_key, False) as repo_mgr:
+                for file_name in file_names:
+                    file_path = os.path.join(subdir_path, file_name)
+                    if _is_orphaned_file(base_dir_path, repo_mgr.citem_index, file_path) and os.path.getmtime(file_path) < before:
+                        orphaned.append(file_path)
+    return orphaned
+
+def _save_scrub_state(base_dir_path, position, scrub_result):
+    import pickle
+    tmp_file_path = _scrub_state_path(base_dir_path) + ".tmp"
+    with open(tmp_file_path, "wb") as f_obj:
+        pickle.dump((position, scrub_result), f_obj, pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_file_path, _scrub_state_path(base_dir_path))
+
+def scrub_repository(repo_name, jobs=None, max_rate=None, restart=False, progress_indicator=utils.DummyProgressThingy()):
+    """Verify (in parallel) that each of the repository's content items
+    can be read and decoded and that its content still hashes to its
+    token and look for stored files that don't belong to any content
+    item.  The repository is only locked (shared) while each batch of
+    items is read and, as progress is saved periodically, an interrupted
+    scrub resumes where it left off unless restart is true.  If max_rate
+    is given, stored content is read at no more than that many bytes per
+    second.  Returns a ScrubResult."""
+    import pickle
+    import time
+    from concurrent.futures import ProcessPoolExecutor
+    rmk = get_repo_mgmt_key(repo_name)
+    base_dir_path = rmk.base_dir_path
+    jobs = jobs if jobs else os.cpu_count() or 1
+    with _maintenance_lock(base_dir_path), ProcessPoolExecutor(jobs) as executor:
+        position, scrub_result = ("", ScrubResult(0, 0, 0.0, [], [], []))
+        if not restart and os.path.exists(_scrub_state_path(base_dir_path)):
+            with open(_scrub_state_path(base_dir_path), "rb") as f_obj:
+                position, scrub_result = pickle.load(f_obj)
+        items, content_bytes, seconds, corrupt, missing, _orphaned = scrub_result
+        start_time = last_save_time = time.time()
+        with open_repo_mgr(rmk, False) as repo_mgr:
+            hash_algorithm_name = repo_mgr.hash_algorithm.name
+            progress_indicator.set_expected_total(sum(totals[2] for totals in repo_mgr.citem_index.get_codec_totals(position)))
+        citems = _iterate_scrub_citems(rmk, position)
+        pending = collections.deque()
+        submitted_bytes = 0
+        try:
+            while True:
+                # NB: keep the workers busy without reading ahead too far
+                while len(pending) < jobs * _SCRUB_WINDOW:
+                    content_token, citem = next(citems, (None, None))
+                    if content_token is None:
+                        break
+                    if max_rate:
+                        delay = submitted_bytes / max_rate - (time.time() - start_time)
+                        if delay > 0:
+                            time.sleep(delay)
+                    pending.append((content_token, citem, executor.submit(_scrub_citem, base_dir_path, content_token, citem, hash_algorithm_name)))
+                    submitted_bytes += citem.stored_size
+                if not pending:
+                    break
+                content_token, citem, future = pending.popleft()
+                state, chunk_tokens = future.result()
+                if chunk_tokens is not None:
+                    with open_repo_mgr(rmk, False) as repo_mgr:
+                        if not all(chunk_token in repo_mgr.citem_index for chunk_token in chunk_tokens):
+                            state = _SCRUB_MISSING
+                if state == _SCRUB_CORRUPT:
+                    corrupt.append(content_token)
+                elif state == _SCRUB_MISSING:
+                    missing.append(content_token)
+                items += 1
+                # NB: a chunked item's content is counted via its chunks
+                content_bytes += 0 if citem.chunked else citem.content_size
+                position = content_token
+                progress_indicator.increment_count(0 if citem.chunked else citem.content_size)
+                if time.time() - last_save_time >= _SCRUB_SAVE_INTERVAL:
+                    last_save_time = time.time()
+                    _save_scrub_state(base_dir_path, position, ScrubResult(items, content_bytes, seconds + last_save_time - start_time, corrupt, missing, []))
+        finally:
+            for _content_token, _citem, future in pending:
+                future.cancel()
+            _save_scrub_state(base_dir_path, position, ScrubResult(items, content_bytes, seconds + time.time() - start_time, corrupt, missing, []))
+        orphaned = _find_orphaned_files(rmk, start_time)
+        os.remove(_scrub_state_path(base_dir_path))
+    progress_indicator.finished()
+    return ScrubResult(items, content_bytes, seconds + time.time() - start_time, corrupt, missing, orphaned)
 
 class BRSS(collections.namedtuple("BRSS", ["references", "referenced_items", "referenced_content_bytes", "referenced_stored_bytes", "unreferenced_items", "unreferenced_content_bytes", "unreferenced_stored_bytes"])):
     @property
@@ -305,29 +1469,11 @@ class BRSS(collections.namedtuple("BRSS", ["references", "referenced_items", "re
     def total_stored_bytes(self):
         return self.referenced_stored_bytes + self.unreferenced_stored_bytes
 
-def get_repo_storage_stats(repo_name):
+def get_repo_storage_stats(repo_name, recompute=False):
+    # NB: the totals maintained by the index unless asked to recompute them
     repo_mgmt_key = get_repo_mgmt_key(repo_name)
-    total_references = 0
-    total_referenced_items = 0
-    total_referenced_content_bytes = 0
-    total_referenced_stored_bytes = 0
-    total_unreferenced_items = 0
-    total_unreferenced_content_bytes = 0
-    total_unreferenced_stored_bytes = 0
     with open_repo_mgr(repo_mgmt_key, False) as repo_mgr:
-        for dir_name, dir_data in repo_mgr.ref_counter.items():
-            for subdir_name, subdir_data in dir_data.items():
-                for count, content_bytes, stored_bytes in subdir_data.values():
-                    if count:
-                        total_references += count
-                        total_referenced_items += 1
-                        total_referenced_content_bytes += content_bytes
-                        total_referenced_stored_bytes += stored_bytes
-                    else:
-                        total_unreferenced_items += 1
-                        total_unreferenced_content_bytes += content_bytes
-                        total_unreferenced_stored_bytes += stored_bytes
-    return BRSS(total_references, total_referenced_items, total_referenced_content_bytes, total_referenced_stored_bytes, total_unreferenced_items, total_unreferenced_content_bytes, total_unreferenced_stored_bytes)
+        return BRSS(*repo_mgr.citem_index.get_storage_totals(recompute))
 
 def get_repo_storage_stats_list():
     from . import config
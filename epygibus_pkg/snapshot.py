@@ -21,11 +21,16 @@ import sys
 import re
 import time
 import gzip
+import operator
 import pickle
+import struct
+import types
+from contextlib import contextmanager
 
 from . import excpns
 from . import bmark
 from . import utils
+from . import snapshot_file
 
 HOME_DIR = os.path.expanduser("~")
 absolute_path = lambda path: os.path.abspath(os.path.expanduser(path))
@@ -37,7 +42,56 @@ path_rel_home = lambda path: os.path.relpath(absolute_path(path), HOME_DIR)
 NFIELDS = 10
 MODE_I, INO_I, DEV_I, NLINK_I, UID_I, GID_I, SIZE_I, ATIME_I, MTIME_I, CTIME_I = range(NFIELDS)
 ATTR_TUPLE = lambda attributes: tuple(attributes[:NFIELDS])
-get_attr_tuple = lambda path: ATTR_TUPLE(os.lstat(path))
+
+class PackedAttrs(bytes):
+    """The ATTR_TUPLE() fields packed into a single (80 byte) object which
+    is indexed, iterated, compared and hashed like the tuple but occupies
+    a third of the memory (as the fields aren't separate int objects).
+    Indexing unpacks all the fields so use unpacked() for repeated access."""
+    __slots__ = ()
+    def __new__(cls, attributes):
+        return bytes.__new__(cls, snapshot_file.ATTRS_RECORD.pack(*attributes[:NFIELDS]))
+    @classmethod
+    def from_packed(cls, data):
+        return bytes.__new__(cls, data)
+    def _unpack(self):
+        return snapshot_file.ATTRS_RECORD.unpack(self)
+    def __getitem__(self, index):
+        return self._unpack()[index]
+    def __iter__(self):
+        return iter(self._unpack())
+    def __len__(self):
+        return NFIELDS
+    def _compare(self, other, op):
+        # NB: as the tuple (rather than the bytes) that it stands in for
+        if isinstance(other, PackedAttrs):
+            return op(self._unpack(), other._unpack())
+        if isinstance(other, tuple): # including os.stat_result
+            return op(self._unpack(), tuple(other))
+        # NB: not NotImplemented as bytes would then compare the bytes
+        return op(self._unpack(), other)
+    def __eq__(self, other):
+        return self._compare(other, operator.eq)
+    def __ne__(self, other):
+        return self._compare(other, operator.ne)
+    def __lt__(self, other):
+        return self._compare(other, operator.lt)
+    def __le__(self, other):
+        return self._compare(other, operator.le)
+    def __gt__(self, other):
+        return self._compare(other, operator.gt)
+    def __ge__(self, other):
+        return self._compare(other, operator.ge)
+    def __hash__(self):
+        return hash(self._unpack())
+    def __repr__(self):
+        return "PackedAttrs({})".format(self._unpack())
+    def __reduce__(self):
+        return (PackedAttrs, (self._unpack(),))
+
+get_attr_tuple = lambda path: PackedAttrs(os.lstat(path))
+# NB: attributes read from older snapshots may be tuples
+unpacked = lambda attributes: attributes._unpack() if isinstance(attributes, PackedAttrs) else ATTR_TUPLE(attributes)
 # a named tuple for passing around the data (if needed)
 # use the same names os.lstat() output for interchangeability
 ATTRS_NAMED = collections.namedtuple("ATTRS_NAMED", ["st_mode", "st_ino", "st_dev", "st_nlink", "st_uid", "st_gid", "st_size", "st_atime", "st_mtime", "st_ctime"])
@@ -74,12 +128,13 @@ class SFile(collections.namedtuple("SFile", ["path", "attributes", "content_toke
             if not overwrite: # move it out of the way
                 os.rename(target_file_path, move_aside_file_path(target_file_path))
         return attributes
-    def copy_contents_to(self, target_file_path, overwrite=False):
+    def copy_contents_to(self, target_file_path, overwrite=False, link=False):
         from . import repo
         with repo.open_repo_mgr(self.repo_mgmt_key, writeable=False) as repo_mgr:
             attributes = self.move_target_aside(repo_mgr, target_file_path, overwrite)
             if attributes is not None: # contents of target are the same as ours
-                repo_mgr.copy_contents_to(self.content_token, target_file_path, attributes)
+                if not (link and repo_mgr.link_contents_to(self.content_token, target_file_path, attributes)):
+                    repo_mgr.copy_contents_to(self.content_token, target_file_path, attributes)
                 return True
             else:
                 return False
@@ -94,7 +149,8 @@ class SFile(collections.namedtuple("SFile", ["path", "attributes", "content_toke
         return self.attributes.st_nlink > 1
     @classmethod
     def make(cls, path, f_data, repo_mgmt_key):
-        return cls(path, ATTRS_NAMED(*f_data[0]), f_data[1], repo_mgmt_key)
+        # NB: snapshots hold content tokens as bytes but the API uses hex
+        return cls(path, ATTRS_NAMED(*f_data[0]), f_data[1].hex(), repo_mgmt_key)
 
 class _SLink(collections.namedtuple("SLink", ["path", "attributes", "tgt_path"]), PathComponentsMixin):
     is_link = True
@@ -142,8 +198,10 @@ class _SLink(collections.namedtuple("SLink", ["path", "attributes", "tgt_path"])
             try:
                 os.lchmod(self.path, attributes.st_mode)
             except AttributeError:
-                # NB: some systems don't support lchmod())
-                os.chmod(self.path, attributes.st_mode)
+                # NB: some systems (e.g. Linux) don't support lchmod() but
+                # don't use a link's mode either and chmod() would change
+                # the link's target (which may be linked to the repository)
+                pass
         except OSError as edata:
             # report the error and move on (we have permission to wreak havoc)
             stderr.write(_("Error: chmod: {}: \"{}\"\n").format(edata.strerror, edata.filename))
@@ -169,45 +227,110 @@ class CreationStats(collections.namedtuple("CreationStats", ["file_count", "soft
     def __add__(self, other):
         return CreationStats(*[self[i] + other[i] for i in range(len(self))])
 
+# NB: shared by all directories without any entries of a particular type
+_NO_ENTRIES = types.MappingProxyType({})
+
 class Snapshot:
-    def __init__(self, parent=None, attributes=None):
+    # NB: there are a lot of these so they're kept as small as possible
+    # and files' content tokens are held as bytes (rather than hex)
+    __slots__ = ("parent", "attributes", "_name", "_subdirs", "_files", "_file_links", "_subdir_links", "_nfiles")
+    def __init__(self, parent=None, attributes=None, name=None):
         self.parent = parent
         self.attributes = attributes
-        self.subdirs = {}
-        self.files = {}
-        self.file_links = {}
-        self.subdir_links = {}
+        self._name = name
+        # NB: containers are only created when the first entry is added
+        self._subdirs = None
+        self._files = None
+        self._file_links = None
+        self._subdir_links = None
+        self._nfiles = None
+    def __getstate__(self):
+        # NB: the same state as before slots so that pickles are compatible
+        attributes = None if self.attributes is None else ATTR_TUPLE(self.attributes)
+        files = {name: (ATTR_TUPLE(attrs), token.hex()) for name, (attrs, token) in self.files.items()}
+        file_links, subdir_links = ({name: (ATTR_TUPLE(attrs), tgt_path) for name, (attrs, tgt_path) in links.items()} for links in (self.file_links, self.subdir_links))
+        return {"parent": self.parent, "attributes": attributes, "subdirs": dict(self.subdirs), "files": files, "file_links": file_links, "subdir_links": subdir_links}
+    def __setstate__(self, state):
+        # NB: attributes are left as tuples (which work just as well) to
+        # keep loading pickled snapshots fast
+        self.__init__(state["parent"], state["attributes"])
+        for name, subdir in state["subdirs"].items():
+            subdir._name = sys.intern(name)
+        if state["files"]:
+            self._files = {sys.intern(name): (attrs, bytes.fromhex(token)) for name, (attrs, token) in state["files"].items()}
+        for key in ("subdirs", "file_links", "subdir_links"):
+            if state[key]:
+                setattr(self, "_" + key, {sys.intern(name): value for name, value in state[key].items()})
+    @property
+    def subdirs(self):
+        return _NO_ENTRIES if self._subdirs is None else self._subdirs
+    @property
+    def files(self):
+        return _NO_ENTRIES if self._files is None else self._files
+    @property
+    def file_links(self):
+        return _NO_ENTRIES if self._file_links is None else self._file_links
+    @property
+    def subdir_links(self):
+        return _NO_ENTRIES if self._subdir_links is None else self._subdir_links
+    def _entries_changed(self):
+        # NB: if a directory's count isn't cached neither are its ancestors'
+        snapshot = self
+        while snapshot is not None and snapshot._nfiles is not None:
+            snapshot._nfiles = None
+            snapshot = snapshot.parent
+    def set_file(self, name, f_data):
+        if self._files is None:
+            self._files = {}
+        self._files[sys.intern(name)] = f_data
+        self._entries_changed()
+    def remove_file(self, name):
+        del self._files[name]
+        self._entries_changed()
+    def set_file_link(self, name, l_data):
+        if self._file_links is None:
+            self._file_links = {}
+        self._file_links[sys.intern(name)] = l_data
+        self._entries_changed()
+    def set_subdir_link(self, name, l_data):
+        if self._subdir_links is None:
+            self._subdir_links = {}
+        self._subdir_links[sys.intern(name)] = l_data
+    def _add_subdir(self, name, attributes):
+        if self._subdirs is None:
+            self._subdirs = {}
+        name = sys.intern(name)
+        subdir = self._subdirs[name] = Snapshot(self, attributes, name)
+        return subdir
     @property
     def occupancy(self):
         return len(self.subdirs) + len(self.files) + len(self.subdir_links) + len(self.file_links)
     @property
     def name(self):
-        if not self.parent:
-            return os.sep
-        for key, value in self.parent.subdirs.iter_items():
-            if value == self:
-                return key
+        return os.sep if not self.parent else self._name
     @property
     def path(self):
-        return os.sep if not self.parent else os.path.join(parent.path, self.name)
+        return os.sep if not self.parent else os.path.join(self.parent.path, self.name)
     @property
     def nfiles(self):
         # NB this doesn't have to be 100% accurate (just used for progress indicator)
-        count = len(self.files) + len(self.file_links)
-        for subdir in self.subdirs.values():
-            count += subdir.nfiles
-        return count
+        if self._nfiles is None:
+            count = len(self.files) + len(self.file_links)
+            for subdir in self.subdirs.values():
+                count += subdir.nfiles
+            self._nfiles = count
+        return self._nfiles
     def _find_or_add_subdir(self, path_parts, index, attributes):
         name = path_parts[index]
         if index == len(path_parts) - 1:
             # neeed to be careful that we don't clobber existing data
             if name not in self.subdirs:
-                self.subdirs[name] = Snapshot(self, attributes)
+                self._add_subdir(name, attributes)
             return self.subdirs[name]
         else:
             if name not in self.subdirs:
                 subdir_attributes = get_attr_tuple(os.path.join(os.sep, *path_parts[:index+1]))
-                self.subdirs[name] = Snapshot(self, subdir_attributes)
+                self._add_subdir(name, subdir_attributes)
             return self.subdirs[name]._find_or_add_subdir(path_parts, index + 1, attributes)
     def find_or_add_subdir(self, abs_subdir_path):
         attributes = get_attr_tuple(abs_subdir_path)
@@ -240,7 +363,7 @@ class Snapshot:
         return SDirSLink.make(abs_subdir_path, self.find_dir(dir_path).subdir_links[subdir_name])
     def iterate_content_tokens(self):
         for _dont_care, content_token in self.files.values():
-            yield content_token
+            yield content_token.hex()
         for subdir in self.subdirs.values():
             for content_token in subdir.iterate_content_tokens():
                 yield content_token
@@ -259,6 +382,53 @@ class Snapshot:
         # this would be the case where the snapshot holds a single file
         return path_bits if path_bits else []
 
+class _LazySnapshot(Snapshot):
+    """A (read only) directory of a columnar snapshot file whose contents
+    are only decoded when they're accessed"""
+    __slots__ = ("_reader", "_index", "_dir_record", "_entries")
+    def __init__(self, reader, index, dir_record, parent=None):
+        self.parent = parent
+        self._name = dir_record.name
+        self._reader = reader
+        self._index = index
+        self._dir_record = dir_record
+        self._subdirs = None
+        self._entries = None
+    @property
+    def attributes(self):
+        return self._dir_record.attributes
+    @property
+    def subdirs(self):
+        if self._subdirs is None:
+            self._subdirs = {dir_record.name: _LazySnapshot(self._reader, index, dir_record, self) for index, dir_record in self._reader.iterate_subdirs(self._dir_record)}
+        return self._subdirs
+    def _get_entries(self):
+        if self._entries is None:
+            self._entries = self._reader.read_entries(self._dir_record, PackedAttrs.from_packed)
+        return self._entries
+    @property
+    def files(self):
+        return self._get_entries()[0]
+    @property
+    def file_links(self):
+        return self._get_entries()[1]
+    @property
+    def subdir_links(self):
+        return self._get_entries()[2]
+    @property
+    def occupancy(self):
+        return self._dir_record.nsubdirs + self._dir_record.nfiles + self._dir_record.nfile_links + self._dir_record.nsubdir_links
+    @property
+    def nfiles(self):
+        if self.parent is None:
+            return self._reader.nfiles
+        return self._dir_record.nfiles + self._dir_record.nfile_links + sum(subdir.nfiles for subdir in self.subdirs.values())
+    def iterate_content_tokens(self):
+        if self.parent is None:
+            # NB: without decoding anything but the file records
+            return self._reader.iterate_content_tokens()
+        return Snapshot.iterate_content_tokens(self)
+
 class SnapshotPlus:
     # limit the number of none basic python types to future proof
     def __init__(self, snapshot, statistics, repo_mgmt_key):
@@ -307,7 +477,42 @@ class SnapshotPlus:
     def find_offset_base_subdir_bits(self):
         return self.snapshot.find_offset_base_subdir_bits([os.sep])
 
+def _read_columnar_snapshot(snapshot_file_path):
+    try:
+        reader = snapshot_file.SnapshotFileReader(snapshot_file_path)
+        statistics, time_statistics, repo_mgmt_key = reader.meta
+    except (ValueError, struct.error, pickle.UnpicklingError):
+        raise excpns.InvalidSnapshotFile(snapshot_file_path)
+    return SnapshotPlus(_LazySnapshot(reader, 0, reader.get_dir(0)), statistics + (time_statistics,), repo_mgmt_key)
+
+def _write_columnar_snapshot(snapshot_file_path, snapshot_plus, compress):
+    meta = (snapshot_plus._statistics, snapshot_plus._time_statistics, snapshot_plus._repo_mgmt_key)
+    snapshot_file.write_snapshot_file(snapshot_file_path, snapshot_plus.snapshot, meta, compress)
+
+SnapshotHeader = collections.namedtuple("SnapshotHeader", ["format_version", "compressed", "nfiles", "creation_stats", "repo_mgmt_key"])
+
+def read_snapshot_header(snapshot_file_path):
+    """Read the snapshot's header without reading its file tree (except
+    for pickled snapshots which have to be read in full)"""
+    from . import repo
+    if snapshot_file_path.endswith(_SNAPSHOT_FILE_SUFFIX):
+        try:
+            header = snapshot_file.read_header(snapshot_file_path)
+            statistics, time_statistics, repo_mgmt_key = header.meta
+        except (ValueError, struct.error, pickle.UnpicklingError):
+            raise excpns.InvalidSnapshotFile(snapshot_file_path)
+        creation_stats = CreationStats(*(statistics + (bmark.ETD(*time_statistics),)))
+        return SnapshotHeader(header.version, bool(header.flags & snapshot_file.COMPRESSED), header.nfiles, creation_stats, repo.RepoMgmtKey(*repo_mgmt_key))
+    snapshot_plus = read_snapshot(snapshot_file_path)
+    try: # WORKAROUND: to handle snapshots without a key
+        repo_mgmt_key = snapshot_plus.repo_mgmt_key
+    except AttributeError:
+        repo_mgmt_key = None
+    return SnapshotHeader(0, snapshot_file_path.endswith(".gz"), snapshot_plus.nfiles, snapshot_plus.creation_stats, repo_mgmt_key)
+
 def read_snapshot(snapshot_file_path):
+    if snapshot_file_path.endswith(_SNAPSHOT_FILE_SUFFIX):
+        return _read_columnar_snapshot(snapshot_file_path)
     OPEN = gzip.open if snapshot_file_path.endswith(".gz") else open
     with OPEN(snapshot_file_path, "rb") as f_obj:
         try:
@@ -319,10 +524,13 @@ def read_snapshot(snapshot_file_path):
     return snapshot_plus
 
 # NB: make sure that these two are in concert
-_SNAPSHOT_FILE_NAME_TEMPLATE = "%Y-%m-%d-%H-%M-%S.pkl"
+# NB: snapshots are now written in the columnar format (compressed, if
+# required, internally) but pickled snapshots are still supported
+_SNAPSHOT_FILE_SUFFIX = ".snap"
+_SNAPSHOT_FILE_NAME_TEMPLATE = "%Y-%m-%d-%H-%M-%S" + _SNAPSHOT_FILE_SUFFIX
 SNAPSHOT_NAME_CRE = re.compile("(\d{4})-(\d{2})-(\d{2})-(\d{2})-(\d{2})-(\d{2})")
 SNAPSHOT_WC_NAME_CRE = re.compile("(\d{4}|.)-(\d{2}|.)-(\d{2}|.)(-(\d{2}|.)(-(\d{2})(-(\d{2}))?)?)?")
-_SNAPSHOT_FILE_NAME_CRE = re.compile("\d{4}-\d{2}-\d{2}-\d{2}-\d{2}-\d{2}\.pkl(\.gz)?")
+_SNAPSHOT_FILE_NAME_CRE = re.compile("\d{4}-\d{2}-\d{2}-\d{2}-\d{2}-\d{2}(\.pkl(\.gz)?|\.snap)$")
 ss_root = lambda fname: os.path.basename(fname).split(".")[0]
 _Y, _MO, _D, _DC0, _H, _DC1, _MI, _DC2, _S = range(9)
 
@@ -356,18 +564,53 @@ def expand_snapshot_wc_name(wc_name):
     return name
 
 def read_most_recent_snapshot(snapshot_dir_path):
-    candidates = [f for f in os.listdir(snapshot_dir_path) if _SNAPSHOT_FILE_NAME_CRE.match(f)]
+    candidates = _get_snapshot_file_list(snapshot_dir_path, reverse=True)
     if candidates:
-        return read_snapshot(os.path.join(snapshot_dir_path, sorted(candidates, reverse=True)[0]))
+        return read_snapshot(os.path.join(snapshot_dir_path, candidates[0]))
     return Snapshot()
 
 def _get_snapshot_file_list(snapshot_dir_path, reverse=False):
-    return sorted([f for f in os.listdir(snapshot_dir_path) if _SNAPSHOT_FILE_NAME_CRE.match(f)], reverse=reverse)
+    file_names = {}
+    for file_name in os.listdir(snapshot_dir_path):
+        if not _SNAPSHOT_FILE_NAME_CRE.match(file_name):
+            continue
+        # NB: a converted snapshot supersedes its original (whose removal may have been interrupted)
+        if file_name.endswith(_SNAPSHOT_FILE_SUFFIX) or ss_root(file_name) not in file_names:
+            file_names[ss_root(file_name)] = file_name
+    return sorted(file_names.values(), reverse=reverse)
+
+def get_snapshot_file_path_list(snapshot_dir_path):
+    return [os.path.join(snapshot_dir_path, f) for f in _get_snapshot_file_list(snapshot_dir_path)]
+
+def _retokenize(snapshot, new_tokens):
+    for file_name, (attributes, content_token) in snapshot.files.items():
+        snapshot.files[file_name] = (attributes, bytes.fromhex(new_tokens[content_token.hex()]))
+    for subdir in snapshot.subdirs.values():
+        _retokenize(subdir, new_tokens)
+
+def write_retokenized_snapshot(snapshot_file_path, new_tokens, tmp_suffix):
+    """Write a copy of the snapshot (with the same name plus tmp_suffix)
+    with its content tokens replaced by their values in new_tokens and
+    return its path"""
+    tmp_file_path = snapshot_file_path + tmp_suffix
+    if snapshot_file_path.endswith(_SNAPSHOT_FILE_SUFFIX):
+        snapshot_file.rewrite_snapshot_file(snapshot_file_path, tmp_file_path, new_tokens=new_tokens)
+        os.chmod(tmp_file_path, os.stat(snapshot_file_path).st_mode)
+        return tmp_file_path
+    snapshot_plus = read_snapshot(snapshot_file_path)
+    _retokenize(snapshot_plus.snapshot, new_tokens)
+    OPEN = gzip.open if snapshot_file_path.endswith(".gz") else open
+    if os.path.exists(tmp_file_path):
+        os.remove(tmp_file_path) # left over by an interrupted attempt
+    with OPEN(tmp_file_path, "wb") as f_obj:
+        pickle.dump(snapshot_plus, f_obj, pickle.HIGHEST_PROTOCOL)
+    os.chmod(tmp_file_path, os.stat(snapshot_file_path).st_mode)
+    return tmp_file_path
 
 class SnapshotGenerator:
     # The file has gone away
     FORGIVEABLE_ERRNOS = frozenset((errno.ENOENT, errno.ENXIO))
-    def __init__(self, archive, stderr=sys.stderr, report_skipped_links=False, activity_indicator=utils.DummyActivityIndicator()):
+    def __init__(self, archive, stderr=sys.stderr, report_skipped_links=False, incremental=False, jobs=1, activity_indicator=utils.DummyActivityIndicator()):
         import re
         import fnmatch
         from . import repo
@@ -378,10 +621,16 @@ class SnapshotGenerator:
         self._exclude_dir_cres = [re.compile(fnmatch.translate(os.path.expanduser(glob))) for glob in archive.exclude_dir_globs]
         self._exclude_file_cres = [re.compile(fnmatch.translate(os.path.expanduser(glob))) for glob in archive.exclude_file_globs]
         self.report_skipped_links=report_skipped_links
+        self.incremental = incremental
+        self.jobs = jobs
         self.repo_mgmt_key = repo.get_repo_mgmt_key(archive.repo_name)
         self.stderr = stderr
         self._reset_counters()
         self._snapshot = None
+        self._parent_snapshot = None
+        self._executor = None
+        self._content_storer = None
+        self._placeholders = collections.deque()
     def __enter__(self):
         return self
     def __exit__(self, exc_type, exc_value, exc_tb):
@@ -397,28 +646,119 @@ class SnapshotGenerator:
         self.subdir_slink_count = 0
         self.released_items = 0
         self.created_items = 0
-    def _adjust_item_stats(self, start_counts, end_counts):
-        # TODO: check the maths here (use a namedtuple)
-        self.created_items += max(sum(end_counts[:-1]) - sum(start_counts[:-1]), 0)
-        self.released_items += max(end_counts[1] - start_counts[1], 0)
+    def _adjust_item_stats(self, session_counts):
+        self.created_items += session_counts.created
+        self.released_items += max(session_counts.unreferenced, 0)
     @property
     def creation_stats(self):
         return CreationStats(self.file_count, self.file_slink_count + self.subdir_slink_count, self.content_count, self.created_items, self.released_items, self.elapsed_time.get_etd())
+    def _read_parent_snapshot(self):
+        snapshot_names = _get_snapshot_file_list(self._archive.snapshot_dir_path)
+        if not snapshot_names:
+            return None
+        try:
+            parent_snapshot = read_snapshot(os.path.join(self._archive.snapshot_dir_path, snapshot_names[-1]))
+            if parent_snapshot.repo_mgmt_key.base_dir_path != self.repo_mgmt_key.base_dir_path:
+                return None # its content tokens are no use to us
+            build_etd = parent_snapshot.creation_stats.etd
+        except (excpns.InvalidSnapshotFile, AttributeError):
+            return None
+        # NB: attributes have a granularity of one second so a file modified during the
+        # same second as the parent's build started can't be trusted to be unchanged
+        written = time.mktime(time.strptime(ss_root(snapshot_names[-1]), "%Y-%m-%d-%H-%M-%S"))
+        self._parent_build_start = int(written - build_etd.real_time) - 1
+        self._parent_dir_path = None
+        self._parent_subdir_ss = None
+        return parent_snapshot
+    def _get_unchanged_content_token(self, file_path, file_attrs):
+        dir_path, file_name = os.path.split(file_path)
+        if dir_path != self._parent_dir_path:
+            self._parent_dir_path = dir_path
+            self._parent_subdir_ss = self._parent_snapshot.find_dir(dir_path)
+        if self._parent_subdir_ss is None:
+            return None
+        try:
+            parent_attrs, content_token = self._parent_subdir_ss.files[file_name]
+        except KeyError:
+            return None
+        parent_attrs, file_attrs = unpacked(parent_attrs), unpacked(file_attrs)
+        if max(parent_attrs[MTIME_I], parent_attrs[CTIME_I]) >= self._parent_build_start:
+            return None
+        for index in (SIZE_I, MTIME_I, CTIME_I, INO_I, DEV_I):
+            if file_attrs[index] != parent_attrs[index]:
+                return None
+        return content_token.hex()
+    @contextmanager
+    def _open_repo_mgr(self):
+        from . import repo
+        with repo.open_repo_mgr(self.repo_mgmt_key, writeable=True) as repo_mgr:
+            if self._executor is not None:
+                self._content_storer = repo.ParallelContentStorer(repo_mgr, self._executor, self.jobs * 8)
+            try:
+                yield repo_mgr
+            finally:
+                if self._content_storer is not None:
+                    content_storer, self._content_storer = self._content_storer, None
+                    try:
+                        content_storer.finish()
+                    finally:
+                        # NB: files whose content was never stored mustn't stay in the snapshot
+                        while self._placeholders:
+                            subdir_ss, file_name = self._placeholders.popleft()
+                            subdir_ss.remove_file(file_name)
+            self._adjust_item_stats(repo_mgr.get_session_counts())
+    def _content_stored(self, subdir_ss, file_name, file_path, repo_mgr, content_token, edata):
+        # NB: called by the parallel content storer in the order of submission
+        self._placeholders.popleft()
+        if content_token is None:
+            subdir_ss.remove_file(file_name)
+            if not isinstance(edata, OSError):
+                raise edata
+            self.stderr.write(_("Error: saving \"{}\" content failed: {}. Skipping.\n").format(file_path, edata.strerror))
+            return
+        try:
+            file_attrs = get_attr_tuple(file_path)
+        except OSError as edata:
+            subdir_ss.remove_file(file_name)
+            repo_mgr.release_content(content_token)
+            if edata.errno in self.FORGIVEABLE_ERRNOS:
+                return # it's gone away so we skip it
+            raise edata
+        self.content_count += file_attrs[SIZE_I]
+        self.file_count += 1
+        subdir_ss.set_file(file_name, (file_attrs, bytes.fromhex(content_token)))
     def _include_file(self, subdir_ss, file_name, file_path, repo_mgr):
         # NB. redundancy in file_name and file_path is deliberate
         # let the caller handle OSError exceptions
         if file_name in subdir_ss.files: # already included via another "includes" entry
             # NB multiple inclusion would mess with content management reference counts
             return
-        try: # it's possible content manager got environment error reading file, if so skip it and report
-            content_token = repo_mgr.store_contents(file_path)
-        except OSError as edata:
-            self.stderr.write(_("Error: saving \"{}\" content failed: {}. Skipping.\n").format(file_path, edata.strerror))
+        content_token = None
+        if self._parent_snapshot is not None:
+            file_attrs = get_attr_tuple(file_path)
+            content_token = self._get_unchanged_content_token(file_path, file_attrs)
+            if content_token is not None:
+                try:
+                    repo_mgr.reference_content(content_token)
+                except KeyError: # content has been pruned since parent was read
+                    content_token = None
+        if content_token is None and self._content_storer is not None:
+            # NB: a placeholder keeps the order deterministic and prevents multiple inclusion
+            subdir_ss.set_file(file_name, None)
+            self._placeholders.append((subdir_ss, file_name))
+            self._content_storer.store_contents(file_path, lambda content_token, edata: self._content_stored(subdir_ss, file_name, file_path, repo_mgr, content_token, edata))
+            self._activity_indicator.pulse()
             return
-        file_attrs = get_attr_tuple(file_path)
+        if content_token is None:
+            try: # it's possible content manager got environment error reading file, if so skip it and report
+                content_token = repo_mgr.store_contents(file_path)
+            except OSError as edata:
+                self.stderr.write(_("Error: saving \"{}\" content failed: {}. Skipping.\n").format(file_path, edata.strerror))
+                return
+            file_attrs = get_attr_tuple(file_path)
         self.content_count += file_attrs[SIZE_I]
         self.file_count += 1
-        subdir_ss.files[file_name] = (file_attrs, content_token)
+        subdir_ss.set_file(file_name, (file_attrs, bytes.fromhex(content_token)))
         self._activity_indicator.pulse()
     def _include_file_link(self, subdir_ss, file_name, file_path):
         # NB. redundancy in file_name and file_path is deliberate
@@ -433,7 +773,7 @@ class SnapshotGenerator:
             self._activity_indicator.pulse()
             return None
         self.file_slink_count += 1
-        subdir_ss.file_links[file_name] = (get_attr_tuple(file_path), target_path)
+        subdir_ss.set_file_link(file_name, (get_attr_tuple(file_path), target_path))
         self._activity_indicator.pulse()
         return abs_target_path if target_valid else None
     def _include_subdir_link(self, subdir_ss, file_name, file_path):
@@ -449,13 +789,11 @@ class SnapshotGenerator:
             self._activity_indicator.pulse()
             return None
         self.subdir_slink_count += 1
-        subdir_ss.subdir_links[file_name] = (get_attr_tuple(file_path), target_path)
+        subdir_ss.set_subdir_link(file_name, (get_attr_tuple(file_path), target_path))
         self._activity_indicator.pulse()
         return abs_target_path if target_valid else None
     def _include_dir(self, abs_base_dir_path):
-        from . import repo
-        with repo.open_repo_mgr(self.repo_mgmt_key, writeable=True) as repo_mgr:
-            start_counts = repo_mgr.get_counts()
+        with self._open_repo_mgr() as repo_mgr:
             for abs_dir_path, subdir_names, file_names in os.walk(abs_base_dir_path, followlinks=True):
                 if self.is_excluded_dir(abs_dir_path):
                     continue
@@ -498,7 +836,6 @@ class SnapshotGenerator:
                 # NB: this is an in place reduction in the list of subdirectories
                 for esdp in excluded_subdir_names:
                     subdir_names.remove(esdp)
-            self._adjust_item_stats(start_counts, repo_mgr.get_counts())
     def is_excluded_file(self, file_path_or_name):
         for cre in self._exclude_file_cres:
             if cre.match(file_path_or_name):
@@ -520,6 +857,21 @@ class SnapshotGenerator:
                 repo_mgr.release_contents(self._snapshot.iterate_content_tokens())
             self._snapshot = None
         self._snapshot = Snapshot()
+        self._parent_snapshot = self._read_parent_snapshot() if self.incremental else None
+        if self.jobs > 1:
+            from concurrent.futures import ProcessPoolExecutor
+            self._executor = ProcessPoolExecutor(self.jobs)
+        try:
+            self._generate_snapshot()
+        finally:
+            if self._executor is not None:
+                # NB: shut down before measuring so that the workers' times are included
+                self._executor.shutdown()
+                self._executor = None
+        self._parent_snapshot = None
+        self.elapsed_time = bmark.get_os_times() - start_time
+        self._activity_indicator.finished()
+    def _generate_snapshot(self):
         abs_dir_link_target_paths = []
         abs_file_link_target_paths = []
         for item in self._archive.includes:
@@ -543,10 +895,8 @@ class SnapshotGenerator:
                 abs_dir_path, file_name = os.path.split(abs_item_path)
                 try:
                     subdir_ss = self._snapshot.find_or_add_subdir(abs_dir_path)
-                    with repo.open_repo_mgr(self.repo_mgmt_key, writeable=True) as repo_mgr:
-                        start_counts = repo_mgr.get_counts()
+                    with self._open_repo_mgr() as repo_mgr:
                         self._include_file(subdir_ss, file_name, abs_item_path, repo_mgr)
-                        self._adjust_item_stats(start_counts, repo_mgr.get_counts())
                 except OSError as edata:
                     self.stderr.write(_("Error: processing file {} failed: {}\n").format(abs_item_path, edata.strerror))
             elif os.path.isdir(abs_item_path):
@@ -570,8 +920,7 @@ class SnapshotGenerator:
                 self._include_dir(abs_item_path)
             except OSError as edata:
                 self.stderr.write(_("Error: processing directory {} failed: {}\n").format(abs_item_path, edata.strerror))
-        with repo.open_repo_mgr(self.repo_mgmt_key, writeable=True) as repo_mgr:
-            start_counts = repo_mgr.get_counts()
+        with self._open_repo_mgr() as repo_mgr:
             for abs_item_path in abs_file_link_target_paths:
                 abs_dir_path, file_name = os.path.split(abs_item_path)
                 try:
@@ -580,9 +929,6 @@ class SnapshotGenerator:
                     self._include_file(subdir_ss, file_name, abs_item_path, repo_mgr)
                 except OSError as edata:
                     self.stderr.write(_("Error: processing file {} failed: {}\n").format(abs_item_path, edata.strerror))
-            self._adjust_item_stats(start_counts, repo_mgr.get_counts())
-        self.elapsed_time = bmark.get_os_times() - start_time
-        self._activity_indicator.finished()
     def write_snapshot(self, compress=False, permissions=stat.S_IRUSR|stat.S_IRGRP):
         assert self._snapshot is not None
         import time
@@ -595,26 +941,35 @@ class SnapshotGenerator:
         snapshot_file_path = os.path.join(self._archive.snapshot_dir_path, snapshot_file_name)
         compress = self._archive.compress_default if compress is None else compress
         self._activity_indicator.pulse()
-        if compress:
-            OPEN = gzip.open
-            snapshot_file_path += ".gz"
-        else:
-            OPEN = open
-        self._activity_indicator.pulse()
-        with OPEN(snapshot_file_path, "wb") as f_obj:
-            pickle.dump(SnapshotPlus(self._snapshot, self.creation_stats, self.repo_mgmt_key), f_obj, pickle.HIGHEST_PROTOCOL)
+        # NB: written under a name private to this process and then linked
+        # to its final name so that a partially written snapshot file never
+        # appears in the archive and (as concurrent sessions may back up the
+        # same archive) another session's snapshot is never overwritten
+        tmp_file_path = os.path.join(self._archive.snapshot_dir_path, ".{}.snap.tmp".format(os.getpid()))
+        try:
+            _write_columnar_snapshot(tmp_file_path, SnapshotPlus(self._snapshot, self.creation_stats, self.repo_mgmt_key), compress)
+            self._activity_indicator.pulse()
+            os.chmod(tmp_file_path, permissions)
+            try:
+                os.link(tmp_file_path, snapshot_file_path)
+            except FileExistsError:
+                # NB: a later name would make the build start (derived from
+                # the name) look later than it was so our references are
+                # released (on exit) instead
+                raise excpns.SnapshotExists(self._archive.name, ss_root(snapshot_file_name))
+        finally:
+            if os.path.exists(tmp_file_path):
+                os.remove(tmp_file_path)
         self._snapshot = None # for reference count purposes we don't care if the permissions get set
         self._activity_indicator.pulse()
-        os.chmod(snapshot_file_path, permissions)
-        self._activity_indicator.pulse()
         self._activity_indicator.finished()
         return (ss_root(snapshot_file_name), os.path.getsize(snapshot_file_path))
 
 GSS = collections.namedtuple("GSS", ["name", "size", "stats", "write_etd"])
 
-def generate_snapshot(archive, compress=None, stderr=sys.stderr, report_skipped_links=True, activity_indicator=utils.DummyActivityIndicator()):
+def generate_snapshot(archive, compress=None, stderr=sys.stderr, report_skipped_links=True, incremental=False, jobs=1, activity_indicator=utils.DummyActivityIndicator()):
     from . import bmark
-    with SnapshotGenerator(archive, stderr=stderr, report_skipped_links=report_skipped_links, activity_indicator=activity_indicator) as snapshot_generator:
+    with SnapshotGenerator(archive, stderr=stderr, report_skipped_links=report_skipped_links, incremental=incremental, jobs=jobs, activity_indicator=activity_indicator) as snapshot_generator:
         snapshot_generator.generate_snapshot()
         start_time = bmark.get_os_times()
         snapshot_name, snapshot_size = snapshot_generator.write_snapshot(compress=compress)
@@ -731,7 +1086,9 @@ class SnapshotFS(collections.namedtuple("SnapshotFS", ["path", "archive_name", "
             for subdir in self.iterate_subdirs():
                 for slink in subdir.iterate_file_links(pre_path=os.path.join(pre_path, subdir.name), recurse=recurse):
                     yield slink
-    def copy_contents_to(self, target_dir_path, overwrite=False, stderr=sys.stderr, progress_indicator=utils.DummyProgressThingy()):
+    def copy_contents_to(self, target_dir_path, overwrite=False, stderr=sys.stderr, progress_indicator=utils.DummyProgressThingy(), link=False):
+        # NB: if link is true, files are hard linked to the repository's
+        # stored content where possible (see _BlobRepo.link_contents_to())
         from . import repo
         # Create the target directory if necessary
         dir_count = 0
@@ -801,6 +1158,10 @@ class SnapshotFS(collections.namedtuple("SnapshotFS", ["path", "archive_name", "
                         else:
                             hard_links[file_data.attributes.st_ino] = file_data
                     try:
+                        if link and repo_mgr.link_contents_to(file_data.content_token, file_data.path, file_data.attributes):
+                            file_count += 1
+                            gross_size += file_data.attributes.st_size
+                            continue
                         repo_mgr.copy_contents_to(file_data.content_token, file_data.path, file_data.attributes)
                     except excpns.CopyFileFailed as edata:
                         stderr.write(str(edata) + "\n")
@@ -822,29 +1183,38 @@ class SnapshotFS(collections.namedtuple("SnapshotFS", ["path", "archive_name", "
     def restore_subdir(self, subdir_path, overwrite=False, stderr=sys.stderr, progress_indicator=utils.DummyProgressThingy()):
         snapshot_subdir_ss = self.get_subdir(subdir_path)
         return snapshot_subdir_ss.copy_contents_to(subdir_path, overwrite=overwrite, stderr=stderr, progress_indicator=progress_indicator)
-    def get_statistics(self):
+    def get_statistics(self, verify=False, jobs=None):
+        # NB: stored sizes come from the index unless verify is True
         from . import repo
-        ck_set = set()
+        ref_counts = collections.Counter()
         n_files = 0
         n_bytes = 0
         n_stored_bytes = 0
         n_share_bytes = 0
+        for file_data in self.iterate_files(recurse=True):
+            n_files += 1
+            n_bytes += file_data.attributes.st_size
+            ref_counts[file_data.content_token] += 1
         # NB not using SFile.get_content_storage_stats() for LOCKING efficiency reasons
         with repo.open_repo_mgr(self.repo_mgmt_key, writeable=False) as repo_mgr:
-            for file_data in self.iterate_files(recurse=True):
-                n_files += 1
-                n_bytes += file_data.attributes.st_size
-                cis = repo_mgr.get_content_storage_stats(file_data.content_token)
-                n_share_bytes += cis.stored_size_per_ref
-                if not file_data.content_token in ck_set:
+            # NB: a chunked item's content is stored by its chunks and our
+            # share of a chunk is in proportion to our share of the items
+            chunk_refs = collections.Counter()
+            for content_token, cis in repo_mgr.iterate_content_storage_stats(ref_counts, verify, jobs):
+                n_stored_bytes += cis.stored_size
+                n_share_bytes += cis.stored_size_per_ref * ref_counts[content_token]
+                for chunk_token in repo_mgr.get_chunk_tokens(content_token) or []:
+                    chunk_refs[chunk_token] += float(ref_counts[content_token]) / max(cis.ref_count, 1)
+            for chunk_token, cis in repo_mgr.iterate_content_storage_stats(chunk_refs, verify, jobs):
+                if chunk_token not in ref_counts:
                     n_stored_bytes += cis.stored_size
-                    ck_set.add(file_data.content_token)
+                n_share_bytes += cis.stored_size_per_ref * chunk_refs[chunk_token]
         n_links = 0
         for link_data in self.iterate_file_links(recurse=True):
             n_links += 1
         for link_data in self.iterate_subdir_links(recurse=True):
             n_links += 1
-        return SSFSStats(n_files, n_links, n_bytes, len(ck_set), n_stored_bytes, n_share_bytes)
+        return SSFSStats(n_files, n_links, n_bytes, len(ref_counts), n_stored_bytes, n_share_bytes)
 
 def get_snapshot_fs_fm_file(snapshot_file_path):
     snapshot_file_name = os.path.basename(snapshot_file_path)
@@ -905,13 +1275,13 @@ def iter_snapshot_fs_list(archive_name, reverse=False):
     snapshot_names = _get_snapshot_file_list(archive.snapshot_dir_path, reverse=reverse)
     if not snapshot_names:
         raise excpns.EmptyArchive(archive_name)
-    try: # WORKAROUND: to handle snapshots without a key
-        repo_mgmt_key = snapshot.repo_mgmt_key
-    except AttributeError:
-        repo_mgmt_key = repo.get_repo_mgmt_key(archive.repo_name)
     for snapshot_name in snapshot_names:
         snapshot_file_path = os.path.join(archive.snapshot_dir_path, snapshot_name)
         snapshot = read_snapshot(snapshot_file_path)
+        try: # WORKAROUND: to handle snapshots without a key
+            repo_mgmt_key = snapshot.repo_mgmt_key
+        except AttributeError:
+            repo_mgmt_key = repo.get_repo_mgmt_key(archive.repo_name)
         snapshot_fs = SnapshotFS(os.sep, archive_name, ss_root(snapshot_name), snapshot, repo_mgmt_key)
         yield (snapshot_fs, os.path.getsize(snapshot_file_path))
 
@@ -966,13 +1336,13 @@ def iter_snapshot_list(archive_name, reverse=False):
     for snapshot_name in _get_snapshot_file_list(archive.snapshot_dir_path, reverse=reverse):
         snapshot_file_path = os.path.join(archive.snapshot_dir_path, snapshot_name)
         snapshot_size = os.path.getsize(snapshot_file_path)
-        snapshot_stats = read_snapshot(snapshot_file_path).creation_stats
+        snapshot_stats = read_snapshot_header(snapshot_file_path).creation_stats
         yield (ss_root(snapshot_name), snapshot_size, snapshot_stats)
 
 def get_snapshot_name_list(archive_name, reverse=False):
     from . import config
     archive = config.read_archive_spec(archive_name)
-    return [(ss_root(f), f.endswith(".gz")) for f in _get_snapshot_file_list(archive.snapshot_dir_path, reverse=reverse)]
+    return [(ss_root(f), _is_compressed_snapshot_file(os.path.join(archive.snapshot_dir_path, f))) for f in _get_snapshot_file_list(archive.snapshot_dir_path, reverse=reverse)]
 
 def create_new_archive(archive_name, location_dir_path, repo_spec, includes, exclude_dir_globs=None, exclude_file_globs=None, skip_broken_sl=True, compress_default=True):
     from . import config
@@ -995,7 +1365,7 @@ def create_new_archive(archive_name, location_dir_path, repo_spec, includes, exc
         config.delete_archive_spec(archive_name)
         raise excpns.SnapshotArchiveLocationNoPerm(archive_name)
 
-def _copy_file_to(snapshot_fs, file_path, into_dir_path, as_name=None, overwrite=False):
+def _copy_file_to(snapshot_fs, file_path, into_dir_path, as_name=None, overwrite=False, link=False):
     file_data = snapshot_fs.get_file(absolute_path(file_path))
     if as_name:
         if os.path.dirname(as_name):
@@ -1003,22 +1373,22 @@ def _copy_file_to(snapshot_fs, file_path, into_dir_path, as_name=None, overwrite
         target_path = os.path.join(absolute_path(into_dir_path), as_name)
     else:
         target_path = os.path.join(absolute_path(into_dir_path), os.path.basename(file_path))
-    file_data.copy_contents_to(target_path, overwrite=overwrite)
+    file_data.copy_contents_to(target_path, overwrite=overwrite, link=link)
     return file_data.attributes.st_size
 
-def copy_file_to(archive_name, file_path, into_dir_path, seln_fn=lambda l: l[-1], as_name=None, overwrite=False):
+def copy_file_to(archive_name, file_path, into_dir_path, seln_fn=lambda l: l[-1], as_name=None, overwrite=False, link=False):
     start_times = bmark.get_os_times()
     snapshot_fs = get_snapshot_fs(archive_name, seln_fn)
-    file_size = _copy_file_to(snapshot_fs, file_path, into_dir_path, as_name, overwrite)
+    file_size = _copy_file_to(snapshot_fs, file_path, into_dir_path, as_name, overwrite, link)
     return (file_size, (bmark.get_os_times() - start_times).get_etd())
 
-def exig_copy_file_to(snapshot_dir_path, file_path, into_dir_path, seln_fn=lambda l: l[-1], as_name=None, overwrite=False):
+def exig_copy_file_to(snapshot_dir_path, file_path, into_dir_path, seln_fn=lambda l: l[-1], as_name=None, overwrite=False, link=False):
     start_times = bmark.get_os_times()
     snapshot_fs = get_snapshot_fs_exig(snapshot_dir_path, seln_fn)
-    file_size = _copy_file_to(snapshot_fs, file_path, into_dir_path, as_name, overwrite)
+    file_size = _copy_file_to(snapshot_fs, file_path, into_dir_path, as_name, overwrite, link)
     return (file_size, (bmark.get_os_times() - start_times).get_etd())
 
-def _copy_subdir_to(snapshot_fs, subdir_path, into_dir_path, as_name=None, overwrite=False, stderr=sys.stderr):
+def _copy_subdir_to(snapshot_fs, subdir_path, into_dir_path, as_name=None, overwrite=False, stderr=sys.stderr, link=False):
     snapshot_subdir_ss = snapshot_fs.get_subdir(absolute_path(subdir_path))
     if as_name:
         if os.path.dirname(as_name):
@@ -1026,18 +1396,18 @@ def _copy_subdir_to(snapshot_fs, subdir_path, into_dir_path, as_name=None, overw
         target_path = os.path.join(absolute_path(into_dir_path), as_name)
     else:
         target_path = os.path.join(absolute_path(into_dir_path), os.path.basename(subdir_path.rstrip(os.sep)))
-    return snapshot_subdir_ss.copy_contents_to(target_path, overwrite=overwrite, stderr=stderr)
+    return snapshot_subdir_ss.copy_contents_to(target_path, overwrite=overwrite, stderr=stderr, link=link)
 
-def copy_subdir_to(archive_name, subdir_path, into_dir_path, seln_fn=lambda l: l[-1], as_name=None, overwrite=False, stderr=sys.stderr):
+def copy_subdir_to(archive_name, subdir_path, into_dir_path, seln_fn=lambda l: l[-1], as_name=None, overwrite=False, stderr=sys.stderr, link=False):
     start_times = bmark.get_os_times()
     snapshot_fs = get_snapshot_fs(archive_name, seln_fn)
-    copy_stats = _copy_subdir_to(snapshot_fs, subdir_path, into_dir_path, as_name=as_name, overwrite=overwrite, stderr=stderr)
+    copy_stats = _copy_subdir_to(snapshot_fs, subdir_path, into_dir_path, as_name=as_name, overwrite=overwrite, stderr=stderr, link=link)
     return (copy_stats, (bmark.get_os_times() - start_times).get_etd())
 
-def exig_copy_subdir_to(snapshot_dir_path, subdir_path, into_dir_path, seln_fn=lambda l: l[-1], as_name=None, overwrite=False, stderr=sys.stderr):
+def exig_copy_subdir_to(snapshot_dir_path, subdir_path, into_dir_path, seln_fn=lambda l: l[-1], as_name=None, overwrite=False, stderr=sys.stderr, link=False):
     start_times = bmark.get_os_times()
     snapshot_fs = get_snapshot_fs_exig(snapshot_dir_path, seln_fn)
-    copy_stats = _copy_subdir_to(snapshot_fs, subdir_path, into_dir_path, as_name=as_name, overwrite=overwrite, stderr=stderr)
+    copy_stats = _copy_subdir_to(snapshot_fs, subdir_path, into_dir_path, as_name=as_name, overwrite=overwrite, stderr=stderr, link=link)
     return (copy_stats, (bmark.get_os_times() - start_times).get_etd())
 
 def restore_file(archive_name, file_path, seln_fn=lambda l: l[-1], overwrite=False):
@@ -1080,32 +1450,73 @@ def get_snapshot_file_path(archive_name, seln_fn=lambda l: l[-1]):
         raise excpns.NoMatchingSnapshot([ss_root(ss_name) for ss_name in snapshot_names])
     return os.path.join(archive.snapshot_dir_path, snapshot_name)
 
+def _is_compressed_snapshot_file(snapshot_file_path):
+    if snapshot_file_path.endswith(_SNAPSHOT_FILE_SUFFIX):
+        return snapshot_file.is_compressed(snapshot_file_path)
+    return snapshot_file_path.endswith(".gz")
+
+def _set_snapshot_file_compression(snapshot_file_path, compress):
+    if snapshot_file_path.endswith(_SNAPSHOT_FILE_SUFFIX):
+        # NB: the blocks are (un)compressed in a copy which then replaces it
+        tmp_file_path = snapshot_file_path + ".tmp"
+        snapshot_file.rewrite_snapshot_file(snapshot_file_path, tmp_file_path, compress=compress)
+        os.chmod(tmp_file_path, os.stat(snapshot_file_path).st_mode)
+        os.replace(tmp_file_path, snapshot_file_path)
+    elif compress:
+        utils.compress_file(snapshot_file_path)
+    else:
+        utils.uncompress_file(snapshot_file_path)
+
 def compress_snapshot(archive_name, seln_fn=lambda l: l[-1]):
     snapshot_file_path = get_snapshot_file_path(archive_name, seln_fn)
-    if snapshot_file_path.endswith(".gz"):
+    if _is_compressed_snapshot_file(snapshot_file_path):
         raise excpns.SnapshotAlreadyCompressed(archive_name, ss_root(snapshot_file_path))
-    utils.compress_file(snapshot_file_path)
+    _set_snapshot_file_compression(snapshot_file_path, True)
 
 def uncompress_snapshot(archive_name, seln_fn=lambda l: l[-1]):
     snapshot_file_path = get_snapshot_file_path(archive_name, seln_fn)
-    if not snapshot_file_path.endswith(".gz"):
+    if not _is_compressed_snapshot_file(snapshot_file_path):
         raise excpns.SnapshotNotCompressed(archive_name, ss_root(snapshot_file_path))
-    utils.uncompress_file(snapshot_file_path)
+    _set_snapshot_file_compression(snapshot_file_path, False)
 
 def get_named_snapshot_file_path(archive_name, snapshot_name):
     from . import config
     archive = config.read_archive_spec(archive_name)
-    snapshot_file_path = os.path.join(archive.snapshot_dir_path, snapshot_name + ".pkl")
-    if os.path.isfile(snapshot_file_path):
-        return snapshot_file_path
-    snapshot_file_path += ".gz"
-    if os.path.isfile(snapshot_file_path):
-        return snapshot_file_path
+    for suffix in (_SNAPSHOT_FILE_SUFFIX, ".pkl", ".pkl.gz"):
+        snapshot_file_path = os.path.join(archive.snapshot_dir_path, snapshot_name + suffix)
+        if os.path.isfile(snapshot_file_path):
+            return snapshot_file_path
     raise excpns.SnapshotNotFound(archive_name, snapshot_name)
 
 def toggle_named_snapshot_compression(archive_name, snapshot_name):
     snapshot_file_path = get_named_snapshot_file_path(archive_name, snapshot_name)
-    if snapshot_file_path.endswith(".gz"):
-        utils.uncompress_file(snapshot_file_path)
-    else:
-        utils.compress_file(snapshot_file_path)
+    _set_snapshot_file_compression(snapshot_file_path, not _is_compressed_snapshot_file(snapshot_file_path))
+
+def convert_snapshot_file(snapshot_file_path):
+    """Replace a pickled snapshot file with its columnar equivalent"""
+    snapshot_plus = read_snapshot(snapshot_file_path)
+    new_file_path = os.path.join(os.path.dirname(snapshot_file_path), ss_root(snapshot_file_path) + _SNAPSHOT_FILE_SUFFIX)
+    tmp_file_path = new_file_path + ".tmp"
+    _write_columnar_snapshot(tmp_file_path, snapshot_plus, snapshot_file_path.endswith(".gz"))
+    os.chmod(tmp_file_path, os.stat(snapshot_file_path).st_mode)
+    os.rename(tmp_file_path, new_file_path)
+    os.remove(snapshot_file_path)
+    return new_file_path
+
+def convert_archive_snapshots(archive_name):
+    """Convert the archive's pickled snapshots to the columnar format and
+    return the number converted"""
+    from . import config
+    archive = config.read_archive_spec(archive_name)
+    count = 0
+    for file_name in sorted(os.listdir(archive.snapshot_dir_path)):
+        if not _SNAPSHOT_FILE_NAME_CRE.match(file_name) or file_name.endswith(_SNAPSHOT_FILE_SUFFIX):
+            continue
+        snapshot_file_path = os.path.join(archive.snapshot_dir_path, file_name)
+        if os.path.exists(os.path.join(archive.snapshot_dir_path, ss_root(file_name) + _SNAPSHOT_FILE_SUFFIX)):
+            # NB: left over from an interrupted conversion
+            os.remove(snapshot_file_path)
+            continue
+        convert_snapshot_file(snapshot_file_path)
+        count += 1
+    return count
@@ -0,0 +1,240 @@
+### Copyright (C) 2016 Peter Williams <pwil3058@gmail.com>
+###
+### This program is free software; you can redistribute it and/or modify
+### it under the terms of the GNU General Public License as published by
+### the Free Software Foundation; version 2 of the License only.
+###
+### This program is distributed in the hope that it will be useful,
+### but WITHOUT ANY WARRANTY; without even the implied warranty of
+### MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+### GNU General Public License for more details.
+###
+### You should have received a copy of the GNU General Public License
+### along with this program; if not, write to the Free Software
+### Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+"""Columnar snapshot files: a directory table (in breadth first order so
+that each directory's subdirectories are contiguous), a string table of
+directory names and, for each directory, a block of fixed width file and
+link records (followed by their names) that may be decoded individually
+so that a directory can be listed without reading the whole snapshot."""
+
+import collections
+import mmap
+import os
+import pickle
+import struct
+import sys
+import zlib
+
+MAGIC = b"EPYGSNAP"
+FORMAT_VERSION = 1
+
+# NB: flags
+COMPRESSED = 1
+
+# NB: magic, version, flags, token size, number of directories, number of
+# files (and file links), directory table offset, string table offset and
+# size, meta data offset and size
+_HEADER = struct.Struct("<8sIIIQQQQQQQ")
+# NB: the attributes (see snapshot.ATTR_TUPLE) with times last as they may be negative
+_ATTRS_FORMAT = "7Q3q"
+_NATTRS = 10
+ATTRS_RECORD = struct.Struct("<" + _ATTRS_FORMAT)
+# NB: name offset and length, parent, first subdir, number of subdirs,
+# block offset and (stored) size, numbers of files, file links and subdir
+# links, whether attributes are present and the attributes
+_DIR_RECORD = struct.Struct("<QIIIIQQIIIB" + _ATTRS_FORMAT)
+# NB: name offset and length (in the block's strings), (packed) attributes
+# and target offset and length
+_LINK_RECORD = struct.Struct("<II{}sII".format(ATTRS_RECORD.size))
+_file_record = lambda token_size: struct.Struct("<II{}s{}s".format(ATTRS_RECORD.size, token_size))
+
+# NB: attributes may be provided already packed (as bytes)
+_pack_attrs = lambda attributes: attributes if isinstance(attributes, bytes) else ATTRS_RECORD.pack(*attributes)
+
+DirRecord = collections.namedtuple("DirRecord", ["name", "parent", "first_subdir", "nsubdirs", "block_offset", "block_size", "nfiles", "nfile_links", "nsubdir_links", "attributes"])
+
+def _encode_block(snapshot, file_record):
+    strings = bytearray()
+    records = bytearray()
+    def add_string(string):
+        data = os.fsencode(string)
+        offset = len(strings)
+        strings.extend(data)
+        return (offset, len(data))
+    for name in sorted(snapshot.files):
+        attributes, content_token = snapshot.files[name]
+        records += file_record.pack(*add_string(name), _pack_attrs(attributes), content_token)
+    for links in (snapshot.file_links, snapshot.subdir_links):
+        for name in sorted(links):
+            attributes, tgt_path = links[name]
+            name_offset, name_length = add_string(name)
+            records += _LINK_RECORD.pack(name_offset, name_length, _pack_attrs(attributes), *add_string(tgt_path))
+    return bytes(records + strings)
+
+def _get_token_size(snapshot):
+    # NB: all of a snapshot's tokens are from the same hash algorithm
+    dirs = [snapshot]
+    while dirs:
+        snapshot = dirs.pop()
+        for _attributes, content_token in snapshot.files.values():
+            return len(content_token)
+        dirs.extend(snapshot.subdirs.values())
+    return 0
+
+def write_snapshot_file(file_path, snapshot, meta, compress=False):
+    """Write snapshot (a tree of objects with attributes, subdirs, files
+    (with bytes content tokens), file_links and subdir_links) and meta
+    (basic python types) to file_path"""
+    token_size = _get_token_size(snapshot)
+    file_record = _file_record(token_size)
+    dirs = [(snapshot, 0, "")]
+    dir_records = bytearray()
+    names = bytearray()
+    name_offsets = {}
+    nfiles = 0
+    with open(file_path, "wb") as f_out:
+        f_out.write(bytes(_HEADER.size))
+        offset = _HEADER.size
+        index = 0
+        while index < len(dirs):
+            snapshot, parent, name = dirs[index]
+            first_subdir = len(dirs)
+            dirs.extend((snapshot.subdirs[subdir_name], index, subdir_name) for subdir_name in sorted(snapshot.subdirs))
+            block = _encode_block(snapshot, file_record)
+            if compress:
+                block = zlib.compress(block)
+            f_out.write(block)
+            name = os.fsencode(name)
+            if name not in name_offsets:
+                name_offsets[name] = len(names)
+                names.extend(name)
+            attributes = snapshot.attributes
+            dir_records += _DIR_RECORD.pack(name_offsets[name], len(name), parent, first_subdir, len(snapshot.subdirs), offset, len(block), len(snapshot.files), len(snapshot.file_links), len(snapshot.subdir_links), attributes is not None, *(attributes or (0,) * _NATTRS))
+            nfiles += len(snapshot.files) + len(snapshot.file_links)
+            offset += len(block)
+            # NB: we're finished with it
+            dirs[index] = None
+            index += 1
+        dir_table_offset = offset
+        f_out.write(dir_records)
+        names_offset = f_out.tell()
+        f_out.write(names)
+        meta_data = pickle.dumps(meta, pickle.HIGHEST_PROTOCOL)
+        meta_offset = f_out.tell()
+        f_out.write(meta_data)
+        f_out.seek(0)
+        f_out.write(_HEADER.pack(MAGIC, FORMAT_VERSION, COMPRESSED if compress else 0, token_size, len(dirs), nfiles, dir_table_offset, names_offset, len(names), meta_offset, len(meta_data)))
+
+SnapshotFileHeader = collections.namedtuple("SnapshotFileHeader", ["version", "flags", "token_size", "ndirs", "nfiles", "meta"])
+
+def _unpack_header(data, file_path):
+    if len(data) < _HEADER.size:
+        raise ValueError(file_path)
+    fields = _HEADER.unpack_from(data)
+    if fields[0] != MAGIC or fields[1] > FORMAT_VERSION:
+        raise ValueError(file_path)
+    return fields
+
+def read_header(file_path):
+    """Read the snapshot file's header and meta data (but nothing else)"""
+    with open(file_path, "rb") as f_in:
+        _magic, version, flags, token_size, ndirs, nfiles, _dir_table_offset, _names_offset, _names_size, meta_offset, meta_size = _unpack_header(f_in.read(_HEADER.size), file_path)
+        f_in.seek(meta_offset)
+        meta = pickle.loads(f_in.read(meta_size))
+    return SnapshotFileHeader(version, flags, token_size, ndirs, nfiles, meta)
+
+def is_compressed(file_path):
+    with open(file_path, "rb") as f_in:
+        return bool(_unpack_header(f_in.read(_HEADER.size), file_path)[2] & COMPRESSED)
+
+class SnapshotFileReader:
+    """Random access to the directories of a snapshot file which is memory
+    mapped (if possible) so that only the parts that are used are read"""
+    def __init__(self, file_path):
+        with open(file_path, "rb") as f_in:
+            try:
+                self._buffer = mmap.mmap(f_in.fileno(), 0, access=mmap.ACCESS_READ)
+            except (OSError, ValueError):
+                # e.g. an empty file or a file system that doesn't support it
+                self._buffer = f_in.read()
+        _magic, self.version, self.flags, self.token_size, self.ndirs, self.nfiles, self._dir_table_offset, self._names_offset, _names_size, meta_offset, meta_size = _unpack_header(self._buffer, file_path)
+        self._file_record = _file_record(self.token_size)
+        self.meta = pickle.loads(self._buffer[meta_offset:meta_offset + meta_size])
+    @property
+    def compressed(self):
+        return bool(self.flags & COMPRESSED)
+    def get_dir(self, index):
+        fields = _DIR_RECORD.unpack_from(self._buffer, self._dir_table_offset + index * _DIR_RECORD.size)
+        name = sys.intern(os.fsdecode(self._buffer[self._names_offset + fields[0]:self._names_offset + fields[0] + fields[1]]))
+        return DirRecord(name, *fields[2:10], tuple(fields[11:]) if fields[10] else None)
+    def iterate_subdirs(self, dir_record):
+        for index in range(dir_record.first_subdir, dir_record.first_subdir + dir_record.nsubdirs):
+            yield (index, self.get_dir(index))
+    def read_block(self, dir_record):
+        block = self._buffer[dir_record.block_offset:dir_record.block_offset + dir_record.block_size]
+        return zlib.decompress(block) if self.compressed else block
+    def read_entries(self, dir_record, make_attributes=ATTRS_RECORD.unpack):
+        # NB: returns dicts of the directory's files (with bytes content
+        # tokens), file links and subdir links with their attributes made
+        # from the packed record
+        block = self.read_block(dir_record)
+        file_record = self._file_record
+        links_offset = dir_record.nfiles * file_record.size
+        strings_offset = links_offset + (dir_record.nfile_links + dir_record.nsubdir_links) * _LINK_RECORD.size
+        string = lambda offset, length: os.fsdecode(block[strings_offset + offset:strings_offset + offset + length])
+        files = {sys.intern(string(n_offset, n_length)): (make_attributes(attrs), token) for n_offset, n_length, attrs, token in file_record.iter_unpack(block[:links_offset])}
+        links = [(sys.intern(string(n_offset, n_length)), (make_attributes(attrs), string(t_offset, t_length))) for n_offset, n_length, attrs, t_offset, t_length in _LINK_RECORD.iter_unpack(block[links_offset:strings_offset])]
+        return (files, dict(links[:dir_record.nfile_links]), dict(links[dir_record.nfile_links:]))
+    def iterate_content_tokens(self):
+        file_record = self._file_record
+        token_offset = file_record.size - self.token_size
+        for index in range(self.ndirs):
+            dir_record = self.get_dir(index)
+            if not dir_record.nfiles:
+                continue
+            block = self.read_block(dir_record)
+            for offset in range(token_offset, dir_record.nfiles * file_record.size, file_record.size):
+                yield block[offset:offset + self.token_size].hex()
+
+_Entries = collections.namedtuple("_Entries", ["files", "file_links", "subdir_links"])
+
+def rewrite_snapshot_file(file_path, new_file_path, compress=None, new_tokens=None):
+    """Write a copy of the snapshot file (compressed or not as requested)
+    with its content tokens replaced by their values in new_tokens (if
+    provided) one directory at a time"""
+    reader = SnapshotFileReader(file_path)
+    compress = reader.compressed if compress is None else compress
+    token_size = reader.token_size
+    if new_tokens:
+        token_size = len(next(iter(new_tokens.values()))) // 2
+    file_record = _file_record(token_size)
+    dir_records = bytearray()
+    with open(new_file_path, "wb") as f_out:
+        f_out.write(bytes(_HEADER.size))
+        offset = _HEADER.size
+        for index in range(reader.ndirs):
+            dir_record = reader.get_dir(index)
+            # NB: the attributes are passed through as is
+            entries = _Entries(*reader.read_entries(dir_record, bytes))
+            if new_tokens:
+                for name, (attributes, content_token) in entries.files.items():
+                    entries.files[name] = (attributes, bytes.fromhex(new_tokens[content_token.hex()]))
+            block = _encode_block(entries, file_record)
+            if compress:
+                block = zlib.compress(block)
+            f_out.write(block)
+            fields = list(_DIR_RECORD.unpack_from(reader._buffer, reader._dir_table_offset + index * _DIR_RECORD.size))
+            fields[5:7] = [offset, len(block)]
+            dir_records += _DIR_RECORD.pack(*fields)
+            offset += len(block)
+        dir_table_offset = offset
+        f_out.write(dir_records)
+        names_offset = f_out.tell()
+        _magic, _version, _flags, _token_size, ndirs, nfiles, _dir_table_offset, old_names_offset, names_size, meta_offset, meta_size = _HEADER.unpack_from(reader._buffer)
+        f_out.write(reader._buffer[old_names_offset:old_names_offset + names_size])
+        new_meta_offset = f_out.tell()
+        f_out.write(reader._buffer[meta_offset:meta_offset + meta_size])
+        f_out.seek(0)
+        f_out.write(_HEADER.pack(MAGIC, FORMAT_VERSION, COMPRESSED if compress else 0, token_size, ndirs, nfiles, dir_table_offset, names_offset, names_size, new_meta_offset, meta_size))
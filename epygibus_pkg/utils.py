@@ -71,6 +71,49 @@ class DummyProgressThingy:
     def finished(self):
         pass
 
+class TextProgressThingy:
+    """Report the progress of a task whose total is measured in bytes
+    (along with its rate and estimated time to completion) on a text
+    stream at most every interval seconds"""
+    def __init__(self, f_out, label, interval=1.0):
+        self._f_out = f_out
+        self._label = label
+        self._interval = interval
+        self._total = 0
+        self._count = 0
+        self._start_time = self._last_report_time = None
+    def _start(self):
+        # NB: the task starts with whichever of these is called first
+        import time
+        if self._start_time is None:
+            self._start_time = self._last_report_time = time.time()
+    def set_expected_total(self, total):
+        self._start()
+        self._total = total
+    def increment_count(self, by=1):
+        import time
+        self._start()
+        self._count += by
+        now = time.time()
+        if now - self._last_report_time >= self._interval:
+            self._last_report_time = now
+            self._report(now)
+    def finished(self):
+        import time
+        if self._start_time is not None:
+            self._report(time.time())
+            self._f_out.write("\n")
+    def _report(self, now):
+        elapsed_time = now - self._start_time
+        rate = self._count / elapsed_time if elapsed_time > 0 else 0.0
+        if rate:
+            seconds = int((self._total - self._count) / rate) if self._total > self._count else 0
+            eta = "{}:{:02}:{:02}".format(seconds // 3600, (seconds // 60) % 60, seconds % 60)
+        else:
+            eta = "?"
+        self._f_out.write("\r{}: {} of {} ({}/s) ETA: {}".format(self._label, format_bytes(self._count), format_bytes(self._total), format_bytes(rate), eta))
+        self._f_out.flush()
+
 class DummyActivityIndicator:
     def start(self, only_every=0):
         pass
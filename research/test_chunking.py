@@ -0,0 +1,99 @@
+### Copyright (C) 2016 Peter Williams <pwil3058@gmail.com>
+###
+### This program is free software; you can redistribute it and/or modify
+### it under the terms of the GNU General Public License as published by
+### the Free Software Foundation; version 2 of the License only.
+###
+### This program is distributed in the hope that it will be useful,
+### but WITHOUT ANY WARRANTY; without even the implied warranty of
+### MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+### GNU General Public License for more details.
+###
+### You should have received a copy of the GNU General Public License
+### along with this program; if not, write to the Free Software
+### Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+import hashlib
+import os
+import sys
+import time
+import argparse
+import io
+import random
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from epygibus_pkg import repo
+
+parser = argparse.ArgumentParser(description="Compare the deduplication ratio and throughput of whole file and content defined chunk storage over a series of versions of a file.")
+parser.add_argument("--size", metavar="MB", type=int, default=32, help="the size (in megabytes) of the initial version of the file")
+parser.add_argument("--versions", metavar="N", type=int, default=10, help="the number of versions of the file to be stored")
+parser.add_argument("--change", metavar="KB", type=int, default=8, help="the amount of data (in kilobytes) changed in each new version")
+parser.add_argument("--seed", metavar="N", type=int, default=42, help="the seed for the random number generator")
+
+args = parser.parse_args()
+
+random.seed(args.seed)
+
+def random_bytes(size):
+    return random.getrandbits(size * 8).to_bytes(size, "little")
+
+def text_bytes(size):
+    words = [random_bytes(random.randint(2, 8)).hex() for i in range(2000)]
+    lines = []
+    length = 0
+    while length < size:
+        line = " ".join(random.choice(words) for i in range(random.randint(4, 16))) + "\n"
+        lines.append(line)
+        length += len(line)
+    return "".join(lines).encode()[:size]
+
+def append_versions(initial, maker):
+    data = initial
+    for i in range(args.versions):
+        yield data
+        data = data + maker(args.change * 1024)
+
+def insert_versions(initial, maker):
+    data = initial
+    for i in range(args.versions):
+        yield data
+        offset = random.randrange(len(data))
+        data = data[:offset] + maker(args.change * 1024) + data[offset:]
+
+def overwrite_versions(initial, maker):
+    data = initial
+    for i in range(args.versions):
+        yield data
+        offset = random.randrange(len(data) - args.change * 1024)
+        data = data[:offset] + maker(args.change * 1024) + data[offset + args.change * 1024:]
+
+def measure(versions):
+    whole_tokens = {}
+    chunk_tokens = {}
+    logical_bytes = 0
+    whole_time = 0.0
+    chunk_time = 0.0
+    for data in versions:
+        logical_bytes += len(data)
+        start = time.perf_counter()
+        whole_tokens[hashlib.sha1(data).hexdigest()] = len(data)
+        whole_time += time.perf_counter() - start
+        start = time.perf_counter()
+        chunk_list = []
+        for chunk in repo.split_into_chunks(io.BytesIO(data)):
+            token = hashlib.sha1(chunk).hexdigest()
+            chunk_tokens[token] = len(chunk)
+            chunk_list.append(token)
+        chunk_time += time.perf_counter() - start
+        chunk_tokens[hashlib.sha1(data).hexdigest()] = len(chunk_list) * 41
+    return (logical_bytes, sum(whole_tokens.values()), whole_time, sum(chunk_tokens.values()), chunk_time)
+
+print("{:>8} {:>10} {:>12} {:>10} {:>7} {:>8} {:>12} {:>7} {:>8}".format("Data", "Change", "Logical(MB)", "Whole(MB)", "Ratio", "MB/s", "Chunked(MB)", "Ratio", "MB/s"))
+size = args.size * 1024 * 1024
+for data_name, maker in [("random", random_bytes), ("text", text_bytes)]:
+    initial = maker(size)
+    for change_name, generator in [("append", append_versions), ("insert", insert_versions), ("overwrite", overwrite_versions)]:
+        logical, whole, whole_time, chunked, chunk_time = measure(generator(initial, maker))
+        MB = float(1024 * 1024)
+        print("{:>8} {:>10} {:>12.1f} {:>10.1f} {:>7.2f} {:>8.1f} {:>12.1f} {:>7.2f} {:>8.1f}".format(data_name, change_name, logical / MB, whole / MB, logical / whole, logical / MB / whole_time, chunked / MB, logical / chunked, logical / MB / chunk_time))
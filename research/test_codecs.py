@@ -0,0 +1,77 @@
+### Copyright (C) 2016 Peter Williams <pwil3058@gmail.com>
+###
+### This program is free software; you can redistribute it and/or modify
+### it under the terms of the GNU General Public License as published by
+### the Free Software Foundation; version 2 of the License only.
+###
+### This program is distributed in the hope that it will be useful,
+### but WITHOUT ANY WARRANTY; without even the implied warranty of
+### MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+### GNU General Public License for more details.
+###
+### You should have received a copy of the GNU General Public License
+### along with this program; if not, write to the Free Software
+### Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+import os
+import sys
+import time
+import argparse
+import io
+import random
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from epygibus_pkg import repo
+from epygibus_pkg import codec
+
+parser = argparse.ArgumentParser(description="Compare the compression ratio and throughput of the available codecs on a random sample of a repository's content items.")
+parser.add_argument("repo_name", metavar="repository", help="the name of the repository to be sampled")
+parser.add_argument("--sample", metavar="MB", type=int, default=64, help="the (approximate) amount of content (in megabytes) to sample")
+parser.add_argument("--codecs", metavar="codec", nargs="+", default=["gzip-1", "gzip-6", "gzip-9", "bz2-1", "bz2-9", "lzma-0", "lzma-6"], choices=list(codec.CODECS), help="the codecs to be compared")
+parser.add_argument("--seed", metavar="N", type=int, default=42, help="the seed for the random number generator")
+
+args = parser.parse_args()
+
+random.seed(args.seed)
+
+def read_sample():
+    sample = []
+    total = 0
+    with repo.open_repo_mgr(repo.get_repo_mgmt_key(args.repo_name), writeable=False) as repo_mgr:
+        citems = [(token, content_size) for token, _ref_count, content_size, _stored_size, chunked in repo_mgr.iterate_content_tokens() if not chunked]
+        random.shuffle(citems)
+        for token, content_size in citems:
+            if total >= args.sample * 1024 * 1024:
+                break
+            with repo_mgr.open_contents_read_only(token, binary=True) as f_in:
+                sample.append(f_in.read())
+            total += content_size
+    return sample
+
+def measure(sample, a_codec):
+    encoded = []
+    start = time.perf_counter()
+    for data in sample:
+        f_out = io.BytesIO()
+        with a_codec.open(f_out, "wb") as f_enc:
+            f_enc.write(data)
+        encoded.append(f_out.getvalue())
+    encode_time = time.perf_counter() - start
+    start = time.perf_counter()
+    for data in encoded:
+        with a_codec.open(io.BytesIO(data), "rb") as f_dec:
+            f_dec.read()
+    decode_time = time.perf_counter() - start
+    return (sum(len(data) for data in encoded), encode_time, decode_time)
+
+sample = read_sample()
+sample_size = sum(len(data) for data in sample)
+MB = float(1024 * 1024)
+print("Sampled {} content items holding {:.1f} MB".format(len(sample), sample_size / MB))
+print("{:>8} {:>12} {:>7} {:>12} {:>12}".format("Codec", "Stored(MB)", "Ratio", "Encode MB/s", "Decode MB/s"))
+for codec_name in args.codecs:
+    if codec_name == codec.NONE.name:
+        continue
+    stored_size, encode_time, decode_time = measure(sample, codec.get_codec(codec_name))
+    print("{:>8} {:>12.1f} {:>7.2f} {:>12.1f} {:>12.1f}".format(codec_name, stored_size / MB, sample_size / stored_size, sample_size / MB / encode_time, sample_size / MB / decode_time))
@@ -0,0 +1,82 @@
+### Copyright (C) 2016 Peter Williams <pwil3058@gmail.com>
+###
+### This program is free software; you can redistribute it and/or modify
+### it under the terms of the GNU General Public License as published by
+### the Free Software Foundation; version 2 of the License only.
+###
+### This program is distributed in the hope that it will be useful,
+### but WITHOUT ANY WARRANTY; without even the implied warranty of
+### MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+### GNU General Public License for more details.
+###
+### You should have received a copy of the GNU General Public License
+### along with this program; if not, write to the Free Software
+### Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+import hashlib
+import os
+import time
+import argparse
+import mmap
+import io
+import tempfile
+import tracemalloc
+
+parser = argparse.ArgumentParser(description="Compare peak memory use and throughput of options for getting file sha1 digest over a range of file sizes.")
+parser.add_argument("--sizes", metavar="MB", type=int, nargs="+", default=[1, 16, 64, 256], help="the sizes (in megabytes) of the files to be tested")
+parser.add_argument("--chunk_size", metavar="bytes", type=int, default=1024 * 1024, help="the chunk size to use for chunked reads")
+parser.add_argument("--iterations", metavar="N", type=int, default=3, help="the number of times each digest is calculated")
+
+args = parser.parse_args()
+
+EMPTY_FILE_HASH = hashlib.sha1(b"").hexdigest()
+
+def hex_digest_read(fobj):
+    return hashlib.sha1(fobj.read()).hexdigest()
+
+def hex_digest_mmap(fobj):
+    try:
+        m = mmap.mmap(fobj.fileno(), 0, access=mmap.ACCESS_READ)
+        hd = hashlib.sha1(m).hexdigest()
+        m.close()
+    except ValueError:
+        hd = EMPTY_FILE_HASH
+    return hd
+
+def hex_digest_read_chunks(fobj):
+    h = hashlib.sha1()
+    for x in iter(lambda: fobj.read(args.chunk_size), b""):
+        h.update(x)
+    return h.hexdigest()
+
+def make_test_file(size_mb):
+    f_obj = tempfile.NamedTemporaryFile(delete=False)
+    with f_obj:
+        block = os.urandom(1024 * 1024)
+        for i in range(size_mb):
+            f_obj.write(block)
+    return f_obj.name
+
+def measure(file_path, functn):
+    digests = set()
+    tracemalloc.start()
+    start = time.perf_counter()
+    for i in range(args.iterations):
+        with io.open(file_path, "rb") as fobj:
+            digests.add(functn(fobj))
+    duration = time.perf_counter() - start
+    _current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert len(digests) == 1
+    return (duration, peak)
+
+print("{:>8} {:>24} {:>14} {:>10}".format("Size(MB)", "Method", "Peak Mem(MB)", "MB/s"))
+for size_mb in args.sizes:
+    file_path = make_test_file(size_mb)
+    try:
+        for name in ["hex_digest_read", "hex_digest_mmap", "hex_digest_read_chunks"]:
+            duration, peak = measure(file_path, eval(name))
+            rate = (size_mb * args.iterations) / duration if duration else float("inf")
+            print("{:>8} {:>24} {:>14.2f} {:>10.1f}".format(size_mb, name, float(peak) / (1024 * 1024), rate))
+    finally:
+        os.remove(file_path)
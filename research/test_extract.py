@@ -0,0 +1,64 @@
+### Copyright (C) 2016 Peter Williams <pwil3058@gmail.com>
+###
+### This program is free software; you can redistribute it and/or modify
+### it under the terms of the GNU General Public License as published by
+### the Free Software Foundation; version 2 of the License only.
+###
+### This program is distributed in the hope that it will be useful,
+### but WITHOUT ANY WARRANTY; without even the implied warranty of
+### MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+### GNU General Public License for more details.
+###
+### You should have received a copy of the GNU General Public License
+### along with this program; if not, write to the Free Software
+### Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+import os
+import sys
+import time
+import argparse
+import shutil
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from epygibus_pkg import repo
+from epygibus_pkg import snapshot
+
+parser = argparse.ArgumentParser(description="Compare the time taken to extract an archive's latest (or specified) snapshot using in kernel (copy_file_range()/sendfile()) copying and copying through user space.  The difference is only significant for repositories whose content isn't encoded.")
+parser.add_argument("archive_name", metavar="archive", help="the name of the archive whose snapshot is to be extracted")
+parser.add_argument("--back", metavar="N", type=int, default=0, help="the number of snapshots before the latest to use")
+parser.add_argument("--into_dir", metavar="path", default=None, help="the directory (on the file system of interest) in which to extract the snapshot (default: a temporary directory)")
+parser.add_argument("--iterations", metavar="N", type=int, default=3, help="the number of times the snapshot is extracted by each method")
+
+args = parser.parse_args()
+
+_zero_copy = repo._copy_file_contents
+
+def _user_space_copy(f_in, f_out):
+    shutil.copyfileobj(f_in, f_out, repo._DIGEST_CHUNK_SIZE)
+
+def measure(snapshot_fs, copy_function, into_dir_path):
+    repo._copy_file_contents = copy_function
+    durations = []
+    for i in range(args.iterations):
+        target_dir_path = tempfile.mkdtemp(dir=into_dir_path)
+        try:
+            start = time.perf_counter()
+            start_times = os.times()
+            stats = snapshot_fs.copy_contents_to(target_dir_path)
+            # NB: include the time taken to get the data to the device
+            os.sync()
+            end_times = os.times()
+            durations.append((time.perf_counter() - start, end_times.user - start_times.user, end_times.system - start_times.system))
+        finally:
+            shutil.rmtree(target_dir_path)
+    repo._copy_file_contents = _zero_copy
+    return (stats, min(durations))
+
+snapshot_fs = snapshot.get_snapshot_fs(args.archive_name, seln_fn=lambda l: l[-1-args.back])
+MB = float(1024 * 1024)
+print("{:>12} {:>8} {:>12} {:>10} {:>10} {:>10} {:>10}".format("Method", "Files", "Size(MB)", "Time(s)", "User(s)", "System(s)", "MB/s"))
+for name, copy_function in [("user_space", _user_space_copy), ("zero_copy", _zero_copy)]:
+    stats, (duration, user_time, system_time) = measure(snapshot_fs, copy_function, args.into_dir)
+    print("{:>12} {:>8} {:>12.1f} {:>10.2f} {:>10.2f} {:>10.2f} {:>10.1f}".format(name, stats.file_count, stats.gross_bytes / MB, duration, user_time, system_time, stats.gross_bytes / MB / duration))
@@ -0,0 +1,103 @@
+### Copyright (C) 2016 Peter Williams <pwil3058@gmail.com>
+###
+### This program is free software; you can redistribute it and/or modify
+### it under the terms of the GNU General Public License as published by
+### the Free Software Foundation; version 2 of the License only.
+###
+### This program is distributed in the hope that it will be useful,
+### but WITHOUT ANY WARRANTY; without even the implied warranty of
+### MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+### GNU General Public License for more details.
+###
+### You should have received a copy of the GNU General Public License
+### along with this program; if not, write to the Free Software
+### Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+import os
+import sys
+import time
+import argparse
+import collections
+import random
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from epygibus_pkg import cindex
+
+parser = argparse.ArgumentParser(description="Compare the memory use and latency of the in memory representations of per content item reference counts.")
+parser.add_argument("--items", metavar="N", type=int, nargs="+", default=[100000, 1000000], help="the numbers of content items to be tested")
+parser.add_argument("--digest_size", metavar="bytes", type=int, default=20, help="the size of the (binary) content tokens")
+parser.add_argument("--seed", metavar="N", type=int, default=42, help="the seed for the random number generator")
+
+args = parser.parse_args()
+
+random.seed(args.seed)
+
+class DictOfDicts:
+    # NB: the original (pickled) ref_counter layout
+    def __init__(self):
+        self.ref_counter = {}
+    def incr(self, token, delta):
+        subdir_data = self.ref_counter.setdefault(token[:2], {}).setdefault(token[2:4], {})
+        try:
+            subdir_data[token[4:]][0] += delta
+        except KeyError:
+            subdir_data[token[4:]] = [delta, 0, 0]
+    def get(self, token, default=None):
+        try:
+            return self.ref_counter[token[:2]][token[2:4]][token[4:]][0]
+        except KeyError:
+            return default
+    def items(self):
+        for dir_name, dir_data in self.ref_counter.items():
+            for subdir_name, subdir_data in dir_data.items():
+                for file_name, data in subdir_data.items():
+                    yield (dir_name + subdir_name + file_name, data[0])
+
+class HexCounter(collections.Counter):
+    def incr(self, token, delta):
+        self[token] += delta
+
+def build(factory, digests):
+    # NB: as in a back up, the mapping holds the only reference to each token
+    mapping = factory()
+    for digest in digests:
+        mapping.incr(digest.hex(), 1)
+    return mapping
+
+def measure_memory(factory, digests):
+    tracemalloc.start()
+    mapping = build(factory, digests)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del mapping
+    return (current, peak)
+
+def measure_latency(factory, digests, probes):
+    start = time.perf_counter()
+    mapping = build(factory, digests)
+    build_time = time.perf_counter() - start
+    start = time.perf_counter()
+    for token in probes:
+        mapping.incr(token, 1)
+    incr_time = time.perf_counter() - start
+    start = time.perf_counter()
+    for token in probes:
+        mapping.get(token, 0)
+    get_time = time.perf_counter() - start
+    start = time.perf_counter()
+    total = sum(delta for _token, delta in mapping.items())
+    scan_time = time.perf_counter() - start
+    assert total == len(digests) + len(probes)
+    return (build_time, incr_time, get_time, scan_time)
+
+MB = float(1024 * 1024)
+print("{:>9} {:>12} {:>10} {:>10} {:>10} {:>10} {:>10} {:>10}".format("Items", "Method", "Mem(MB)", "Peak(MB)", "Build(s)", "Incr(us)", "Get(us)", "Scan(s)"))
+for num_items in args.items:
+    digests = [os.urandom(args.digest_size) for _ in range(num_items)]
+    probes = [digest.hex() for digest in random.sample(digests, min(num_items, 100000))]
+    for name, factory in [("dict_of_dicts", DictOfDicts), ("hex_counter", HexCounter), ("ref_deltas", cindex.RefDeltas)]:
+        current, peak = measure_memory(factory, digests)
+        build_time, incr_time, get_time, scan_time = measure_latency(factory, digests, probes)
+        print("{:>9} {:>12} {:>10.1f} {:>10.1f} {:>10.2f} {:>10.2f} {:>10.2f} {:>10.2f}".format(num_items, name, current / MB, peak / MB, build_time, incr_time * 1e6 / len(probes), get_time * 1e6 / len(probes), scan_time))
@@ -0,0 +1,93 @@
+### Copyright (C) 2016 Peter Williams <pwil3058@gmail.com>
+###
+### This program is free software; you can redistribute it and/or modify
+### it under the terms of the GNU General Public License as published by
+### the Free Software Foundation; version 2 of the License only.
+###
+### This program is distributed in the hope that it will be useful,
+### but WITHOUT ANY WARRANTY; without even the implied warranty of
+### MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+### GNU General Public License for more details.
+###
+### You should have received a copy of the GNU General Public License
+### along with this program; if not, write to the Free Software
+### Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+import os
+import sys
+import time
+import argparse
+import random
+import shutil
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from epygibus_pkg import cindex
+
+parser = argparse.ArgumentParser(description="Compare the cost of the item statistics of back up sessions (one per include) when calculated from the index's totals and from the session's running counts.")
+parser.add_argument("--items", metavar="N", type=int, nargs="+", default=[10000, 100000, 1000000], help="the numbers of content items in the repository")
+parser.add_argument("--includes", metavar="N", type=int, default=20, help="the number of back up sessions (one per include)")
+parser.add_argument("--files", metavar="N", type=int, default=500, help="the number of files backed up per include")
+parser.add_argument("--new_fraction", metavar="F", type=float, default=0.1, help="the fraction of files with new content")
+parser.add_argument("--seed", metavar="N", type=int, default=42, help="the seed for the random number generator")
+
+args = parser.parse_args()
+
+def new_token():
+    # NB: from the (seeded) random number generator so that the workloads are repeatable
+    return "{:040x}".format(random.getrandbits(160))
+
+def build_index(index_path, num_items):
+    cindex.create_index(index_path)
+    citem_index = cindex.open_index(index_path, True)
+    tokens = [new_token() for _ in range(num_items)]
+    for token in tokens:
+        citem_index.add(token, 1, 1024, 1024)
+    citem_index.close()
+    return tokens
+
+def back_up(index_path, tokens, use_totals):
+    # NB: returns the time taken by the item statistics and their values
+    stats_time = 0.0
+    created = 0
+    for _ in range(args.includes):
+        citem_index = cindex.open_index(index_path, True)
+        start = time.perf_counter()
+        start_counts = citem_index.get_counts() if use_totals else None
+        stats_time += time.perf_counter() - start
+        for _ in range(args.files):
+            if random.random() < args.new_fraction:
+                citem_index.add(new_token(), 1, 1024, 1024)
+            else:
+                citem_index.incr_ref_count(random.choice(tokens))
+        start = time.perf_counter()
+        if use_totals:
+            end_counts = citem_index.get_counts()
+            created += sum(end_counts[:-1]) - sum(start_counts[:-1])
+        else:
+            created += citem_index.get_session_counts().created
+        stats_time += time.perf_counter() - start
+        citem_index.close()
+    return (stats_time, created)
+
+print("{:>9} {:>14} {:>12} {:>14} {:>10}".format("Items", "Method", "Stats(s)", "Per include(ms)", "Created"))
+for num_items in args.items:
+    dir_path = tempfile.mkdtemp()
+    try:
+        template_path = os.path.join(dir_path, "template.db")
+        random.seed(args.seed)
+        tokens = build_index(template_path, num_items)
+        results = []
+        for name, use_totals in [("index_totals", True), ("session_counts", False)]:
+            # NB: each method starts from the same index with the same workload
+            # (seeded differently to the index so that new tokens are new)
+            index_path = os.path.join(dir_path, name + ".db")
+            shutil.copyfile(template_path, index_path)
+            random.seed(args.seed + num_items)
+            results.append((name,) + back_up(index_path, tokens, use_totals))
+        assert len(set(created for _name, _stats_time, created in results)) == 1, results
+        for name, stats_time, created in results:
+            print("{:>9} {:>14} {:>12.3f} {:>14.3f} {:>10}".format(num_items, name, stats_time, stats_time * 1000 / args.includes, created))
+    finally:
+        shutil.rmtree(dir_path)
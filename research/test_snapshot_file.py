@@ -0,0 +1,76 @@
+### Copyright (C) 2016 Peter Williams <pwil3058@gmail.com>
+###
+### This program is free software; you can redistribute it and/or modify
+### it under the terms of the GNU General Public License as published by
+### the Free Software Foundation; version 2 of the License only.
+###
+### This program is distributed in the hope that it will be useful,
+### but WITHOUT ANY WARRANTY; without even the implied warranty of
+### MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+### GNU General Public License for more details.
+###
+### You should have received a copy of the GNU General Public License
+### along with this program; if not, write to the Free Software
+### Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+import os
+import sys
+import time
+import argparse
+import gzip
+import pickle
+import shutil
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from epygibus_pkg import snapshot
+
+parser = argparse.ArgumentParser(description="Compare the cost of listing one directory of a snapshot when it is stored as a pickle and in the columnar snapshot file format.")
+parser.add_argument("--files", metavar="N", type=int, nargs="+", default=[10000, 100000, 1000000], help="the numbers of files in the snapshot")
+parser.add_argument("--per_dir", metavar="N", type=int, default=100, help="the number of files per directory")
+parser.add_argument("--fan_out", metavar="N", type=int, default=10, help="the number of subdirectories per directory")
+parser.add_argument("--compress", action="store_true", help="compress the snapshot files")
+
+args = parser.parse_args()
+
+ATTRS = snapshot.get_attr_tuple(__file__)
+
+def build_snapshot(num_files):
+    root = snapshot.Snapshot(None, ATTRS)
+    dirs = [root]
+    index = 0
+    count = 0
+    while count < num_files:
+        parent = dirs[index // args.fan_out]
+        subdir = parent._add_subdir("d{}".format(index), ATTRS)
+        dirs.append(subdir)
+        for i in range(min(args.per_dir, num_files - count)):
+            subdir.set_file("f{}".format(i), (ATTRS, count.to_bytes(20, "big")))
+            count += 1
+        index += 1
+    return (snapshot.SnapshotPlus(root, (num_files, 0, 0, 0, 0, (0.0, 0.0, 0.0)), ("", "", "", True)), dirs[-1])
+
+def time_listing(file_path, path):
+    start = time.perf_counter()
+    snapshot_plus = snapshot.read_snapshot(file_path)
+    files = snapshot_plus.snapshot.find_dir(path).files
+    assert len(files) > 0
+    return time.perf_counter() - start
+
+print("{:>9} {:>10} {:>12} {:>12}".format("Files", "Format", "Size(Mb)", "Listing(s)"))
+for num_files in args.files:
+    dir_path_name = tempfile.mkdtemp()
+    try:
+        snapshot_plus, deepest = build_snapshot(num_files)
+        path = deepest.path
+        pkl_path = os.path.join(dir_path_name, "2016-01-01-00-00-00.pkl" + (".gz" if args.compress else ""))
+        with (gzip.open if args.compress else open)(pkl_path, "wb") as f_obj:
+            pickle.dump(snapshot_plus, f_obj, pickle.HIGHEST_PROTOCOL)
+        snap_path = os.path.join(dir_path_name, "2016-01-01-00-00-00.snap")
+        snapshot._write_columnar_snapshot(snap_path, snapshot_plus, args.compress)
+        del snapshot_plus, deepest
+        for name, file_path in [("pickle", pkl_path), ("columnar", snap_path)]:
+            print("{:>9} {:>10} {:>12.3f} {:>12.4f}".format(num_files, name, os.path.getsize(file_path) / 1000000, time_listing(file_path, path)))
+    finally:
+        shutil.rmtree(dir_path_name)
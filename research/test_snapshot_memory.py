@@ -0,0 +1,116 @@
+### Copyright (C) 2016 Peter Williams <pwil3058@gmail.com>
+###
+### This program is free software; you can redistribute it and/or modify
+### it under the terms of the GNU General Public License as published by
+### the Free Software Foundation; version 2 of the License only.
+###
+### This program is distributed in the hope that it will be useful,
+### but WITHOUT ANY WARRANTY; without even the implied warranty of
+### MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+### GNU General Public License for more details.
+###
+### You should have received a copy of the GNU General Public License
+### along with this program; if not, write to the Free Software
+### Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+import os
+import sys
+import gc
+import time
+import argparse
+import shutil
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from epygibus_pkg import snapshot
+
+parser = argparse.ArgumentParser(description="Compare the memory (measured with tracemalloc) needed to hold a snapshot tree using plain (dict based) nodes with tuple attributes and hex content tokens and the compact Snapshot nodes with packed attributes and bytes content tokens and to load a fully walked columnar snapshot file.")
+parser.add_argument("--files", metavar="N", type=int, nargs="+", default=[10000, 100000, 1000000], help="the numbers of files in the snapshot")
+parser.add_argument("--per_dir", metavar="N", type=int, default=10, help="the number of files per directory")
+parser.add_argument("--fan_out", metavar="N", type=int, default=10, help="the number of subdirectories per directory")
+
+args = parser.parse_args()
+
+class PlainSnapshot:
+    # NB: the Snapshot node as it was
+    def __init__(self, parent=None, attributes=None):
+        self.parent = parent
+        self.attributes = attributes
+        self.subdirs = {}
+        self.files = {}
+        self.file_links = {}
+        self.subdir_links = {}
+
+def get_attrs(index):
+    # NB: distinct values (as in a real file system) so ints aren't shared
+    return (0o100644, 1000000 + index, 2049, 1, 1000, 1000, 4096 + index, 1400000000 + index, 1400000000 + index, 1400000000 + index)
+
+def build_plain(num_files):
+    root = PlainSnapshot(None, get_attrs(0))
+    dirs = [root]
+    index = count = 0
+    while count < num_files:
+        parent = dirs[index // args.fan_out]
+        subdir = parent.subdirs["d{}".format(index)] = PlainSnapshot(parent, get_attrs(index))
+        dirs.append(subdir)
+        for i in range(min(args.per_dir, num_files - count)):
+            subdir.files["file{}.txt".format(i)] = (get_attrs(count), "{:040x}".format(count))
+            count += 1
+        index += 1
+    return root
+
+def build_compact(num_files):
+    root = snapshot.Snapshot(None, snapshot.PackedAttrs(get_attrs(0)))
+    dirs = [root]
+    index = count = 0
+    while count < num_files:
+        parent = dirs[index // args.fan_out]
+        subdir = parent._add_subdir("d{}".format(index), snapshot.PackedAttrs(get_attrs(index)))
+        dirs.append(subdir)
+        for i in range(min(args.per_dir, num_files - count)):
+            subdir.set_file("file{}.txt".format(i), (snapshot.PackedAttrs(get_attrs(count)), bytes.fromhex("{:040x}".format(count))))
+            count += 1
+        index += 1
+    return root
+
+def walk(snapshot_dir):
+    count = len(snapshot_dir.files)
+    for subdir in snapshot_dir.subdirs.values():
+        count += walk(subdir)
+    return count
+
+def measure(function, *fargs):
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = function(*fargs)
+    elapsed = time.perf_counter() - start
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return (result, size, elapsed)
+
+def load_walked(file_path):
+    snapshot_plus = snapshot.read_snapshot(file_path)
+    walk(snapshot_plus.snapshot)
+    return snapshot_plus
+
+print("{:>9} {:>16} {:>12} {:>14} {:>10}".format("Files", "Nodes", "Memory(Mb)", "Per file(b)", "Time(s)"))
+for num_files in args.files:
+    for name, build in [("plain", build_plain), ("compact", build_compact)]:
+        root, size, elapsed = measure(build, num_files)
+        print("{:>9} {:>16} {:>12.1f} {:>14.1f} {:>10.2f}".format(num_files, name, size / 1000000, size / num_files, elapsed))
+        if build is build_compact:
+            dir_path = tempfile.mkdtemp()
+            try:
+                file_path = os.path.join(dir_path, "snapshot.snap")
+                snapshot._write_columnar_snapshot(file_path, snapshot.SnapshotPlus(root, (num_files, 0, 0, 0, 0, (0.0, 0.0, 0.0)), ("", "", "", True)), False)
+                del root
+                snapshot_plus, size, elapsed = measure(load_walked, file_path)
+                print("{:>9} {:>16} {:>12.1f} {:>14.1f} {:>10.2f}".format(num_files, "loaded (walked)", size / 1000000, size / num_files, elapsed))
+                del snapshot_plus
+            finally:
+                shutil.rmtree(dir_path)
+        else:
+            del root